@@ -0,0 +1,207 @@
+"""os_operations.process benchmark suite
+
+Measures the process table lookups of pybenutils.os_operations.process on the current host and writes the results
+as json. Use --processes to spawn idle "sleep" processes until the host runs at least that many processes (in a
+tree of --tree_depth levels, to exercise the tree walks), so the numbers are comparable between hosts.
+
+> python benchmarks/process_benchmark.py --processes 2000 --repeat 20 -o process_benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import platform
+import argparse
+import subprocess
+import psutil
+from pybenutils.os_operations.process import ProcessChangeFeed, ProcessHandler, ProcessMonitor, ProcessQuery, \
+    ProcessSnapshot, get_all_running_processes
+from pybenutils.network.transfer_metrics import get_percentiles
+
+SLEEP_SECONDS = 3600
+
+
+def spawn_idle_processes(count: int, tree_depth: int) -> list:
+    """Spawn idle processes. With a tree depth above 1, each spawned process is a shell holding a chain of
+     tree_depth - 1 sleeping descendants
+
+    :param count: Number of processes to add
+    :param tree_depth: Levels of every spawned tree
+    :return: List of the spawned root Popen objects
+    """
+    sleep_path = shutil.which('sleep')
+    if not sleep_path:
+        raise RuntimeError('The "sleep" binary is required to spawn the benchmark processes')
+    chain = f'{sleep_path} {SLEEP_SECONDS}'
+    for _ in range(tree_depth - 1):
+        chain = f'sh -c {shlex.quote(chain + "; true")}'  # The trailing command keeps each shell from exec-ing
+    return [subprocess.Popen(shlex.split(chain), start_new_session=True) for _ in range(max(count // tree_depth, 0))]
+
+
+def stop_processes(roots: list):
+    """Kill the spawned trees (each tree is its own session / process group)"""
+    for root in roots:
+        try:
+            os.killpg(root.pid, 9)
+        except OSError:
+            pass
+    for root in roots:
+        root.wait()
+
+
+def measure(scenario: str, variant: str, func, repeat: int, ops=1) -> dict:
+    """Run func repeat times and return the result dict of the scenario"""
+    latencies = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start_time)
+    seconds = sum(latencies)
+    result = {'scenario': scenario, 'variant': variant, 'repeat': repeat, 'ops': ops, 'seconds': seconds,
+              'seconds_per_op': seconds / (ops * repeat), 'latency': get_percentiles(latencies)}
+    print(f'{scenario:<24} {variant:<28} {seconds:8.3f}s {result["seconds_per_op"] * 1000:10.3f} ms/op')
+    return result
+
+
+def legacy_get_child_names(process_name: str) -> list:
+    """The process_iter() + p.parent().name() per process children lookup, kept as the comparison baseline"""
+    names = []
+    for p in psutil.process_iter():
+        try:
+            if process_name.lower() == p.parent().name().lower():
+                names.append(p.name())
+        except Exception:
+            pass
+    return names
+
+
+def run_benchmarks(args) -> list:
+    """Run all the scenarios
+
+    :return: List of result dicts
+    """
+    results = []
+    lookups = args.lookups
+    names = ['sleep', 'sh', 'python', 'not_running_process']
+    results.append(measure('snapshot', 'full_attrs', lambda: ProcessSnapshot(), args.repeat))
+    results.append(measure('snapshot', 'pid_ppid_name', lambda: ProcessSnapshot(attrs=()), args.repeat))
+
+    def _handler_name_lookups():
+        for index in range(lookups):
+            ProcessHandler.get_processes_by_name(names[index % len(names)])
+
+    def _snapshot_name_lookups():
+        snapshot = ProcessSnapshot(attrs=())
+        for index in range(lookups):
+            snapshot.get_processes_by_name(names[index % len(names)])
+
+    results.append(measure('name_lookups', 'get_processes_by_name', _handler_name_lookups, args.repeat,
+                           ops=lookups))
+    results.append(measure('name_lookups', 'one_snapshot', _snapshot_name_lookups, args.repeat, ops=lookups))
+
+    results.append(measure('children_lookup', 'legacy_parent_name', lambda: legacy_get_child_names('sh'),
+                           args.repeat))
+    results.append(measure('children_lookup', 'child_process_name_list',
+                           lambda: ProcessHandler('sh').get_processes_child_process_name_list(), args.repeat))
+
+    own_pid = os.getpid()
+    results.append(measure('tree_walk', 'psutil_children_recursive',
+                           lambda: psutil.Process(own_pid).children(recursive=True), args.repeat))
+    results.append(measure('tree_walk', 'snapshot_walk_tree',
+                           lambda: list(ProcessSnapshot(attrs=()).walk_tree(own_pid)), args.repeat))
+
+    tokens = [str(SLEEP_SECONDS), 'sleep', '-c', 'not_running_token']
+
+    def _legacy_cmdline_lookups():
+        for index in range(lookups):
+            token = tokens[index % len(tokens)]
+            [p for p in psutil.process_iter(['cmdline'], ad_value=None) if p.info['cmdline'] and
+             token in p.info['cmdline']]
+
+    def _snapshot_cmdline_lookups():
+        snapshot = ProcessSnapshot()
+        for index in range(lookups):
+            snapshot.get_pids_by_cmdline_token(tokens[index % len(tokens)])
+
+    results.append(measure('cmdline_lookups', 'legacy_process_iter', _legacy_cmdline_lookups, args.repeat,
+                           ops=lookups))
+    results.append(measure('cmdline_lookups', 'snapshot_token_index', _snapshot_cmdline_lookups, args.repeat,
+                           ops=lookups))
+
+    def _legacy_condition(p):
+        return 'not_running_token' in ' '.join(p.cmdline()) and p.name() == 'sleep'
+
+    def _legacy_condition_scan():
+        for p in psutil.process_iter():
+            try:
+                _legacy_condition(p)
+            except psutil.Error:
+                pass
+
+    query = ProcessQuery(name='sleep', cmdline_contains='not_running_token')
+    results.append(measure('process_query', 'lambda_condition', _legacy_condition_scan, args.repeat))
+    results.append(measure('process_query', 'compiled_query', query.find, args.repeat))
+
+    def _rss_by_name_dicts():
+        rss_by_name = {}
+        for info in get_all_running_processes(('name', 'memory_info')):
+            if info['memory_info']:
+                rss_by_name[info['name']] = rss_by_name.get(info['name'], 0) + info['memory_info'].rss
+        return rss_by_name
+
+    results.append(measure('rss_by_name', 'process_dicts', _rss_by_name_dicts, args.repeat))
+    results.append(measure('rss_by_name', 'columnar_group_by', lambda: get_all_running_processes(
+        ('name', 'rss'), columnar=True).group_by('name', 'rss'), args.repeat))
+
+    watched_names = [names[index % len(names)] for index in range(lookups)]
+    results.append(measure('watchers', f'{lookups}_process_exists_polls',
+                           lambda: [ProcessHandler(name).process_exists() for name in watched_names], args.repeat))
+    feed = ProcessChangeFeed(interval=3600)  # Polled by the scenario only
+    tokens = [feed.subscribe(lambda event: None, process_name=name) for name in watched_names]
+    results.append(measure('watchers', f'{lookups}_change_feed_subscribers', feed.poll, args.repeat))
+    for token in tokens:
+        feed.unsubscribe(token)
+
+    monitor = ProcessMonitor(process_name='sleep', samples=args.repeat)
+    monitored = len(monitor.processes)
+    results.append(measure('monitor_sample', f'{monitored}_sleep_processes', monitor.sample, args.repeat,
+                           ops=max(monitored, 1)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='os_operations.process benchmark suite')
+    parser.add_argument('-p', '--processes', type=int, default=2000,
+                        help='Spawn idle processes until the host runs at least this many. 0 to spawn none')
+    parser.add_argument('-d', '--tree_depth', type=int, default=3, help='Levels of every spawned process tree')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='Runs of each scenario')
+    parser.add_argument('-l', '--lookups', type=int, default=20, help='Name lookups per run')
+    parser.add_argument('-o', '--output', default='process_benchmark.json', help='Output json file path')
+    args = parser.parse_args()
+
+    roots = spawn_idle_processes(args.processes - len(psutil.pids()), args.tree_depth)
+    try:
+        time.sleep(1)  # Let the spawned trees settle
+        processes_count = len(psutil.pids())
+        print(f'Running with {processes_count} processes')
+        results = run_benchmarks(args)
+    finally:
+        stop_processes(roots)
+
+    try:
+        from importlib.metadata import version
+        package_version = version('pybenutils')
+    except Exception:
+        package_version = 'unknown'
+    report = {'suite': 'process', 'version': package_version, 'time': time.time(), 'python': sys.version,
+              'platform': platform.platform(), 'psutil': psutil.__version__, 'processes': processes_count,
+              'args': vars(args), 'results': results}
+    with open(args.output, 'w') as out_file:
+        out_file.write(json.dumps(report, indent=4, default=str))
+    print(f'Results were written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
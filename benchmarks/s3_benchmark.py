@@ -0,0 +1,220 @@
+"""S3BucketManager benchmark suite
+
+Runs upload, download, listing, copy and delete scenarios against a local S3 compatible server and writes the
+results as json, so runs can be compared across releases.
+By default an in-process moto server is started (python -m pip install "moto[server]").
+Use --endpoint to run against any other S3 compatible server (e.g. minio).
+
+> python benchmarks/s3_benchmark.py --threads 1 5 20 --part_sizes 5 16 -o s3_benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import random
+import platform
+import argparse
+import tempfile
+from multiprocessing.dummy import Pool as ThreadPool
+from boto.s3.connection import S3Connection, OrdinaryCallingFormat
+from pybenutils.network.s3_bucket_cls import S3BucketManager
+from pybenutils.network.transfer_metrics import TransferMetrics
+
+ACCESS_KEY = 'benchmark'
+SECRET_KEY = 'benchmark'
+LOG_WORDS = ['INFO', 'DEBUG', 'ERROR', 'request', 'response', 'user', 'session', 'took', 'ms', 'status', 'id']
+
+
+def get_free_port() -> int:
+    """Returns a free local tcp port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_moto_server():
+    """Start an in-process moto S3 server
+
+    :return: Tuple of (server object, host, port)
+    """
+    from moto.server import ThreadedMotoServer
+    port = get_free_port()
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+    server.start()
+    return server, '127.0.0.1', port
+
+
+def write_log_like_file(file_path: str, size: int, seed: int):
+    """Write a compressible, log like, text file of about the given size"""
+    rnd = random.Random(seed)
+    with open(file_path, 'w') as out_file:
+        written = 0
+        while written < size:
+            line = f'{time.time():.6f} {" ".join(rnd.choices(LOG_WORDS, k=8))} {rnd.randint(0, 10 ** 9)}\n'
+            out_file.write(line)
+            written += len(line)
+
+
+def create_dataset(root_dir: str, small_files: int, small_size: int, huge_files: int, huge_size: int):
+    """Create the local files to upload
+
+    :return: Tuple of (small files dir, huge files dir)
+    """
+    small_dir = os.path.join(root_dir, 'small')
+    huge_dir = os.path.join(root_dir, 'huge')
+    os.makedirs(small_dir)
+    os.makedirs(huge_dir)
+    rnd = random.Random(0)
+    for index in range(small_files):
+        with open(os.path.join(small_dir, f'file_{index}.bin'), 'wb') as out_file:
+            out_file.write(rnd.randbytes(small_size) if hasattr(rnd, 'randbytes') else os.urandom(small_size))
+    for index in range(huge_files):
+        write_log_like_file(os.path.join(huge_dir, f'huge_{index}.log'), huge_size, seed=index)
+    return small_dir, huge_dir
+
+
+def get_dir_size(dir_path: str) -> int:
+    """Returns the total size of the files in the given directory"""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(dir_path) for name in files)
+
+
+def run_scenario(name, func, threads, part_size, files_count, bytes_count, metrics: TransferMetrics) -> dict:
+    """Run a single benchmark scenario and return its result dict
+
+    :param part_size: Part size the scenario ran with, None if it does not use multipart requests
+    :param files_count: Number of objects the scenario handles. None to count the list func returns
+    """
+    start_time = time.perf_counter()
+    returned = func()
+    seconds = time.perf_counter() - start_time
+    if files_count is None:
+        files_count = len(returned)
+    stats = metrics.summary()['operations']
+    metrics.reset()
+    result = {'scenario': name, 'threads': threads, 'part_size': part_size, 'files': files_count,
+              'bytes': bytes_count, 'seconds': seconds,
+              'throughput': bytes_count / seconds if seconds else 0,
+              'objects_per_second': files_count / seconds if seconds else 0,
+              'metrics': stats}
+    part_size_text = f'{part_size // 1024 ** 2}MB' if part_size else '-'
+    print(f'{name:<24} threads={threads:<3} part_size={part_size_text:<5} {seconds:8.3f}s '
+          f'{result["throughput"] / 1024 ** 2:8.2f} MB/s {result["objects_per_second"]:8.1f} obj/s')
+    return result
+
+
+def run_benchmarks(manager: S3BucketManager, metrics: TransferMetrics, work_dir: str, small_dir: str,
+                   huge_dir: str, threads_list, part_sizes) -> list:
+    """Run all the scenarios for every combination of thread count and part size. The part size applies to the
+     compressed uploads (multipart above it) and to the copies of objects above MULTIPART_COPY_THRESHOLD, the
+     other scenarios record it as None
+
+    :return: List of result dicts
+    """
+    results = []
+    small_count = len(os.listdir(small_dir))
+    huge_count = len(os.listdir(huge_dir))
+    small_bytes = get_dir_size(small_dir)
+    huge_bytes = get_dir_size(huge_dir)
+    huge_multipart_copy = any(os.path.getsize(os.path.join(huge_dir, name)) >= S3BucketManager.MULTIPART_COPY_THRESHOLD
+                              for name in os.listdir(huge_dir))
+    for threads in threads_list:
+        for part_size in part_sizes:
+            S3BucketManager.UPLOAD_THREADS_NUM = threads
+            S3BucketManager.DOWNLOAD_THREADS_NUM = threads
+            S3BucketManager.COPY_THREADS_NUM = threads
+            S3BucketManager.MULTIPART_CHUNK_SIZE = part_size
+            S3BucketManager.MULTIPART_COPY_PART_SIZE = part_size
+            prefix = f'bench_t{threads}_p{part_size}'
+            download_dir = os.path.join(work_dir, f'download_{prefix}')
+
+            def _delete_prefix():
+                key_names = manager.get_s3_folder_content(f'{prefix}/')
+                pool = ThreadPool(threads)
+                try:
+                    pool.map(manager.delete_key_from_bucket, key_names)
+                finally:
+                    pool.close()
+                    pool.join()
+                return key_names
+
+            # Name, func, uses the part size, objects count (None to count the returned list), bytes count
+            scenarios = [
+                ('upload_small_files', lambda: manager.upload(small_dir, f'{prefix}/small'), False, small_count,
+                 small_bytes),
+                ('upload_huge_files', lambda: manager.upload(huge_dir, f'{prefix}/huge'), False, huge_count,
+                 huge_bytes),
+                ('upload_huge_gzip', lambda: manager.upload(huge_dir, f'{prefix}/huge_gzip', compression='gzip'),
+                 True, huge_count, huge_bytes),
+                ('list_prefix', lambda: manager.get_s3_folder_content(f'{prefix}/'), False, None, 0),
+                ('download_small_files', lambda: manager.download(f'{prefix}/small', download_dir), False,
+                 small_count, small_bytes),
+                ('download_huge_files', lambda: manager.download(f'{prefix}/huge', download_dir), False,
+                 huge_count, huge_bytes),
+                ('download_huge_gzip', lambda: manager.download(f'{prefix}/huge_gzip', download_dir), False,
+                 huge_count, huge_bytes),
+                ('server_side_copy', lambda: manager.copy_prefix(f'{prefix}/huge/', f'{prefix}/copy/'),
+                 huge_multipart_copy, huge_count, huge_bytes),
+                ('delete_prefix', _delete_prefix, False, None, 0),
+            ]
+            for name, func, uses_part_size, files_count, bytes_count in scenarios:
+                results.append(run_scenario(name, func, threads, part_size if uses_part_size else None,
+                                            files_count, bytes_count, metrics))
+            shutil.rmtree(download_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='S3BucketManager benchmark suite')
+    parser.add_argument('-e', '--endpoint', default='', help='host:port of an S3 compatible server. '
+                                                             'Default: start a local moto server')
+    parser.add_argument('-b', '--bucket', default='pybenutils-benchmark', help='Bucket name')
+    parser.add_argument('-t', '--threads', nargs='+', type=int, default=[1, 5, 20], help='Thread counts to test')
+    parser.add_argument('-p', '--part_sizes', nargs='+', type=int, default=[8],
+                        help='Part sizes to test in MB (compressed uploads and multipart copies)')
+    parser.add_argument('--small_files', type=int, default=200, help='Number of small files')
+    parser.add_argument('--small_size', type=int, default=4, help='Small file size in KB')
+    parser.add_argument('--huge_files', type=int, default=2, help='Number of huge files')
+    parser.add_argument('--huge_size', type=int, default=64, help='Huge file size in MB')
+    parser.add_argument('-o', '--output', default='s3_benchmark.json', help='Output json file path')
+    args = parser.parse_args()
+
+    server = None
+    if args.endpoint:
+        host, port = args.endpoint.rsplit(':', 1)
+        port = int(port)
+    else:
+        server, host, port = start_moto_server()
+    connection_kwargs = {'host': host, 'port': port, 'is_secure': False, 'calling_format': OrdinaryCallingFormat()}
+    work_dir = tempfile.mkdtemp(prefix='s3_benchmark_')
+    try:
+        conn = S3Connection(aws_access_key_id=ACCESS_KEY, aws_secret_access_key=SECRET_KEY, **connection_kwargs)
+        if not conn.lookup(args.bucket):
+            conn.create_bucket(args.bucket)
+        metrics = TransferMetrics(exporters=[])
+        manager = S3BucketManager(ACCESS_KEY, SECRET_KEY, args.bucket, metrics=metrics, **connection_kwargs)
+        small_dir, huge_dir = create_dataset(work_dir, args.small_files, args.small_size * 1024,
+                                             args.huge_files, args.huge_size * 1024 ** 2)
+        results = run_benchmarks(manager, metrics, work_dir, small_dir, huge_dir, args.threads,
+                                 [part_size * 1024 ** 2 for part_size in args.part_sizes])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if server:
+            server.stop()
+
+    try:
+        from importlib.metadata import version
+        package_version = version('pybenutils')
+    except Exception:
+        package_version = 'unknown'
+    report = {'suite': 's3', 'version': package_version, 'time': time.time(), 'python': sys.version,
+              'platform': platform.platform(), 'endpoint': args.endpoint or 'moto', 'args': vars(args),
+              'results': results}
+    with open(args.output, 'w') as out_file:
+        out_file.write(json.dumps(report, indent=4, default=str))
+    print(f'Results were written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
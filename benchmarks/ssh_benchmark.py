@@ -0,0 +1,482 @@
+"""SSH helpers benchmark suite
+
+Starts an in-process paramiko SSH/SFTP server (exec requests run as local shell commands, the sftp subsystem serves
+the local filesystem) and measures connect latency, per command overhead, parallel fan-out scaling and file transfer
+throughput, comparing the run_commands / SshHelper modes. The results are written as json.
+The fan-out scenario binds the server to 127.0.0.N loopback addresses, which works out of the box on Linux.
+The scp scenarios need the scp binary, which serves the remote side of the protocol.
+Prefetched sftp downloads from paramiko's own sftp server occasionally stall for a few seconds (paramiko's
+SFTPClient.get does the same against it), so compare the transfers by their latency p50 rather than the total.
+
+> python benchmarks/ssh_benchmark.py --commands 50 --fan_out 1 4 16 --large_size 64 -o ssh_benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import socket
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import paramiko
+from pybenutils.network.ssh_helper import SshHelper
+from pybenutils.network.ssh_pool import default_pool
+from pybenutils.network.ssh_utils import connect, run_commands, run_commands_batch, run_commands_on_hosts
+from pybenutils.network.transfer_metrics import get_percentiles
+
+USERNAME = 'benchmark'
+PASSWORD = 'benchmark'
+CONNECT_KWARGS = {'look_for_keys': False, 'allow_agent': False}
+
+
+class LocalSftpHandle(paramiko.SFTPHandle):
+    """Sftp file handle over a local file"""
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+    def chattr(self, attr):
+        try:
+            if attr._flags & attr.FLAG_SIZE:
+                # SFTPServer.set_file_attr truncates by reopening the file with 'w+', which empties it first
+                self.writefile.flush()
+                os.ftruncate(self.writefile.fileno(), attr.st_size)
+                attr._flags &= ~attr.FLAG_SIZE
+            paramiko.SFTPServer.set_file_attr(self.filename, attr)
+            return paramiko.SFTP_OK
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+
+class LocalSftpServer(paramiko.SFTPServerInterface):
+    """Sftp subsystem serving the local filesystem (remote paths are local absolute paths)"""
+
+    def list_folder(self, path):
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), getattr(attr, 'st_mode', None) or 0o666)
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = LocalSftpHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.replace, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        return self._call(paramiko.SFTPServer.set_file_attr, path, attr)
+
+    def symlink(self, target_path, path):
+        return self._call(os.symlink, target_path, path)
+
+    def readlink(self, path):
+        try:
+            return os.readlink(path)
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+    @staticmethod
+    def _call(func, *args):
+        try:
+            func(*args)
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+        return paramiko.SFTP_OK
+
+
+def run_exec_request(channel, command: str, cwd: str):
+    """Run an exec request as a local shell command, pumping the channel to the process pipes"""
+    process = subprocess.Popen(command, shell=True, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+
+    def _pump_input():
+        try:
+            while True:
+                data = channel.recv(32 * 1024)
+                if not data:
+                    break
+                process.stdin.write(data)
+                process.stdin.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def _pump_output(pipe, send):
+        while True:
+            data = os.read(pipe.fileno(), 32 * 1024)
+            if not data:
+                break
+            send(data)
+
+    threading.Thread(target=_pump_input, daemon=True).start()
+    stderr_thread = threading.Thread(target=_pump_output, args=(process.stderr, channel.sendall_stderr), daemon=True)
+    stderr_thread.start()
+    _pump_output(process.stdout, channel.sendall)
+    stderr_thread.join()
+    channel.send_exit_status(process.wait())
+    channel.shutdown_write()
+    # The exec request reply is sent only after check_channel_exec_request returned. Closing the channel before it
+    # went out fails the client exec_command, so the client is given the chance to close the channel first
+    for _ in range(100):
+        if channel.closed:
+            break
+        time.sleep(0.01)
+    channel.close()
+
+
+class BenchServerInterface(paramiko.ServerInterface):
+    """Accepts the benchmark user password, session channels, pty and exec requests"""
+
+    def __init__(self, cwd: str):
+        self.cwd = cwd
+
+    def check_auth_password(self, username, password):
+        if username == USERNAME and password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=run_exec_request, args=(channel, command.decode(), self.cwd), daemon=True).start()
+        return True
+
+
+class BenchSshServer(object):
+    """In-process ssh server listening on the same port of one or more loopback addresses"""
+
+    def __init__(self, addresses, cwd: str):
+        self.cwd = cwd
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.running = True
+        self.transports = []
+        self.listeners = []
+        self.port = 0
+        for address in addresses:
+            listener = socket.socket()
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((address, self.port))
+            listener.listen(128)
+            self.port = listener.getsockname()[1]
+            self.listeners.append(listener)
+        for listener in self.listeners:
+            threading.Thread(target=self._accept_loop, args=(listener,), daemon=True).start()
+
+    def _accept_loop(self, listener):
+        while self.running:
+            try:
+                client_socket, _ = listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(client_socket,), daemon=True).start()
+
+    def _serve(self, client_socket):
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Like sshd, no Nagle delays
+        transport = paramiko.Transport(client_socket)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, LocalSftpServer)
+        self.transports.append(transport)
+        try:
+            transport.start_server(server=BenchServerInterface(self.cwd))
+        except Exception:
+            transport.close()
+
+    def stop(self):
+        self.running = False
+        for listener in self.listeners:
+            listener.close()
+        for transport in self.transports:
+            transport.close()
+
+
+def get_loopback_addresses(count: int) -> list:
+    """Returns up to count loopback addresses that can be bound (127.0.0.N)"""
+    addresses = []
+    for index in range(1, count + 1):
+        try:
+            with socket.socket() as sock:
+                sock.bind((f'127.0.0.{index}', 0))
+            addresses.append(f'127.0.0.{index}')
+        except OSError:
+            break
+    return addresses
+
+
+def create_dataset(root_dir: str, small_files: int, small_size: int, large_size: int):
+    """Create the local files to transfer
+
+    :return: Tuple of (small files dir, large file path)
+    """
+    small_dir = os.path.join(root_dir, 'small')
+    os.makedirs(small_dir)
+    for index in range(small_files):
+        with open(os.path.join(small_dir, f'file_{index}.bin'), 'wb') as out_file:
+            out_file.write(os.urandom(small_size))
+    large_file = os.path.join(root_dir, 'large.bin')
+    rnd = random.Random(0)
+    with open(large_file, 'wb') as out_file:
+        for _ in range(large_size // (1024 ** 2)):
+            # Half random half repeated, so the compressed tar modes have something to compress
+            out_file.write(os.urandom(512 * 1024) + bytes([rnd.randint(0, 255)]) * (512 * 1024))
+    return small_dir, large_file
+
+
+def measure(scenario: str, variant: str, func, repeat=1, ops=1, bytes_count=0, **params) -> dict:
+    """Run func repeat times and return the result dict of the scenario
+
+    :param scenario: Scenario name
+    :param variant: The mode that was measured
+    :param func: Callable to measure
+    :param repeat: Number of runs. The latency percentiles are of the single runs
+    :param ops: Number of operations (commands, connections, hosts) done by a single run
+    :param bytes_count: Bytes moved by a single run
+    :return: Result dict
+    """
+    latencies = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start_time)
+    seconds = sum(latencies)
+    result = {'scenario': scenario, 'variant': variant, 'params': params, 'repeat': repeat, 'seconds': seconds,
+              'ops_per_second': ops * repeat / seconds if seconds else 0,
+              'seconds_per_op': seconds / (ops * repeat) if ops else 0,
+              'bytes': bytes_count * repeat, 'throughput': bytes_count * repeat / seconds if seconds else 0,
+              'latency': get_percentiles(latencies)}
+    throughput = f'{result["throughput"] / 1024 ** 2:8.2f} MB/s' if bytes_count else ''
+    print(f'{scenario:<20} {variant:<28} {seconds:8.3f}s {result["seconds_per_op"] * 1000:9.2f} ms/op {throughput}')
+    return result
+
+
+def check_responses(responses):
+    """Fail the benchmark if a command failed, so broken modes are not reported as fast"""
+    for response in responses:
+        if response['exit_status'] != 0:
+            raise RuntimeError(f'Benchmark command failed: {response}')
+
+
+def run_connection_benchmarks(host: str, port: int, args) -> list:
+    """Connect latency and per command overhead scenarios"""
+    results = []
+    kwargs = dict(CONNECT_KWARGS, port=port)
+    commands = ['true'] * args.commands
+    results.append(measure('connect', 'new_connection', lambda: connect(host, USERNAME, PASSWORD, **kwargs).close(),
+                           repeat=args.repeat))
+    default_pool.release(default_pool.acquire(host, USERNAME, PASSWORD, **kwargs))
+    results.append(measure('connect', 'pool_lease',
+                           lambda: default_pool.release(default_pool.acquire(host, USERNAME, PASSWORD, **kwargs)),
+                           repeat=args.repeat))
+    default_pool.close_all()
+
+    for variant, func in [
+        ('run_commands', lambda: run_commands(host, USERNAME, PASSWORD, commands, use_pool=False, **kwargs)),
+        ('run_commands_channels_8', lambda: run_commands(host, USERNAME, PASSWORD, commands, max_channels=8,
+                                                         use_pool=False, **kwargs)),
+        ('run_commands_batch', lambda: run_commands_batch(host, USERNAME, PASSWORD, commands, use_pool=False,
+                                                          **kwargs)),
+    ]:
+        results.append(measure('command_overhead', variant, lambda: check_responses(func()), repeat=args.repeat,
+                               ops=len(commands), commands=len(commands)))
+
+    helper = SshHelper(host, USERNAME, PASSWORD, use_pool=False)
+    helper.port = port
+    try:
+        results.append(measure('command_overhead', 'ssh_helper_run',
+                               lambda: [helper.run(command) for command in commands], repeat=args.repeat,
+                               ops=len(commands), commands=len(commands)))
+    finally:
+        helper.close()
+
+    for use_pool in (False, True):
+        results.append(measure('repeated_calls', f'run_commands_pool_{use_pool}'.lower(),
+                               lambda: check_responses(run_commands(host, USERNAME, PASSWORD, ['true'],
+                                                                    use_pool=use_pool, **kwargs)),
+                               repeat=args.commands, ops=1))
+    default_pool.close_all()
+    return results
+
+
+def run_fan_out_benchmarks(addresses: list, port: int, args) -> list:
+    """Parallel fan-out scaling scenarios"""
+    results = []
+    for hosts_count in args.fan_out:
+        if hosts_count > len(addresses):
+            print(f'Skipping fan-out to {hosts_count} hosts, only {len(addresses)} loopback addresses are available')
+            continue
+        hosts = [dict(CONNECT_KWARGS, server=address, username=USERNAME, password=PASSWORD, port=port)
+                 for address in addresses[:hosts_count]]
+
+        def _fan_out(use_pool):
+            for server, result in run_commands_on_hosts(hosts, ['true', 'uname -a'], max_workers=hosts_count,
+                                                        use_pool=use_pool).items():
+                if result['status'] != 'success':
+                    raise RuntimeError(f'Fan-out to {server} failed: {result}')
+
+        for use_pool in (False, True):
+            results.append(measure('fan_out', f'hosts_{hosts_count}_pool_{use_pool}'.lower(),
+                                   lambda: _fan_out(use_pool), repeat=args.repeat, ops=hosts_count,
+                                   hosts=hosts_count))
+        default_pool.close_all()
+    return results
+
+
+def run_transfer_benchmarks(host: str, port: int, work_dir: str, small_dir: str, large_file: str, args) -> list:
+    """File transfer throughput scenarios for every transfer mode"""
+    results = []
+    kwargs = dict(CONNECT_KWARGS, port=port)
+    small_bytes = sum(os.path.getsize(os.path.join(small_dir, name)) for name in os.listdir(small_dir))
+    large_bytes = os.path.getsize(large_file)
+    modes = ['sftp', 'tar', 'tar.gz']
+    if shutil.which('scp'):
+        modes.insert(0, 'scp')
+    else:
+        print('Skipping the scp scenarios, the scp binary is missing')
+
+    for mode in modes:
+        remote_dir = os.path.join(work_dir, f'remote_{mode}')
+        local_dir = os.path.join(work_dir, f'local_{mode}')
+        os.makedirs(remote_dir)
+        os.makedirs(local_dir)
+        remote_large = os.path.join(remote_dir, 'large.bin')
+        scenarios = [
+            ('put_small_files', [f'RECURSIVE-PUT {small_dir} TO {remote_dir}'], len(os.listdir(small_dir)),
+             small_bytes),
+            ('get_small_files', [f'RECURSIVE-GET {os.path.join(remote_dir, "small")} TO {local_dir}'],
+             len(os.listdir(small_dir)), small_bytes),
+        ]
+        if not mode.startswith('tar'):  # The tar modes move single files with sftp
+            scenarios += [('put_large_file', [f'PUT {large_file} TO {remote_large}'], 1, large_bytes),
+                          ('get_large_file', [f'GET {remote_large} TO {local_dir}'], 1, large_bytes)]
+        for scenario, commands, files_count, bytes_count in scenarios:
+            results.append(measure(scenario, mode, lambda: check_responses(
+                run_commands(host, USERNAME, PASSWORD, commands, stop_on_exception=True, transfer_mode=mode,
+                             **kwargs)), repeat=args.transfer_repeat, ops=files_count, bytes_count=bytes_count))
+        shutil.rmtree(local_dir)
+        shutil.rmtree(remote_dir)
+
+    remote_dir = os.path.join(work_dir, 'remote_sync')
+    os.makedirs(remote_dir)
+    sync_commands = [f'RECURSIVE-PUT {small_dir} TO {remote_dir}', f'PUT {large_file} TO {remote_dir}/large.bin']
+    # The unchanged sync sends no file data, so it reports only the time of the no-op check
+    for variant, bytes_count in (('first_sync', small_bytes + large_bytes), ('unchanged_sync_noop_check', 0)):
+        results.append(measure('skip_unchanged', variant, lambda: check_responses(
+            run_commands(host, USERNAME, PASSWORD, sync_commands, stop_on_exception=True, skip_unchanged=True,
+                         **kwargs)), ops=len(os.listdir(small_dir)) + 1, bytes_count=bytes_count))
+    shutil.rmtree(remote_dir)
+
+    helper = SshHelper(host, USERNAME, PASSWORD)
+    helper.port = port
+    remote_large = os.path.join(work_dir, 'helper_large.bin')
+    local_large = os.path.join(work_dir, 'helper_large_back.bin')
+    try:
+        results.append(measure('put_large_file', 'ssh_helper',
+                               lambda: helper.copy_to_remote(large_file, remote_large, keep_connection=True),
+                               repeat=args.transfer_repeat, bytes_count=large_bytes))
+        results.append(measure('get_large_file', 'ssh_helper',
+                               lambda: helper.get_from_remote(remote_large, local_large, keep_connection=True),
+                               repeat=args.transfer_repeat, bytes_count=large_bytes))
+    finally:
+        helper.close()
+    default_pool.close_all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SSH helpers benchmark suite')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs of each connection scenario')
+    parser.add_argument('-t', '--transfer_repeat', type=int, default=3, help='Runs of each transfer scenario')
+    parser.add_argument('-c', '--commands', type=int, default=50, help='Commands per command overhead run')
+    parser.add_argument('-f', '--fan_out', nargs='+', type=int, default=[1, 4, 16], help='Host counts to fan out to')
+    parser.add_argument('--small_files', type=int, default=200, help='Number of small files')
+    parser.add_argument('--small_size', type=int, default=4, help='Small file size in KB')
+    parser.add_argument('--large_size', type=int, default=64, help='Large file size in MB')
+    parser.add_argument('-o', '--output', default='ssh_benchmark.json', help='Output json file path')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='ssh_benchmark_')
+    addresses = get_loopback_addresses(max(args.fan_out))
+    server = BenchSshServer(addresses, cwd=work_dir)
+    try:
+        small_dir, large_file = create_dataset(os.path.join(work_dir, 'dataset'), args.small_files,
+                                               args.small_size * 1024, args.large_size * 1024 ** 2)
+        results = run_connection_benchmarks(addresses[0], server.port, args)
+        results += run_fan_out_benchmarks(addresses, server.port, args)
+        results += run_transfer_benchmarks(addresses[0], server.port, work_dir, small_dir, large_file, args)
+    finally:
+        default_pool.close_all()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    try:
+        from importlib.metadata import version
+        package_version = version('pybenutils')
+    except Exception:
+        package_version = 'unknown'
+    report = {'suite': 'ssh', 'version': package_version, 'time': time.time(), 'python': sys.version,
+              'platform': platform.platform(), 'paramiko': paramiko.__version__, 'args': vars(args),
+              'results': results}
+    with open(args.output, 'w') as out_file:
+        out_file.write(json.dumps(report, indent=4, default=str))
+    print(f'Results were written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
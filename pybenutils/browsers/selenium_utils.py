@@ -23,6 +23,7 @@ from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.wait import WebDriverWait
 
 from pybenutils.browsers.simple_browser_controller_cls import kill_all_browsers
+from pybenutils.os_operations import process_runner
 from pybenutils.os_operations.process import kill_process_by_cmd
 from pybenutils.utils_logger.config_logger import get_logger
 from pybenutils.windows_registry import get_registry_value
@@ -79,7 +80,7 @@ def get_chrome_version():
         # https://stackoverflow.com/questions/44612147/how-to-find-the-chrome-browser-version-using-terminal-in-mac
         try:
             cmd = r'/Applications/Google\ Chrome.app/Contents/MacOS/Google\ Chrome --version'
-            res = subprocess.run(cmd, capture_output=True, text=True, check=True, shell=True)
+            res = process_runner.run(cmd, capture_output=True, text=True, check=True, shell=True, timeout=30)
             chrome_version = res.stdout
             if chrome_version:
                 res = re.search(r'Google Chrome (\d+)\..*', chrome_version)
@@ -104,7 +105,7 @@ def get_edge_chromium_version():
         # https://stackoverflow.com/questions/44612147/how-to-find-the-chrome-browser-version-using-terminal-in-mac
         try:
             cmd = r'/Applications/Microsoft\ Edge.app/Contents/MacOS/Microsoft\ Edge --version'
-            res = subprocess.run(cmd, capture_output=True, text=True, check=True, shell=True)
+            res = process_runner.run(cmd, capture_output=True, text=True, check=True, shell=True, timeout=30)
             edge_version = res.stdout
             if edge_version:
                 res = re.search(r'Microsoft Edge (\d+\.\d+\.\d+\.\d+).*', edge_version)
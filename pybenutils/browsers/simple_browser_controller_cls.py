@@ -8,6 +8,7 @@ from typing import List
 import pyperclip
 from psutil import NoSuchProcess
 from pybenutils.utils_logger.config_logger import get_logger
+from pybenutils.os_operations import process_runner
 from pybenutils.os_operations.process import ProcessHandler
 from pybenutils.os_operations.window_operations import get_hwnds_by_class, click_on_point
 from pybenutils.browsers.windows_browsers_keywords import set_browser_url, close_browser, get_to_home_page, \
@@ -22,7 +23,7 @@ logger = get_logger()
 
 
 def _linux_run(cmd, check=False, capture=True, timeout=10):
-    """Run shell command on Linux and return CompletedProcess.
+    """Run shell command on Linux and return CompletedProcess (a process_runner.RunResult, with the run cost).
 
     :param cmd: list or str command
     :param check: raise on non-zero exit
@@ -30,7 +31,7 @@ def _linux_run(cmd, check=False, capture=True, timeout=10):
     :param timeout: seconds
     """
     try:
-        return subprocess.run(
+        return process_runner.run(
             cmd,
             shell=isinstance(cmd, str),
             check=check,
@@ -1,35 +1,139 @@
+import io
 import os
 import time
+import zlib
 import posixpath
+import mimetypes
 import threading
 from glob import glob
 from boto.s3.key import Key
-from typing import List, Union
+from typing import List, Tuple, Union
 from boto import log as boto_log
 from pybenutils.utils_logger.config_logger import get_logger
 from boto.exception import S3ResponseError
 from boto.s3.connection import S3Connection
 from multiprocessing.dummy import Pool as ThreadPool
+from pybenutils.network.s3_index_cache import S3IndexCache
+from pybenutils.network.transfer_metrics import TransferMetrics
 from pybenutils.os_operations.files_and_directories import get_files_in_folder
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zstd content-encoding is optional, gzip is always available
+
 logger = get_logger()
 lock = threading.Lock()
 boto_log.setLevel('WARNING')  # Added because boto prints passwords
 
+COMPRESSION_MIN_SIZE = 4 * 1024  # Smaller files are not worth the extra request overhead
+COMPRESSION_PROBE_SIZE = 64 * 1024
+COMPRESSIBLE_EXTENSIONS = ('.log', '.txt', '.out', '.err', '.json', '.csv', '.tsv', '.xml', '.html', '.htm', '.md',
+                           '.yaml', '.yml', '.ini', '.cfg', '.conf', '.js', '.css', '.svg', '.sql', '.py', '.dmp',
+                           '.trace')
+INCOMPRESSIBLE_EXTENSIONS = ('.gz', '.tgz', '.zip', '.7z', '.bz2', '.xz', '.zst', '.rar', '.jar', '.whl', '.png',
+                             '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.avi', '.mov', '.pdf', '.dmg',
+                             '.pkg', '.msi', '.apk', '.ipa', '.crx', '.xpi')
+
+
+def choose_compression(file_path: str, compression='auto') -> Tuple[str, int]:
+    """Returns the content-encoding codec and level to use for uploading the given file
+
+    :param file_path: Path of the local file to upload
+    :param compression: 'auto' to pick the codec by heuristics, 'gzip' or 'zstd' to force a codec. Empty for none
+    :return: Tuple of (codec, level). The codec is an empty string if the file should be uploaded as is
+    """
+    if not compression:
+        return '', 0
+    if compression not in ('auto', 'gzip', 'zstd'):
+        raise ValueError(f'Unsupported compression "{compression}". Use "auto", "gzip" or "zstd"')
+    if compression == 'zstd' and not zstandard:
+        raise ImportError('zstd compression requires the "zstandard" package')
+    size = os.path.getsize(file_path)
+    extension = os.path.splitext(file_path)[-1].lower()
+    if compression == 'auto':
+        if size < COMPRESSION_MIN_SIZE or extension in INCOMPRESSIBLE_EXTENSIONS:
+            return '', 0
+        if extension not in COMPRESSIBLE_EXTENSIONS:
+            # Unknown file type - compress a sample to see if it is worth it
+            with open(file_path, 'rb') as sample_file:
+                sample = sample_file.read(COMPRESSION_PROBE_SIZE)
+            if len(zlib.compress(sample, 1)) > len(sample) * 0.9:
+                return '', 0
+        compression = 'zstd' if zstandard else 'gzip'
+    # Spend more cpu on small files, keep the big ones streaming at network speed
+    if size < 16 * 1024 * 1024:
+        level = 9 if compression == 'gzip' else 10
+    elif size < 256 * 1024 * 1024:
+        level = 6 if compression == 'gzip' else 3
+    else:
+        level = 1
+    return compression, level
+
+
+def iter_compressed_chunks(file_path: str, codec: str, level: int, chunk_size=1024 * 1024):
+    """Yields the compressed content of the given file chunk by chunk
+
+    :param file_path: Path of the local file to compress
+    :param codec: 'gzip' or 'zstd'
+    :param level: Compression level
+    :param chunk_size: Size of the chunks read from the file
+    """
+    if codec == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    with open(file_path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(chunk_size), b''):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+def get_decompressor(content_encoding: str):
+    """Returns a streaming decompressor object for the given content-encoding, None if it is not compressed
+
+    :param content_encoding: The Content-Encoding header of the s3 object
+    :return: Object with decompress(data) and flush() methods or None
+    """
+    content_encoding = (content_encoding or '').lower()
+    if content_encoding == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if content_encoding == 'zstd':
+        if not zstandard:
+            raise ImportError('Decompressing zstd objects requires the "zstandard" package')
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
 
 class S3BucketManager(object):
     """A manager that helps with upload and download to/from s3 bucket"""
     DOWNLOAD_THREADS_NUM = 5
     UPLOAD_THREADS_NUM = 5
     DOWNLOAD_ATTEMPTS = 3
+    MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024  # S3 requires at least 5MB for every part except the last one
+    COPY_THREADS_NUM = 10
+    MULTIPART_COPY_THRESHOLD = 1024 * 1024 * 1024  # CopyObject is limited to 5GB, big objects are copied in parts
+    MULTIPART_COPY_PART_SIZE = 256 * 1024 * 1024
 
-    def __init__(self, key, password, bucket_name):
+    def __init__(self, key, password, bucket_name, index_cache_path='', index_cache_max_age=3600,
+                 metrics: TransferMetrics = None, **kwargs):
         """
         :param key: Aws key
         :param password:  Aws password
         :param bucket_name: Bucket name
+        :param index_cache_path: Path of a local SQLite index of the bucket keys (see S3IndexCache). When given,
+         existence checks and folder listings are answered from the index instead of listing the bucket. Names
+         missing from the index are looked up in the bucket, and their folder is listed again on the next sync
+        :param index_cache_max_age: Seconds after which an indexed folder is listed again. Each folder expires on
+         its own and is listed again when a lookup reads it
+        :param metrics: TransferMetrics instance to record every transfer in. The pooled upload and download report
+         the aggregated stats of their batch to its exporters when done
+        :param kwargs: Arguments to pass to S3Connection (e.g. host, port, is_secure and calling_format to work with
+         an S3 compatible server)
         """
-        self.conn = S3Connection(aws_access_key_id=key, aws_secret_access_key=password)
+        self.conn = S3Connection(aws_access_key_id=key, aws_secret_access_key=password, **kwargs)
         self.bucket_name = bucket_name
         try:
             self.bucket_obj = self.conn.get_bucket(self.bucket_name)
@@ -38,26 +142,66 @@ class S3BucketManager(object):
                 raise AssertionError(f'Access denied for bucket "{bucket_name}": {str(conn_err)}')
             else:
                 raise conn_err
+        self.index_cache = None
+        if index_cache_path:
+            self.index_cache = S3IndexCache(self.bucket_obj, index_cache_path, max_age=index_cache_max_age)
+            self.index_cache.sync()
+        self.metrics = metrics
+        self.queue_wait = threading.local()  # Set by the pool wrappers, consumed by the transfer methods
+
+    def _pop_queue_wait(self) -> float:
+        """Returns the queue wait time the pool wrapper set for the current thread transfer, and clears it"""
+        queue_wait = getattr(self.queue_wait, 'value', 0.0)
+        self.queue_wait.value = 0.0
+        return queue_wait
+
+    def _get_index(self, name: str):
+        """Returns the index cache to answer a lookup of the given name from, with the folder of the name synced if
+         it expired. None if there is no index or it does not cover the name"""
+        if not self.index_cache or not self.index_cache.covers(name):
+            return None
+        self.index_cache.sync_if_expired(name)
+        return self.index_cache
 
-    def upload_file(self, source, destination, public=True):
+    def _record_transfer(self, operation, name, size, start_time, retries=0, queue_wait=0.0, success=True):
+        """Record a transfer in the metrics collector, if there is one"""
+        if self.metrics:
+            self.metrics.record(operation, name, size, start_time, retries=retries, queue_wait=queue_wait,
+                                success=success)
+
+    def upload_file(self, source, destination, public=True, compression=''):
         """Upload source to s3 server.
          The uploaded file path will be '{}/{}'.format(destination, os.path.basename(source))
 
         :param source: Path of the local file to upload
         :param destination: Destination dir
         :param public: If we need to set the upload as public
+        :param compression: Content-encoding to compress the file with while streaming it up: 'auto', 'gzip', 'zstd'.
+         Empty for none. 'auto' picks the codec and level by the file extension and size (see choose_compression)
         :return: Uploaded file path within the bucket
         """
+        start_time = time.time()
+        queue_wait = self._pop_queue_wait()
         attempts = S3BucketManager.DOWNLOAD_ATTEMPTS
+        codec, level = choose_compression(source, compression)
+        key_name = posixpath.join(destination, os.path.basename(source.strip()))
         for attempt in range(attempts):
             try:
                 logger.info(f"upload from {source} to {destination}")
-                k = self.bucket_obj.new_key(posixpath.join(destination, os.path.basename(source.strip())))
-                k.set_contents_from_filename(source)
-                if public:
-                    k.make_public()
-                uploaded_file_url = 'http://{bucket}.s3.amazonaws.com/{key}'.format(bucket=self.bucket_name, key=k.key)
+                if codec:
+                    size = self._upload_compressed_file(source, key_name, codec, level, public)
+                else:
+                    k = self.bucket_obj.new_key(key_name)
+                    k.set_contents_from_filename(source)
+                    size = os.path.getsize(source)
+                    if public:
+                        k.make_public()
+                if self.index_cache:
+                    self.index_cache.record_put(key_name, size)
+                uploaded_file_url = 'http://{bucket}.s3.amazonaws.com/{key}'.format(bucket=self.bucket_name,
+                                                                                     key=key_name)
                 logger.info('Successfully uploaded to {url}'.format(url=uploaded_file_url))
+                self._record_transfer('upload', key_name, size, start_time, retries=attempt, queue_wait=queue_wait)
                 return uploaded_file_url
             except Exception as ex:
                 logger.error('Attempt {num}/{max_attempts} failed with error:{err}'.format(
@@ -65,12 +209,63 @@ class S3BucketManager(object):
                 if attempt + 1 < attempts:
                     time.sleep(10)
                 else:
+                    self._record_transfer('upload', key_name, 0, start_time, retries=attempt, queue_wait=queue_wait,
+                                          success=False)
                     raise ex
 
+    def _upload_compressed_file(self, source, key_name, codec, level, public):
+        """Compress the source while streaming it up. Small results are sent in a single put, bigger ones as a
+         multipart upload, so only one part is held in memory at a time
+
+        :param source: Path of the local file to upload
+        :param key_name: Key name of the uploaded object
+        :param codec: 'gzip' or 'zstd'
+        :param level: Compression level
+        :param public: If we need to set the upload as public
+        :return: Number of compressed bytes sent
+        """
+        headers = {'Content-Encoding': codec,
+                   'Content-Type': mimetypes.guess_type(source)[0] or 'application/octet-stream'}
+        metadata = {'uncompressed-size': str(os.path.getsize(source))}
+        policy = 'public-read' if public else None
+        part_size = S3BucketManager.MULTIPART_CHUNK_SIZE
+        buffer = bytearray()
+        multipart = None
+        part_num = 0
+        sent = 0
+        try:
+            for data in iter_compressed_chunks(source, codec, level):
+                buffer += data
+                while len(buffer) >= part_size:
+                    if not multipart:
+                        multipart = self.bucket_obj.initiate_multipart_upload(key_name, headers=headers,
+                                                                              metadata=metadata, policy=policy)
+                    part_num += 1
+                    multipart.upload_part_from_file(io.BytesIO(buffer[:part_size]), part_num)
+                    sent += part_size
+                    del buffer[:part_size]
+            if multipart:
+                if buffer:
+                    multipart.upload_part_from_file(io.BytesIO(buffer), part_num + 1)
+                multipart.complete_upload()
+            else:
+                k = self.bucket_obj.new_key(key_name)
+                k.update_metadata(metadata)
+                k.set_contents_from_string(bytes(buffer), headers=headers, policy=policy)
+            sent += len(buffer)
+        except Exception:
+            if multipart:
+                multipart.cancel_upload()
+            raise
+        logger.debug(f'Compressed {source} with {codec} (level {level}): {metadata["uncompressed-size"]} -> '
+                     f'{sent} bytes')
+        return sent
+
     def upload(self, source_list: Union[str, List[str]],
                destination: str,
                public=True,
-               exclude_list: Union[str, List[str]] = '') -> List[str]:
+               exclude_list: Union[str, List[str]] = '',
+               compression='') -> List[str]:
         """An improved method to upload multiple sources to Amazon s3 server. The list can contain a file path to upload
          or a folder to upload all its content. If the source is a file, it will be uploaded directly to the s3
          destination dir. If the source is a folder, its content will be uploaded with the same hierarchical order
@@ -80,6 +275,7 @@ class S3BucketManager(object):
         :param destination: Destination folder (Inside the bucket)
         :param public: Adds read permission to Everyone for the file uploaded
         :param exclude_list: List of paths to exclude (Files & Folders). Supports glob string patterns
+        :param compression: Content-encoding for the uploaded files: 'auto', 'gzip', 'zstd'. Empty for none
         :return: A list of urls pointing to the uploaded files
         """
 
@@ -90,6 +286,7 @@ class S3BucketManager(object):
             :param tup: a tuple of argument
             :return: the result of self.upload_file_to_s3 with the given input
             """
+            self.queue_wait.value = time.time() - enqueue_time
             return self.upload_file(*tup)
 
         source_list = source_list if type(source_list) == list else [source_list]
@@ -116,7 +313,7 @@ class S3BucketManager(object):
                 source = os.path.realpath(source)
                 if os.path.isfile(source):
                     if source not in extended_exclude_list:
-                        upload_details = (source, destination, public)
+                        upload_details = (source, destination, public, compression)
                         upload_details_list.append(upload_details)
                 elif os.path.isdir(source):
                     upload_list_from_folder = get_files_in_folder(source)
@@ -125,15 +322,20 @@ class S3BucketManager(object):
                             continue
                         relative_path = os.path.dirname(file_path.split(source)[-1])
                         destination = '{base}{rel}'.format(base=destination, rel=relative_path.replace('\\', '/'))
-                        upload_details = (file_path, destination, public)
+                        upload_details = (file_path, destination, public, compression)
                         upload_details_list.append(upload_details)
                 else:
                     logger.info('Could not validate source for {source}. Skipping...'.format(source=source))
 
         pool = ThreadPool(S3BucketManager.UPLOAD_THREADS_NUM)
-        uploaded_files_list = pool.map(_upload_file_wrapper, upload_details_list)
-        pool.close()
-        pool.join()
+        enqueue_time = time.time()
+        try:
+            uploaded_files_list = pool.map(_upload_file_wrapper, upload_details_list)
+        finally:
+            pool.close()
+            pool.join()
+            if self.metrics:
+                self.metrics.report(f'Upload of {len(upload_details_list)} files')
         return uploaded_files_list
 
     def get_s3_folder_content(self, s3_folder):
@@ -143,14 +345,24 @@ class S3BucketManager(object):
         :param s3_folder: S3 folder to examine
         :return: A list of relative paths of the objects insides the input folder
         """
-        return [key.key for key in self.bucket_obj.list(prefix=s3_folder)]
+        index = self._get_index(s3_folder)
+        if index:
+            folder_content = index.list_folder(s3_folder)
+            if folder_content:
+                return folder_content
+        # Not indexed, or written by another client since the last sync
+        folder_content = [key.key for key in self.bucket_obj.list(prefix=s3_folder)]
+        if index and folder_content and s3_folder.strip('/'):
+            index.mark_dirty(s3_folder.rstrip('/') + '/')
+        return folder_content
 
-    def download_file(self, source, destination):
+    def download_file(self, source, destination, decompress=True):
         """Download source from s3 server. if destination is a file, the download file path will be the same. If it's a
          folder, the download file path will be '{}/{}'.format(destination, os.path.basename(source))
 
         :param source: Relative path of the file inside the bucket
         :param destination: Local path of the directory or file the file should be downloaded to
+        :param decompress: Decompress gzip/zstd content-encoded objects while streaming them down
         """
         if '.' in destination[-5:]:  # the destination is a file path and not a folder
             dest_file_path = destination
@@ -167,9 +379,24 @@ class S3BucketManager(object):
         if not os.path.exists(destination_dir):
             return
 
+        start_time = time.time()
+        queue_wait = self._pop_queue_wait()
         k = Key(self.bucket_obj)
         k.key = source
-        k.get_contents_to_filename(dest_file_path)
+        try:
+            k.open_read()  # Fills the object headers, the content itself is read by the calls below
+            decompressor = get_decompressor(k.content_encoding) if decompress else None
+            if decompressor:
+                with open(dest_file_path, 'wb') as dest_file:
+                    for chunk in k:
+                        dest_file.write(decompressor.decompress(chunk))
+                    dest_file.write(decompressor.flush())
+            else:
+                k.get_contents_to_filename(dest_file_path)
+        except Exception:
+            self._record_transfer('download', source, 0, start_time, queue_wait=queue_wait, success=False)
+            raise
+        self._record_transfer('download', source, k.size or 0, start_time, queue_wait=queue_wait)
         return dest_file_path
 
     def download(self, source_list, destination):
@@ -189,26 +416,45 @@ class S3BucketManager(object):
             :param tup: Tuple of argument
             :return: The result of self.download_file_from_s3 with the given input
             """
+            self.queue_wait.value = time.time() - enqueue_time
             return self.download_file(*tup)
 
         source_list = source_list if isinstance(source_list, list) else [source_list]
         download_details_list = []
         for source in source_list:
             source = source.strip('/')
-            k = self.bucket_obj.get_key(source)  # check if source is a file (s3 key) or a folder
-            if k:
+            index = self._get_index(source)
+            # check if source is a file (s3 key) or a folder, from the index if it knows the name
+            use_index = bool(index and (index.exists(source) or index.is_folder(source)))
+            if use_index:
+                is_file = index.exists(source)
+            else:
+                is_file = self.bucket_obj.get_key(source)
+                if index and is_file:
+                    index.mark_dirty(source)
+            if is_file:
                 download_details_list.append((source, destination))
             else:  # source is a folder
-                for key in self.bucket_obj.list(prefix=source):
-                    relative_url = key.key
+                if use_index:
+                    folder_content = index.list_folder(source)
+                else:
+                    folder_content = [key.key for key in self.bucket_obj.list(prefix=source)]
+                    if index and folder_content:
+                        index.mark_dirty(source + '/')
+                for relative_url in folder_content:
                     sub_folder = os.path.dirname(relative_url).split(source)[-1].strip('/')
                     destination = os.path.join(destination, sub_folder) if sub_folder else destination
                     download_details_list.append((relative_url, destination))
 
         pool = ThreadPool(S3BucketManager.DOWNLOAD_THREADS_NUM)
-        download_list = pool.map(_download_file_wrapper, download_details_list)
-        pool.close()
-        pool.join()
+        enqueue_time = time.time()
+        try:
+            download_list = pool.map(_download_file_wrapper, download_details_list)
+        finally:
+            pool.close()
+            pool.join()
+            if self.metrics:
+                self.metrics.report(f'Download of {len(download_details_list)} files')
         return download_list
 
     def delete_key_from_bucket(self, key_to_delete):
@@ -217,3 +463,132 @@ class S3BucketManager(object):
         :param key_to_delete: Folder or file path to delete
         """
         self.bucket_obj.delete_key(key_to_delete)
+        if self.index_cache:
+            self.index_cache.record_delete(key_to_delete)
+
+    def _get_bucket(self, bucket_name=''):
+        """Returns the bucket object for the given bucket name, the managed bucket if empty"""
+        if not bucket_name or bucket_name == self.bucket_name:
+            return self.bucket_obj
+        return self.conn.get_bucket(bucket_name, validate=False)
+
+    def copy_key(self, source_key, destination_key, destination_bucket='', public=False):
+        """Server side copy of a single object. The object bytes never pass through this host. Objects bigger than
+         MULTIPART_COPY_THRESHOLD are copied part by part (UploadPartCopy)
+
+        :param source_key: Key name or boto Key object (as returned by bucket listing) inside the managed bucket
+        :param destination_key: Key name of the copy
+        :param destination_bucket: Bucket name to copy into. Empty for the managed bucket
+        :param public: Adds read permission to Everyone for the copied object
+        :return: The destination key name
+        """
+        dest_bucket = self._get_bucket(destination_bucket)
+        if isinstance(source_key, str):
+            source_key = self.bucket_obj.get_key(source_key)
+            if not source_key:
+                raise FileNotFoundError(f'No such key in bucket "{self.bucket_name}"')
+        policy = 'public-read' if public else None
+        if source_key.size < S3BucketManager.MULTIPART_COPY_THRESHOLD:
+            dest_bucket.copy_key(destination_key, self.bucket_name, source_key.name,
+                                 headers={'x-amz-acl': policy} if policy else None)
+            return destination_key
+
+        # Listing results do not hold the object headers, fetch them so the copy keeps its metadata
+        head = self.bucket_obj.get_key(source_key.name)
+        headers = {'Content-Type': head.content_type}
+        if head.content_encoding:
+            headers['Content-Encoding'] = head.content_encoding
+        multipart = dest_bucket.initiate_multipart_upload(destination_key, headers=headers, metadata=head.metadata,
+                                                          policy=policy)
+        try:
+            part_size = S3BucketManager.MULTIPART_COPY_PART_SIZE
+            for part_num, start in enumerate(range(0, head.size, part_size), 1):
+                multipart.copy_part_from_key(self.bucket_name, head.name, part_num,
+                                             start, min(start + part_size, head.size) - 1)
+            multipart.complete_upload()
+        except Exception:
+            multipart.cancel_upload()
+            raise
+        return destination_key
+
+    def copy_prefix(self, source_prefix, destination_prefix, destination_bucket='', public=False,
+                    delete_source=False) -> List[str]:
+        """Server side copy of all the objects under a prefix. The listing is streamed into a thread pool so the copy
+         starts with the first listing page. Every key keeps its path relative to the prefix, i.e. the
+         source_prefix part of the key name is replaced with destination_prefix. When the prefixes overlap in the
+         same bucket the source is listed in full first, so the copies are never listed and copied again
+
+        :param source_prefix: Prefix (folder) inside the managed bucket to copy from
+        :param destination_prefix: Prefix to copy into
+        :param destination_bucket: Bucket name to copy into. Empty for the managed bucket
+        :param public: Adds read permission to Everyone for the copied objects
+        :param delete_source: Delete every source object that was copied successfully (move)
+        :return: A list of the copied destination key names
+        """
+
+        def _copy_key_wrapper(key):
+            """Copies a single listed key, returns the exception instead of raising it to let the others finish
+
+            :param key: Boto key object from the bucket listing
+            :return: Tuple of (source key name, destination key name, exception or None)
+            """
+            destination_key = destination_prefix + key.name[len(source_prefix):]
+            try:
+                self.copy_key(key, destination_key, destination_bucket=destination_bucket, public=public)
+                if self.index_cache and dest_bucket is self.bucket_obj:
+                    self.index_cache.record_put(destination_key, key.size, (key.etag or '').strip('"'))
+                return key.name, destination_key, None
+            except Exception as ex:
+                logger.error(f'Failed to copy {key.name} to {destination_key}: {ex}')
+                return key.name, destination_key, ex
+
+        logger.info(f'Copy "{source_prefix}" to "{destination_bucket or self.bucket_name}/{destination_prefix}"')
+        dest_bucket = self._get_bucket(destination_bucket)
+        source_keys = self.bucket_obj.list(prefix=source_prefix)
+        if dest_bucket is self.bucket_obj:
+            if source_prefix == destination_prefix:
+                raise ValueError(f'Cannot copy "{source_prefix}" onto itself')
+            if destination_prefix.startswith(source_prefix) or source_prefix.startswith(destination_prefix):
+                source_keys = list(source_keys)
+        copied_list = []
+        copied_source_list = []
+        errors = []
+        pool = ThreadPool(S3BucketManager.COPY_THREADS_NUM)
+        try:
+            for source_key, destination_key, error in pool.imap_unordered(_copy_key_wrapper, source_keys):
+                if error:
+                    errors.append(error)
+                else:
+                    copied_list.append(destination_key)
+                    copied_source_list.append(source_key)
+        finally:
+            pool.close()
+            pool.join()
+        logger.info(f'{len(copied_list)} objects were copied, {len(errors)} failed')
+
+        if delete_source and dest_bucket is self.bucket_obj:  # A source key may have been overwritten by a copy
+            copied_names = set(copied_list)
+            copied_source_list = [source_key for source_key in copied_source_list if source_key not in copied_names]
+        if delete_source and copied_source_list:
+            result = self.bucket_obj.delete_keys(copied_source_list)
+            if self.index_cache:
+                for source_key in copied_source_list:
+                    self.index_cache.record_delete(source_key)
+            for error in result.errors:
+                logger.error(f'Failed to delete {error.key}: {error.message}')
+        if errors:
+            raise errors[0]
+        return copied_list
+
+    def move_prefix(self, source_prefix, destination_prefix, destination_bucket='', public=False) -> List[str]:
+        """Server side move of all the objects under a prefix. Source objects are deleted only after their copy
+         succeeded (see copy_prefix)
+
+        :param source_prefix: Prefix (folder) inside the managed bucket to move from
+        :param destination_prefix: Prefix to move into
+        :param destination_bucket: Bucket name to move into. Empty for the managed bucket
+        :param public: Adds read permission to Everyone for the moved objects
+        :return: A list of the moved destination key names
+        """
+        return self.copy_prefix(source_prefix, destination_prefix, destination_bucket=destination_bucket,
+                                public=public, delete_source=True)
@@ -0,0 +1,217 @@
+import time
+import sqlite3
+import threading
+from typing import List, Optional
+from boto.s3.prefix import Prefix
+from pybenutils.utils_logger.config_logger import get_logger
+
+logger = get_logger()
+
+
+class S3IndexCache(object):
+    """A local SQLite index of the keys metadata of an s3 bucket (or of a prefix inside it).
+     The indexed root is split by its top level "folders". Each folder is listed as a unit and is listed again only
+     if it is new, was marked dirty (by a write that went through this cache) or is older than max_age seconds,
+     so a sync of a mostly unchanged bucket costs a single delimiter listing request. Each folder expires on its own,
+     and sync_if_expired of a name inside a folder lists only that folder, so the folders are refreshed as they are
+     read instead of all together"""
+
+    def __init__(self, bucket_obj, db_path, prefix='', max_age=3600):
+        """
+        :param bucket_obj: Boto bucket object to index
+        :param db_path: Path of the SQLite database file. Use ':memory:' for an in process only index
+        :param prefix: Index only the keys under this prefix
+        :param max_age: Seconds after which an indexed folder is listed again on sync. 0 to relist on every sync
+        """
+        self.bucket_obj = bucket_obj
+        self.bucket_name = bucket_obj.name
+        self.prefix = prefix
+        self.max_age = max_age
+        self.synced_at = 0.0  # Time of the last full sync
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS keys (bucket TEXT, name TEXT, parent TEXT, size INTEGER, '
+                            'etag TEXT, last_modified TEXT, PRIMARY KEY (bucket, name))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS keys_parent ON keys (bucket, parent)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS prefixes (bucket TEXT, prefix TEXT, synced_at REAL, '
+                            'dirty INTEGER, PRIMARY KEY (bucket, prefix))')
+
+    def covers(self, name: str) -> bool:
+        """Returns True if the given key name is inside the indexed prefix"""
+        return name.startswith(self.prefix)
+
+    def _get_parent(self, name: str) -> str:
+        """Returns the top level folder (relative to the indexed prefix) the given key belongs to"""
+        relative_name = name[len(self.prefix):]
+        if '/' in relative_name:
+            return self.prefix + relative_name.split('/', 1)[0] + '/'
+        return self.prefix
+
+    def _get_folder(self, name: str) -> Optional[str]:
+        """Returns the top level folder the given name is located in, None for a root level name"""
+        parent = self._get_parent(name)
+        return parent if parent != self.prefix else None
+
+    def _insert_keys(self, keys, parent):
+        """Insert boto key objects rows into the index. Must be called inside a transaction"""
+        self.db.executemany('INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?)',
+                            ((self.bucket_name, key.name, parent, key.size, (key.etag or '').strip('"'),
+                              key.last_modified) for key in keys))
+
+    def sync(self, force=False) -> List[str]:
+        """Bring the index up to date. Only new, dirty and expired folders are listed again
+
+        :param force: List all the folders again
+        :return: List of the folders that were listed
+        """
+        start_time = time.time()
+        root_keys = []
+        folders = []
+        for item in self.bucket_obj.list(prefix=self.prefix, delimiter='/'):
+            if isinstance(item, Prefix):
+                folders.append(item.name)
+            else:
+                root_keys.append(item)
+
+        with self.lock:
+            synced = dict(self.db.execute('SELECT prefix, CASE WHEN dirty THEN 0 ELSE synced_at END FROM prefixes '
+                                          'WHERE bucket = ?', (self.bucket_name,)).fetchall())
+        expired = start_time - self.max_age
+        refresh_list = [folder for folder in folders if force or synced.get(folder, 0) <= expired]
+        removed_list = [folder for folder in synced if folder not in folders and folder != self.prefix]
+
+        with self.lock, self.db:
+            # Root level keys come with the delimiter listing for free
+            self.db.execute('DELETE FROM keys WHERE bucket = ? AND parent = ?', (self.bucket_name, self.prefix))
+            self._insert_keys(root_keys, self.prefix)
+            for folder in removed_list:
+                self.db.execute('DELETE FROM keys WHERE bucket = ? AND parent = ?', (self.bucket_name, folder))
+                self.db.execute('DELETE FROM prefixes WHERE bucket = ? AND prefix = ?', (self.bucket_name, folder))
+        for folder in refresh_list:
+            self._list_folder(folder, start_time)
+        self.synced_at = start_time
+        logger.debug(f'Index of "{self.bucket_name}/{self.prefix}" synced in {time.time() - start_time:.2f} seconds. '
+                     f'Listed {len(refresh_list)} of {len(folders)} folders, removed {len(removed_list)}')
+        return refresh_list
+
+    def _list_folder(self, folder: str, start_time: float):
+        """List a top level folder and replace its indexed keys
+
+        :param folder: Top level folder (prefix)
+        :param start_time: Time to record as the folder sync time, taken before the listing
+        """
+        keys = list(self.bucket_obj.list(prefix=folder))
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM keys WHERE bucket = ? AND parent = ?', (self.bucket_name, folder))
+            self._insert_keys(keys, folder)
+            self.db.execute('INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?, 0)',
+                            (self.bucket_name, folder, start_time))
+
+    def sync_folder(self, folder: str, force=False) -> bool:
+        """List a single top level folder again if it is new, dirty or older than max_age seconds
+
+        :param folder: Top level folder (prefix)
+        :param force: List the folder even if it did not expire
+        :return: True if the folder was listed
+        """
+        start_time = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT synced_at, dirty FROM prefixes WHERE bucket = ? AND prefix = ?',
+                                  (self.bucket_name, folder)).fetchone()
+        if not force and row and not row[1] and row[0] > start_time - self.max_age:
+            return False
+        self._list_folder(folder, start_time)
+        logger.debug(f'Folder "{self.bucket_name}/{folder}" of the index synced in {time.time() - start_time:.2f} '
+                     f'seconds')
+        return True
+
+    def sync_if_expired(self, name='') -> bool:
+        """Refresh the part of the index a lookup of the given name reads, if it expired. A name inside a top level
+         folder lists only that folder (see sync_folder). A root level name, or no name, syncs the index if its last
+         full sync is older than max_age seconds
+
+        :param name: Key name or prefix about to be looked up
+        :return: True if anything was listed
+        """
+        folder = self._get_folder(name) if name else None
+        if folder:
+            return self.sync_folder(folder)
+        if time.time() - self.synced_at <= self.max_age:
+            return False
+        self.sync()
+        return True
+
+    def mark_dirty(self, name: str):
+        """Mark the folder holding the given key name (or prefix) to be listed again on the next sync
+
+        :param name: Key name or prefix
+        """
+        with self.lock, self.db:
+            self.db.execute('UPDATE prefixes SET dirty = 1 WHERE bucket = ? AND prefix = ?',
+                            (self.bucket_name, self._get_parent(name)))
+
+    def record_put(self, name: str, size: int, etag=''):
+        """Add or update a key in the index after it was written to the bucket
+
+        :param name: Key name
+        :param size: Object size in bytes
+        :param etag: Object etag if known
+        """
+        if not self.covers(name):
+            return
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?, ?, ?)',
+                            (self.bucket_name, name, self._get_parent(name), size, etag,
+                             time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())))
+
+    def record_delete(self, name: str):
+        """Remove a key from the index after it was deleted from the bucket
+
+        :param name: Key name
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM keys WHERE bucket = ? AND name = ?', (self.bucket_name, name))
+
+    def get(self, name: str) -> Optional[dict]:
+        """Returns the indexed metadata of the given key name, None if it is not in the index
+
+        :param name: Key name
+        :return: Dict with the keys: name, size, etag, last_modified
+        """
+        with self.lock:
+            row = self.db.execute('SELECT name, size, etag, last_modified FROM keys WHERE bucket = ? AND name = ?',
+                                  (self.bucket_name, name)).fetchone()
+        return dict(zip(('name', 'size', 'etag', 'last_modified'), row)) if row else None
+
+    def exists(self, name: str) -> bool:
+        """Returns True if the given key name is in the index"""
+        return self.get(name) is not None
+
+    def list_folder(self, folder: str) -> List[str]:
+        """Returns the key names under the given folder (prefix), recursively
+
+        :param folder: S3 folder (prefix) to list
+        :return: A list of key names, sorted
+        """
+        if not folder:
+            query, params = 'SELECT name FROM keys WHERE bucket = ? ORDER BY name', (self.bucket_name,)
+        else:
+            # A range instead of LIKE so the primary key index is used
+            upper_bound = folder[:-1] + chr(ord(folder[-1]) + 1)
+            query = 'SELECT name FROM keys WHERE bucket = ? AND name >= ? AND name < ? ORDER BY name'
+            params = (self.bucket_name, folder, upper_bound)
+        with self.lock:
+            return [row[0] for row in self.db.execute(query, params)]
+
+    def is_folder(self, name: str) -> bool:
+        """Returns True if any indexed key is located under the given name as a folder"""
+        folder = name.rstrip('/') + '/'
+        upper_bound = folder[:-1] + chr(ord('/') + 1)
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM keys WHERE bucket = ? AND name >= ? AND name < ? LIMIT 1',
+                                   (self.bucket_name, folder, upper_bound)).fetchone() is not None
+
+    def close(self):
+        """Close the index database"""
+        self.db.close()
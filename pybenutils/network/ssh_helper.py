@@ -4,14 +4,18 @@ import time
 import json
 import tempfile
 import argparse
-import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 arch = platform.machine().lower()
 ARM_PROCESSOR = "arm" in arch or "aarch" in arch
 if not ARM_PROCESSOR:
     import paramiko
 
+from pybenutils.network.ssh_utils import STREAM_TAIL_LINES, iter_channel_lines, run_batch_on_client
+from pybenutils.network.ssh_pool import default_pool, set_tcp_nodelay
+from pybenutils.network.ssh_transfer import open_sftp, sftp_get, sftp_put
+
 
-results_list = []
 example_dict = {
     "connections": [
         {
@@ -30,7 +34,15 @@ example_dict = {
 
 
 class SshHelper:
-    def __init__(self, host, user_name, password):
+    def __init__(self, host, user_name, password, use_pool=False):
+        """
+        :param host: Remote server ip
+        :param user_name: Remote server username
+        :param password: Remote server password
+        :param use_pool: Lease the connection from the process wide pool (see ssh_pool) so helpers created for the
+         same server reuse one authenticated connection. The helper must then be closed to give it back
+        """
+        self.use_pool = use_pool
         self.user = user_name
         self.password = password
         self.host = host
@@ -38,27 +50,78 @@ class SshHelper:
         self.timeout = 120
         self.bufsize = -1
         self.client = None
+        self.sftp = None
 
     def connect(self):
+        if self.use_pool:
+            self.client = default_pool.acquire(self.host, self.user, self.password, port=self.port, banner_timeout=10)
+            return
         self.client = paramiko.SSHClient()
         self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self.client.connect(hostname=self.host, port=self.port, username=self.user, password=self.password,
                             banner_timeout=10)
+        set_tcp_nodelay(self.client.get_transport())
+
+    def is_connected(self) -> bool:
+        """Returns True if the client holds an active (authenticated) transport"""
+        transport = self.client.get_transport() if self.client else None
+        return bool(transport and transport.is_active() and transport.is_authenticated())
 
-    def run(self, command):
-        if not self.client:
+    def ensure_connected(self):
+        """Connect if there is no active connection, dropping a dead one"""
+        if not self.is_connected():
+            if self.client:
+                self.close()
             self.connect()
+
+    def get_sftp(self):
+        """Returns an sftp client over the current connection, opened once per connection"""
+        self.ensure_connected()
+        if not self.sftp:
+            if self.use_pool:
+                self.sftp = default_pool.get_sftp(self.client)  # Owned by the pooled connection
+            else:
+                self.sftp = open_sftp(self.client.get_transport())
+        return self.sftp
+
+    def run(self, command, output_callback=None):
+        """Run a command and return its combined stdout and stderr with its exit status
+
+        :param command: Command to execute
+        :param output_callback: Streaming mode. Callable receiving every output line as it arrives. Only the last
+         lines of the output are returned, so the memory stays bounded
+        :return: Tuple of (output, exit status)
+        """
+        self.ensure_connected()
         chan = self.client.get_transport().open_session()
         chan.settimeout(self.timeout)
         chan.set_combine_stderr(True)
         chan.get_pty()
         chan.exec_command(command)
-        stdout = chan.makefile('r', self.bufsize)
-        stdout_text = stdout.read()
+        if output_callback:
+            tail = deque(maxlen=STREAM_TAIL_LINES)
+            for _, line in iter_channel_lines(chan, timeout=self.timeout):
+                tail.append(line)
+                output_callback(line)
+            stdout_text = '\n'.join(tail)
+        else:
+            stdout = chan.makefile('r', self.bufsize)
+            stdout_text = stdout.read()
         status = int(chan.recv_exit_status())
         return stdout_text, status
 
-    def run_in_terminal(self, command, outputfile='outfile'):
+    def run_batch(self, commands, stop_on_error=False):
+        """Run a command list as a single remote script, in one round trip (see ssh_utils.run_batch_on_client)
+
+        :param commands: List of commands to execute
+        :param stop_on_error: Stop after the first command that returned an stderr string
+        :return: List of return objects [{'ssh_stdin': str, 'ssh_stdout': str, 'ssh_stderr': str, 'exit_status': int,
+         'duration': float}]
+        """
+        self.ensure_connected()
+        return run_batch_on_client(self.client, commands, stop_on_error=stop_on_error, command_timeout=self.timeout)
+
+    def run_in_terminal(self, command, outputfile='outfile', keep_connection=False):
         tempdir = tempfile.gettempdir()  # prints the current temporary directory
         temp_file_name = os.path.join(tempdir, 't_{ts}.txt'.format(ts=str(time.time()).replace('.', '')))
         with open(temp_file_name, mode='w+') as f:
@@ -69,11 +132,7 @@ class SshHelper:
             print(f.read())  # reads data back from the file
 
         try:
-            if not self.client:
-                self.connect()
-
-            sftp = self.client.open_sftp()
-            sftp.put(temp_file_name, '/tmp/tmp.sh')
+            self.get_sftp().put(temp_file_name, '/tmp/tmp.sh')
 
             chan = self.client.get_transport().open_session()
             chan.settimeout(self.timeout)
@@ -89,67 +148,113 @@ class SshHelper:
 
             return stdout_text, status
         finally:
-            self.close()
+            if not keep_connection:
+                self.close()
 
     def close(self):
-        self.client.close()
+        if self.use_pool:
+            if self.client:
+                default_pool.release(self.client, discard=not self.is_connected())
+            self.sftp = None
+            self.client = None
+            return
+        if self.sftp:
+            self.sftp.close()
+            self.sftp = None
+        if self.client:
+            self.client.close()
+            self.client = None
 
-    def copy_to_remote(self, source, destination):
+    def copy_to_remote(self, source, destination, keep_connection=False):
         """ Copy file from local to remote
 
         :param source: local file
         :param destination: Full path on remote machine
+        :param keep_connection: Keep the connection open for the next calls
+        :return: Transfer stats {'path': str, 'bytes': int, 'seconds': float, 'throughput': float}
         """
-        if not self.client:
-            self.connect()
-        sftp = self.client.open_sftp()
-        sftp.put(os.path.realpath(source), destination)
-        self.close()
+        try:
+            return sftp_put(self.get_sftp(), os.path.realpath(source), destination)
+        finally:
+            if not keep_connection:
+                self.close()
+
+    def get_from_remote(self, source, destination, keep_connection=False):
+        """ Copy file from remote to local
+
+        :param source: Full path on remote machine
+        :param destination: local file
+        :param keep_connection: Keep the connection open for the next calls
+        :return: Transfer stats {'path': str, 'bytes': int, 'seconds': float, 'throughput': float}
+        """
+        try:
+            return sftp_get(self.get_sftp(), source, destination)
+        finally:
+            if not keep_connection:
+                self.close()
+
+    def call_with_reconnect(self, func, *args, **kwargs):
+        """Call one of the helper methods, reconnecting and trying once more if it failed on a dropped connection
 
-    def get_from_remote(self, source, destination):
-        if not self.client:
+        :param func: Bound method of this helper
+        :return: The result of the method
+        """
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if self.is_connected():
+                raise  # The failure is not connection related
+            self.close()
             self.connect()
-        sftp = self.client.open_sftp()
-        sftp.get(source, destination)
-        self.close()
+            return func(*args, **kwargs)
+
 
+def run_cmd(conf) -> str:
+    """Run the command list of a single connection configuration (see example_dict)
 
-def run_cmd(conf):
-    global results_list
+    :param conf: Connection configuration dict
+    :return: The run log
+    """
     thread_log = '---THREAD_START---\n'
-    for idx, cmd in enumerate(conf['cmd_list']):
-        thread_log += '*****\n'
-        cmd = str(cmd).replace("'", "\\'")
-        thread_log += 'Running cmd: {}\n'.format(cmd)
-        open_connection = SshHelper(host=conf['host'], user_name=conf['host_user'], password=conf['host_pass'])
-        status = 'DONE'
-        output = ''
-        if cmd.startswith('COPY_FILE'):
-            thread_log += 'Trying to copy {s} to {t}\n'.format(s=cmd.split()[1], t=cmd.split()[2])
-            try:
-                open_connection.copy_to_remote(source=cmd.split()[1], destination=cmd.split()[2])
-            except Exception as err:
-                thread_log += 'Failed to perform copy function for error: {e}\n'.format(e=err)
-        elif cmd.startswith('GET_FILE'):
-            thread_log += 'Trying to copy {s} to {t}\n'.format(s=cmd.split()[1], t=cmd.split()[2])
-            try:
-                open_connection.get_from_remote(source=cmd.split()[1], destination=cmd.split()[2])
-            except Exception as err2:
-                thread_log += 'Failed to perform get function for error: {e}\n'.format(e=err2)
-        else:
-            try:
-                output_file_path = '/Automation/output_{ind}.txt'.format(ind=idx)
-                output, status = open_connection.run_in_terminal(cmd, outputfile=output_file_path)
-            except Exception as err3:
-                thread_log += 'Failed to perform run command function for error: {e}\n'.format(e=err3)
-                thread_log += 'Stopping the commands flow due to connection problem\n'
-                break
-        thread_log += 'Finished with status code: {s}. Run-time log: {log}\n'.format(s=status, log=str(output))
-
-        time.sleep(5)
+    # One authenticated connection for the whole list. Each step blocks until it completes, and the connection is
+    # re-established only if it dropped
+    open_connection = SshHelper(host=conf['host'], user_name=conf['host_user'], password=conf['host_pass'])
+    try:
+        for idx, cmd in enumerate(conf['cmd_list']):
+            thread_log += '*****\n'
+            cmd = str(cmd).replace("'", "\\'")
+            thread_log += 'Running cmd: {}\n'.format(cmd)
+            status = 'DONE'
+            output = ''
+            if cmd.startswith('COPY_FILE'):
+                thread_log += 'Trying to copy {s} to {t}\n'.format(s=cmd.split()[1], t=cmd.split()[2])
+                try:
+                    open_connection.call_with_reconnect(open_connection.copy_to_remote, source=cmd.split()[1],
+                                                        destination=cmd.split()[2], keep_connection=True)
+                except Exception as err:
+                    thread_log += 'Failed to perform copy function for error: {e}\n'.format(e=err)
+            elif cmd.startswith('GET_FILE'):
+                thread_log += 'Trying to copy {s} to {t}\n'.format(s=cmd.split()[1], t=cmd.split()[2])
+                try:
+                    open_connection.call_with_reconnect(open_connection.get_from_remote, source=cmd.split()[1],
+                                                        destination=cmd.split()[2], keep_connection=True)
+                except Exception as err2:
+                    thread_log += 'Failed to perform get function for error: {e}\n'.format(e=err2)
+            else:
+                try:
+                    output_file_path = '/Automation/output_{ind}.txt'.format(ind=idx)
+                    output, status = open_connection.call_with_reconnect(open_connection.run_in_terminal, cmd,
+                                                                         outputfile=output_file_path,
+                                                                         keep_connection=True)
+                except Exception as err3:
+                    thread_log += 'Failed to perform run command function for error: {e}\n'.format(e=err3)
+                    thread_log += 'Stopping the commands flow due to connection problem\n'
+                    break
+            thread_log += 'Finished with status code: {s}. Run-time log: {log}\n'.format(s=status, log=str(output))
+    finally:
+        open_connection.close()
     thread_log += '---THREAD_END---\n'
-    with open(args.out, 'w+') as out_file:
-        out_file.write(thread_log)
+    return thread_log
 
 
 if __name__ == '__main__':
@@ -160,6 +265,8 @@ if __name__ == '__main__':
                         default='')
     parser.add_argument('-o', '--out', help='Output log file path', required=False, nargs='?',
                         default='output_{ts}.txt'.format(ts=str(time.time()).replace('.', '')))
+    parser.add_argument('-w', '--max_workers', help='Maximal number of hosts handled at the same time',
+                        required=False, type=int, default=20)
     args = parser.parse_args()
 
     if not os.path.isfile(args.config_file):
@@ -169,12 +276,7 @@ if __name__ == '__main__':
 
     with open(args.config_file, 'r') as config_file_source:
         ssh_config_dict = json.load(config_file_source)
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        logs_list = list(executor.map(run_cmd, ssh_config_dict['connections']))
     with open(args.out, 'w') as output_file:
-        output_file.write('')
-    threads = []
-    for connection in ssh_config_dict['connections']:
-        t = threading.Thread(target=run_cmd, args=(connection,))
-        threads.append(t)
-        t.start()
-    for thread in threads:
-        thread.join()
+        output_file.write(''.join(logs_list))
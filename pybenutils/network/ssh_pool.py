@@ -0,0 +1,290 @@
+import time
+import atexit
+import hashlib
+import socket
+import platform
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+arch = platform.machine().lower()
+ARM_PROCESSOR = "arm" in arch or "aarch" in arch
+if not ARM_PROCESSOR:
+    from paramiko import SSHClient, AutoAddPolicy
+
+from pybenutils.network.ssh_transfer import open_sftp
+from pybenutils.utils_logger.config_logger import get_logger
+
+logger = get_logger()
+
+
+def set_tcp_nodelay(transport):
+    """Disable Nagle's algorithm on the transport socket, like sshd does. Otherwise the small request packets of
+     every exec / sftp round trip wait for the delayed acknowledgements of the previous ones (~40ms each)
+
+    :param transport: Connected paramiko transport
+    """
+    if isinstance(transport.sock, socket.socket):  # Not a proxy command or a tunnel channel
+        transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _PooledConnection(object):
+    """A pooled ssh client with its lazily opened sftp session"""
+
+    def __init__(self, key: Tuple[str, int, str, str], ssh: 'SSHClient'):
+        self.key = key
+        self.ssh = ssh
+        self.sftp = None
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.uses = 0
+
+    def close(self):
+        for resource in (self.sftp, self.ssh):
+            try:
+                if resource:
+                    resource.close()
+            except Exception as ex:
+                logger.debug(f'Failed to close pooled connection to {self.key[0]}: {ex}')
+        self.sftp = None
+
+
+class SshConnectionPool(object):
+    """A thread safe pool of authenticated ssh connections keyed by (host, port, user, credentials). The
+     credentials part is a digest of the password and the connect arguments, so a connection is never handed to a
+     caller that connects with another password or other options.
+     A connection is leased exclusively: acquire it, use it and release it for the next caller, so repeated short
+     calls to the same host pay the handshake once. Released connections are kept alive with transport keepalive
+     packets, closed after idle_timeout seconds without use and health checked before they are handed out again.
+     A reaper thread runs while there are idle connections and closes the expired ones every keepalive interval"""
+    MAX_SESSIONS_PER_HOST = 4
+    IDLE_TIMEOUT = 300  # Seconds
+    KEEPALIVE_INTERVAL = 30  # Seconds
+    WAIT_TIMEOUT = 60  # Seconds acquire waits for a free session before raising TimeoutError
+    HEALTH_CHECK_TIMEOUT = 5  # Seconds the server gets to answer the health check round trip
+
+    def __init__(self, max_sessions_per_host=None, idle_timeout=None, keepalive_interval=None, wait_timeout=None):
+        """
+        :param max_sessions_per_host: Maximal number of connections (leased and idle) per (host, port, user,
+         credentials)
+        :param idle_timeout: Seconds an unused connection is kept open
+        :param keepalive_interval: Seconds between keepalive packets on every pooled connection. 0 to disable
+        :param wait_timeout: Default seconds acquire waits for a free session
+        """
+        self.max_sessions_per_host = max_sessions_per_host or self.MAX_SESSIONS_PER_HOST
+        self.wait_timeout = self.WAIT_TIMEOUT if wait_timeout is None else wait_timeout
+        self.idle_timeout = self.IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.keepalive_interval = self.KEEPALIVE_INTERVAL if keepalive_interval is None else keepalive_interval
+        self.condition = threading.Condition()
+        self.idle: Dict[Tuple[str, int, str, str], List[_PooledConnection]] = {}
+        self.leased: Dict[int, _PooledConnection] = {}  # id(ssh) to its pooled connection
+        self.sessions_count: Dict[Tuple[str, int, str, str], int] = {}  # Leased, idle and connecting, per key
+        self.counters = {'created': 0, 'reused': 0, 'evicted_idle': 0, 'evicted_unhealthy': 0}
+        self._reaper = None
+
+    @classmethod
+    def is_healthy(cls, ssh: 'SSHClient') -> bool:
+        """Returns True if the client transport is active and authenticated and the server answers a round trip
+         (a session channel opened and closed) within HEALTH_CHECK_TIMEOUT seconds. Catches connections the server
+         (or a firewall) dropped while they were idle, which the transport reports as active until it writes"""
+        transport = ssh.get_transport()
+        if not transport or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.open_session(timeout=cls.HEALTH_CHECK_TIMEOUT).close()
+        except Exception:
+            return False
+        return transport.is_active()
+
+    @staticmethod
+    def get_key(server: str, username: str, password: str, port=22, **kwargs) -> Tuple[str, int, str, str]:
+        """Returns the pool key of a connection: (server, port, username, digest of the password and the connect
+         arguments). The password itself is not kept in the key"""
+        options = repr((password, sorted(kwargs.items())))
+        return server, int(port), username, hashlib.sha256(options.encode()).hexdigest()
+
+    def _connect(self, key: Tuple[str, int, str, str], password: str, **kwargs) -> 'SSHClient':
+        """Open a new authenticated ssh client"""
+        server, port, username, _ = key
+        ssh = SSHClient()
+        ssh.set_missing_host_key_policy(AutoAddPolicy())
+        logger.debug(f'Pool connecting to {username}@{server}:{port}')
+        ssh.connect(server, port=port, username=username, password=password, **kwargs)
+        set_tcp_nodelay(ssh.get_transport())
+        if self.keepalive_interval:
+            ssh.get_transport().set_keepalive(self.keepalive_interval)
+        return ssh
+
+    def _pop_expired(self) -> List[_PooledConnection]:
+        """Remove the connections idle for longer than idle_timeout. Must be called with the condition held
+
+        :return: The removed connections, to be closed outside the lock
+        """
+        expired_list = []
+        deadline = time.time() - self.idle_timeout
+        for key, connections in self.idle.items():
+            for connection in [connection for connection in connections if connection.last_used < deadline]:
+                connections.remove(connection)
+                self.sessions_count[key] -= 1
+                expired_list.append(connection)
+        self.counters['evicted_idle'] += len(expired_list)
+        if expired_list:
+            self.condition.notify_all()
+        return expired_list
+
+    def acquire(self, server: str, username: str, password: str, port=22, wait_timeout=None,
+                **kwargs) -> 'SSHClient':
+        """Lease a connected ssh client. Reuses a healthy idle connection or opens a new one, waiting for a free slot
+         if the key is at max_sessions_per_host. Must be given back with release
+
+        :param server: Remote server ip
+        :param username: Remote server username
+        :param password: Remote server password
+        :param port: Remote server ssh port
+        :param wait_timeout: Seconds to wait for a free slot before raising TimeoutError. None for the pool
+         wait_timeout
+        :param kwargs: Arguments to pass to ssh.connect for a new connection. Part of the pool key
+        :return: Connected SSHClient
+        """
+        key = self.get_key(server, username, password, port=port, **kwargs)
+        wait_timeout = self.wait_timeout if wait_timeout is None else wait_timeout
+        deadline = time.time() + wait_timeout
+        reused = False
+        while True:
+            connection = None
+            with self.condition:
+                expired_list = self._pop_expired()
+                while not self.idle.get(key) and self.sessions_count.get(key, 0) >= self.max_sessions_per_host:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError(f'No free ssh session to {server} within {wait_timeout} seconds')
+                    self.condition.wait(remaining)
+                if self.idle.get(key):
+                    connection = self.idle[key].pop()
+                else:
+                    self.sessions_count[key] = self.sessions_count.get(key, 0) + 1
+            for expired in expired_list:
+                expired.close()
+            if connection:
+                if self.is_healthy(connection.ssh):
+                    reused = True
+                    break
+                logger.debug(f'Dropping an unhealthy pooled connection to {server}')
+                connection.close()
+                with self.condition:
+                    self.sessions_count[key] -= 1
+                    self.counters['evicted_unhealthy'] += 1
+                    self.condition.notify_all()
+                continue
+            try:
+                connection = _PooledConnection(key, self._connect(key, password, **kwargs))
+            except Exception:
+                with self.condition:
+                    self.sessions_count[key] -= 1
+                    self.condition.notify_all()
+                raise
+            break
+        connection.uses += 1
+        with self.condition:
+            self.counters['reused' if reused else 'created'] += 1
+            self.leased[id(connection.ssh)] = connection
+        return connection.ssh
+
+    def _reap(self):
+        """Reaper thread loop: close the expired idle connections every keepalive interval, until none is idle"""
+        interval = min(self.keepalive_interval or self.idle_timeout, self.idle_timeout) or 1
+        while True:
+            time.sleep(interval)
+            self.evict_idle()
+            with self.condition:
+                if not any(self.idle.values()):
+                    self._reaper = None
+                    return
+
+    def release(self, ssh: 'SSHClient', discard=False):
+        """Give a leased client back to the pool
+
+        :param ssh: Client returned by acquire
+        :param discard: Close the connection instead of keeping it for reuse (e.g. after a connection error)
+        """
+        with self.condition:
+            connection = self.leased.pop(id(ssh), None)
+            if not connection:
+                logger.debug('Released an ssh client that is not leased from the pool')
+                return
+            if not discard:
+                connection.last_used = time.time()
+                self.idle.setdefault(connection.key, []).append(connection)
+                if not self._reaper:
+                    self._reaper = threading.Thread(target=self._reap, name='SshConnectionPoolReaper', daemon=True)
+                    self._reaper.start()
+            else:
+                self.sessions_count[connection.key] -= 1
+            self.condition.notify_all()
+        if discard:
+            connection.close()
+
+    @contextmanager
+    def lease(self, server: str, username: str, password: str, port=22, wait_timeout=None, **kwargs):
+        """Context manager version of acquire / release. The connection is discarded if the block raised while it
+         was no longer healthy
+
+        > with default_pool.lease('192.168.0.10', 'qa', '1234') as ssh:
+        >     ssh.exec_command('uptime')
+        """
+        ssh = self.acquire(server, username, password, port=port, wait_timeout=wait_timeout, **kwargs)
+        try:
+            yield ssh
+        except Exception:
+            self.release(ssh, discard=not self.is_healthy(ssh))
+            raise
+        else:
+            self.release(ssh)
+
+    def get_sftp(self, ssh: 'SSHClient') -> 'SFTPClient':
+        """Returns the sftp session of a leased client, opened once per pooled connection
+
+        :param ssh: Client returned by acquire
+        :return: SFTPClient
+        """
+        with self.condition:
+            connection = self.leased.get(id(ssh))
+        if not connection:
+            return open_sftp(ssh.get_transport())
+        if not connection.sftp or connection.sftp.sock.closed:
+            connection.sftp = open_sftp(ssh.get_transport())
+        return connection.sftp
+
+    def evict_idle(self) -> int:
+        """Close the connections idle for longer than idle_timeout
+
+        :return: Number of closed connections
+        """
+        with self.condition:
+            expired_list = self._pop_expired()
+        for connection in expired_list:
+            connection.close()
+        return len(expired_list)
+
+    def close_all(self):
+        """Close all the idle connections. Leased connections are not affected"""
+        with self.condition:
+            idle_list = [connection for connections in self.idle.values() for connection in connections]
+            for connection in idle_list:
+                self.sessions_count[connection.key] -= 1
+            self.idle = {}
+            for key in [key for key, count in self.sessions_count.items() if not count]:
+                del self.sessions_count[key]
+            self.condition.notify_all()
+        for connection in idle_list:
+            connection.close()
+
+    def stats(self) -> dict:
+        """Returns the pool counters with the current number of leased and idle connections"""
+        with self.condition:
+            return dict(self.counters, leased=len(self.leased),
+                        idle=sum(len(connections) for connections in self.idle.values()))
+
+
+default_pool = SshConnectionPool()  # Process wide pool used by ssh_utils and SshHelper
+atexit.register(default_pool.close_all)
@@ -0,0 +1,611 @@
+import os
+import re
+import json
+import uuid
+import stat
+import time
+import shlex
+import hashlib
+import tarfile
+import platform
+import posixpath
+import threading
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+arch = platform.machine().lower()
+ARM_PROCESSOR = "arm" in arch or "aarch" in arch
+if not ARM_PROCESSOR:
+    from paramiko import SFTPClient
+
+from pybenutils.utils_logger.config_logger import get_logger
+
+logger = get_logger()
+
+SFTP_WINDOW_SIZE = 64 * 1024 * 1024  # Paramiko's default 2MB window stalls the stream on high latency links
+SFTP_MAX_PACKET_SIZE = 32 * 1024
+SFTP_BLOCK_SIZE = 1024 * 1024  # Local read / write size, sent as pipelined 32KB sftp requests
+SFTP_MAX_PREFETCH_REQUESTS = 256  # Read requests kept in flight per downloaded file
+TAR_COMPRESSION_FLAGS = {'': '', 'gz': '-z', 'bz2': '-j', 'xz': '-J'}
+# sha256sum and shasum escape a path holding a backslash or a newline (the line then starts with a backslash)
+HASH_PATH_ESCAPES = {'\\': '\\', 'n': '\n', 'r': '\r'}
+HASH_PATH_ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+
+def open_sftp(transport, window_size=SFTP_WINDOW_SIZE, max_packet_size=SFTP_MAX_PACKET_SIZE) -> 'SFTPClient':
+    """Open an sftp session with a large channel window on the given transport
+
+    :param transport: Active paramiko transport (ssh.get_transport())
+    :param window_size: Channel window size in bytes
+    :param max_packet_size: Channel maximal packet size in bytes
+    :return: SFTPClient
+    """
+    return SFTPClient.from_transport(transport, window_size=window_size, max_packet_size=max_packet_size)
+
+
+def get_transfer_stats(path: str, size: int, start_time: float) -> dict:
+    """Returns the stats dict of a single finished transfer"""
+    seconds = time.time() - start_time
+    return {'path': path, 'bytes': size, 'seconds': seconds, 'throughput': size / seconds if seconds else 0}
+
+
+def sftp_put(sftp: 'SFTPClient', local_path: str, remote_path: str) -> dict:
+    """Upload a file with pipelined write requests (writes do not wait for the server acknowledgements)
+
+    :param sftp: SFTPClient
+    :param local_path: Local file path
+    :param remote_path: Remote file path
+    :return: Transfer stats {'path': str, 'bytes': int, 'seconds': float, 'throughput': float}
+    """
+    start_time = time.time()
+    size = 0
+    with open(local_path, 'rb') as local_file, sftp.open(remote_path, 'wb') as remote_file:
+        remote_file.set_pipelined(True)
+        for chunk in iter(lambda: local_file.read(SFTP_BLOCK_SIZE), b''):
+            remote_file.write(chunk)
+            size += len(chunk)
+    # Closing the remote file waits for all the pipelined acknowledgements
+    sftp.chmod(remote_path, stat.S_IMODE(os.stat(local_path).st_mode))
+    return get_transfer_stats(remote_path, size, start_time)
+
+
+def sftp_get(sftp: 'SFTPClient', remote_path: str, local_path: str) -> dict:
+    """Download a file with prefetch (many read requests in flight at the same time)
+
+    :param sftp: SFTPClient
+    :param remote_path: Remote file path
+    :param local_path: Local file path
+    :return: Transfer stats {'path': str, 'bytes': int, 'seconds': float, 'throughput': float}
+    """
+    start_time = time.time()
+    size = 0
+    with sftp.open(remote_path, 'rb') as remote_file, open(local_path, 'wb') as local_file:
+        remote_file.prefetch(remote_file.stat().st_size, max_concurrent_requests=SFTP_MAX_PREFETCH_REQUESTS)
+        for chunk in iter(lambda: remote_file.read(SFTP_BLOCK_SIZE), b''):
+            local_file.write(chunk)
+            size += len(chunk)
+    return get_transfer_stats(local_path, size, start_time)
+
+
+def sftp_makedirs(sftp: 'SFTPClient', remote_dir: str):
+    """Create a remote directory and its missing parents"""
+    if not remote_dir or remote_dir == '/':
+        return
+    try:
+        sftp.stat(remote_dir)
+    except IOError:
+        sftp_makedirs(sftp, posixpath.dirname(remote_dir.rstrip('/')))
+        sftp.mkdir(remote_dir)
+
+
+def sftp_is_dir(sftp: 'SFTPClient', remote_path: str) -> bool:
+    """Returns True if the remote path is an existing directory"""
+    try:
+        return stat.S_ISDIR(sftp.stat(remote_path).st_mode)
+    except IOError:
+        return False
+
+
+class SftpTransferEngine(object):
+    """High throughput sftp transfers over a single ssh connection. Every file is moved with pipelined requests and
+     a large channel window, and several files are moved at the same time, each worker thread using its own sftp
+     channel on the same transport (no extra handshakes)"""
+
+    def __init__(self, transport, max_workers=4, window_size=SFTP_WINDOW_SIZE, max_packet_size=SFTP_MAX_PACKET_SIZE):
+        """
+        :param transport: Active paramiko transport (ssh.get_transport())
+        :param max_workers: Number of files transferred at the same time
+        :param window_size: Sftp channel window size in bytes
+        :param max_packet_size: Sftp channel maximal packet size in bytes
+        """
+        self.transport = transport
+        self.max_workers = max_workers
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.local = threading.local()
+        self.sftp_list = []
+        self.lock = threading.Lock()
+
+    def get_sftp(self) -> 'SFTPClient':
+        """Returns the sftp client of the current thread, opening it on first use"""
+        if not getattr(self.local, 'sftp', None):
+            self.local.sftp = open_sftp(self.transport, window_size=self.window_size,
+                                        max_packet_size=self.max_packet_size)
+            with self.lock:
+                self.sftp_list.append(self.local.sftp)
+        return self.local.sftp
+
+    def _transfer(self, transfer_func, pairs: List[Tuple[str, str]], direction: str) -> dict:
+        """Run the given single file transfer function over all the pairs concurrently
+
+        :return: Summary {'files': [stats], 'bytes': int, 'seconds': float, 'throughput': float}
+        """
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            files_stats = list(executor.map(lambda pair: transfer_func(self.get_sftp(), *pair), pairs))
+        summary = get_transfer_stats('', sum(file_stats['bytes'] for file_stats in files_stats), start_time)
+        summary['files'] = files_stats
+        logger.info(f'{direction} {len(files_stats)} files, {summary["bytes"]} bytes in {summary["seconds"]:.2f}s '
+                    f'({summary["throughput"] / 1024 ** 2:.2f} MB/s)')
+        return summary
+
+    def put_files(self, pairs: List[Tuple[str, str]]) -> dict:
+        """Upload files concurrently
+
+        :param pairs: List of tuples (local path, remote path)
+        :return: Summary {'files': [stats], 'bytes': int, 'seconds': float, 'throughput': float}
+        """
+        return self._transfer(sftp_put, pairs, 'Uploaded')
+
+    def get_files(self, pairs: List[Tuple[str, str]]) -> dict:
+        """Download files concurrently
+
+        :param pairs: List of tuples (remote path, local path)
+        :return: Summary {'files': [stats], 'bytes': int, 'seconds': float, 'throughput': float}
+        """
+        for _, local_path in pairs:
+            if os.path.dirname(local_path):
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        return self._transfer(sftp_get, pairs, 'Downloaded')
+
+    def put(self, local_path: str, remote_path: str) -> dict:
+        """Upload a file or a directory tree (like scp -r: into remote_path/<name> if remote_path is an existing
+         directory, otherwise as remote_path)
+
+        :param local_path: Local file or directory
+        :param remote_path: Remote destination path
+        :return: Summary {'files': [stats], 'bytes': int, 'seconds': float, 'throughput': float}
+        """
+        sftp = self.get_sftp()
+        local_path = os.path.realpath(local_path)
+        if sftp_is_dir(sftp, remote_path):
+            remote_path = posixpath.join(remote_path, os.path.basename(local_path))
+        if not os.path.isdir(local_path):
+            return self.put_files([(local_path, remote_path)])
+        pairs = []
+        for root, _, files in os.walk(local_path):
+            remote_root = posixpath.join(remote_path, os.path.relpath(root, local_path).replace(os.sep, '/'))
+            sftp_makedirs(sftp, posixpath.normpath(remote_root))
+            pairs += [(os.path.join(root, name), posixpath.join(posixpath.normpath(remote_root), name))
+                      for name in files]
+        return self.put_files(pairs)
+
+    def get(self, remote_path: str, local_path: str) -> dict:
+        """Download a file or a directory tree (like scp -r: into local_path/<name> if local_path is an existing
+         directory, otherwise as local_path)
+
+        :param remote_path: Remote file or directory
+        :param local_path: Local destination path
+        :return: Summary {'files': [stats], 'bytes': int, 'seconds': float, 'throughput': float}
+        """
+        sftp = self.get_sftp()
+        local_path = local_path or '.'
+        if os.path.isdir(local_path):
+            local_path = os.path.join(local_path, posixpath.basename(remote_path.rstrip('/')))
+        if not sftp_is_dir(sftp, remote_path):
+            return self.get_files([(remote_path, local_path)])
+        pairs = []
+        folders = [(remote_path.rstrip('/'), local_path)]
+        while folders:
+            remote_dir, local_dir = folders.pop()
+            os.makedirs(local_dir, exist_ok=True)
+            for attr in sftp.listdir_attr(remote_dir):
+                remote_item = posixpath.join(remote_dir, attr.filename)
+                local_item = os.path.join(local_dir, attr.filename)
+                if stat.S_ISDIR(attr.st_mode):
+                    folders.append((remote_item, local_item))
+                else:
+                    pairs.append((remote_item, local_item))
+        return self.get_files(pairs)
+
+    def close(self):
+        """Close all the sftp channels opened by the engine. The transport itself is left open"""
+        with self.lock:
+            for sftp in self.sftp_list:
+                sftp.close()
+            self.sftp_list = []
+        self.local = threading.local()
+
+
+class _CountingFile(object):
+    """File like wrapper counting the bytes read or written through it"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.count += len(data)
+        return data
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.count += len(data)
+        return len(data)
+
+
+def _finish_tar_channel(channel, description: str):
+    """Wait for the remote tar to exit and raise an IOError with its stderr if it failed"""
+    status = channel.recv_exit_status()
+    stderr = b''
+    while channel.recv_stderr_ready():
+        stderr += channel.recv_stderr(32 * 1024)
+    channel.close()
+    if status:
+        raise IOError(f'{description} failed with exit code {status}: {stderr.decode(errors="replace").strip()}')
+
+
+def tar_put(ssh, local_path: str, remote_path: str, compression='') -> dict:
+    """Upload a directory tree as a single tar stream, extracted by the remote tar while it is being sent, instead of
+     a round trip per file. Symlinks and permissions are preserved. A single file is sent with sftp.
+     Like scp -r: into remote_path/<name> if remote_path is an existing directory, otherwise as remote_path
+
+    :param ssh: Connected SSHClient
+    :param local_path: Local directory (or file)
+    :param remote_path: Remote destination path
+    :param compression: '', 'gz', 'bz2' or 'xz'. Worth it on slow links, a waste of cpu on fast ones
+    :return: Transfer stats {'path': str, 'bytes': int, 'seconds': float, 'throughput': float}. The bytes are the
+     (compressed) bytes sent
+    """
+    start_time = time.time()
+    local_path = os.path.realpath(local_path)
+    if not os.path.isdir(local_path):
+        # The remote tar strips the root of the archive when remote_path is a new directory, which is the file itself
+        sftp = open_sftp(ssh.get_transport())
+        try:
+            if sftp_is_dir(sftp, remote_path):
+                remote_path = posixpath.join(remote_path, os.path.basename(local_path))
+            return sftp_put(sftp, local_path, remote_path)
+        finally:
+            sftp.close()
+    flag = TAR_COMPRESSION_FLAGS[compression]
+    quoted_target = shlex.quote(remote_path)
+    command = (f'if [ -d {quoted_target} ]; then tar -x -p {flag} -f - -C {quoted_target}; '
+               f'else mkdir -p {quoted_target} && tar -x -p {flag} -f - --strip-components=1 -C {quoted_target}; fi')
+    channel = ssh.get_transport().open_session()
+    channel.exec_command(command)
+    writer = _CountingFile(channel.makefile('wb'))
+    with tarfile.open(fileobj=writer, mode=f'w|{compression}') as tar:
+        tar.add(local_path, arcname=os.path.basename(local_path))  # Symlinks are archived as links
+    writer.fileobj.flush()
+    channel.shutdown_write()
+    _finish_tar_channel(channel, f'Remote tar extraction into {remote_path}')
+    stats = get_transfer_stats(remote_path, writer.count, start_time)
+    logger.info(f'Sent {local_path} as a tar stream: {stats["bytes"]} bytes in {stats["seconds"]:.2f}s '
+                f'({stats["throughput"] / 1024 ** 2:.2f} MB/s)')
+    return stats
+
+
+def tar_get(ssh, remote_path: str, local_path: str, compression='') -> dict:
+    """Download a directory tree as a single tar stream created by the remote tar, extracted locally while it is
+     received. Symlinks and permissions are preserved.
+     Like scp -r: into local_path/<name> if local_path is an existing directory, otherwise as local_path. Raises
+     IOError if the stream held nothing to extract
+
+    :param ssh: Connected SSHClient
+    :param remote_path: Remote directory (or file)
+    :param local_path: Local destination path
+    :param compression: '', 'gz', 'bz2' or 'xz'. Worth it on slow links, a waste of cpu on fast ones
+    :return: Transfer stats {'path': str, 'bytes': int, 'seconds': float, 'throughput': float}. The bytes are the
+     (compressed) bytes received
+    """
+    start_time = time.time()
+    remote_path = remote_path.rstrip('/') or '/'
+    local_path = local_path.rstrip(os.sep) or os.sep if local_path else '.'
+    strip_root = not os.path.isdir(local_path)
+    flag = TAR_COMPRESSION_FLAGS[compression]
+    command = (f'tar -c {flag} -f - -C {shlex.quote(posixpath.dirname(remote_path) or "/")} '
+               f'{shlex.quote(posixpath.basename(remote_path) or ".")}')
+    channel = ssh.get_transport().open_session()
+    channel.exec_command(command)
+    reader = _CountingFile(channel.makefile('rb'))
+    # The tar filter (python 3.12+ and security backports) refuses paths escaping the destination
+    extract_kwargs = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+    extracted = 0
+    with tarfile.open(fileobj=reader, mode=f'r|{compression}') as tar:
+        for member in tar:
+            extracted += 1
+            if strip_root and '/' not in member.name:  # The remote root itself
+                if member.isdir():
+                    os.makedirs(local_path)
+                else:  # A single file, saved as local_path
+                    member.name = os.path.basename(local_path)
+                    tar.extract(member, os.path.dirname(local_path) or '.', **extract_kwargs)
+                continue
+            if strip_root:
+                # Extract the remote directory content directly into local_path, like scp -r does
+                member.name = member.name.split('/', 1)[1]
+                if member.islnk():
+                    member.linkname = member.linkname.split('/', 1)[-1]
+            tar.extract(member, local_path, **extract_kwargs)
+    _finish_tar_channel(channel, f'Remote tar archiving of {remote_path}')
+    if not extracted:
+        raise IOError(f'The tar stream of {remote_path} had nothing to extract into {local_path}')
+    stats = get_transfer_stats(local_path, reader.count, start_time)
+    logger.info(f'Received {remote_path} as a tar stream: {stats["bytes"]} bytes in {stats["seconds"]:.2f}s '
+                f'({stats["throughput"] / 1024 ** 2:.2f} MB/s)')
+    return stats
+
+
+DELTA_BLOCK_SIZE = 1024 * 1024
+DELTA_MIN_SIZE = 8 * 1024 * 1024  # Smaller changed files are sent whole
+# Runs on the remote server: reads NUL separated paths from stdin, prints a json of {path: [block sha1, ...]}
+REMOTE_BLOCK_HASHES_SCRIPT = ('import sys, json, hashlib\n'
+                              'result = {}\n'
+                              'for path in sys.stdin.buffer.read().decode("utf-8", "surrogateescape").split("\\0"):\n'
+                              '    if not path:\n'
+                              '        continue\n'
+                              '    try:\n'
+                              '        with open(path, "rb") as f:\n'
+                              '            result[path] = [hashlib.sha1(b).hexdigest() for b in '
+                              'iter(lambda: f.read({block_size}), b"")]\n'
+                              '    except OSError:\n'
+                              '        pass\n'
+                              'print(json.dumps(result))\n')
+
+
+def _exec_with_input(ssh, command: str, input_data: bytes) -> Tuple[int, bytes]:
+    """Execute a command, send it the given stdin data and return its (exit status, stdout). Stderr is ignored"""
+    channel = ssh.get_transport().open_session()
+    channel.exec_command(command)
+    channel.sendall(input_data)
+    channel.shutdown_write()
+    stdout = channel.makefile('rb').read()
+    status = channel.recv_exit_status()
+    channel.close()
+    return status, stdout
+
+
+def get_local_hash(file_path: str) -> str:
+    """Returns the sha256 hex digest of a local file"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as local_file:
+        for chunk in iter(lambda: local_file.read(SFTP_BLOCK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_remote_hashes(ssh, remote_paths: List[str]) -> Dict[str, str]:
+    """Returns the sha256 of many remote files, computed by a single remote exec (sha256sum or shasum).
+     The paths are sent through stdin, so the command line length is not a limit
+
+    :param ssh: Connected SSHClient
+    :param remote_paths: Remote files paths
+    :return: Dict of {remote path: sha256 hex digest}. Missing files are not included
+    """
+    if not remote_paths:
+        return {}
+    command = ('if command -v sha256sum >/dev/null 2>&1; then xargs -0 sha256sum --; '
+               'else xargs -0 shasum -a 256 --; fi 2>/dev/null')
+    _, stdout = _exec_with_input(ssh, command, '\0'.join(remote_paths).encode('utf-8', 'surrogateescape'))
+    hashes = {}
+    for line in stdout.decode('utf-8', 'surrogateescape').split('\n'):
+        escaped = line.startswith('\\')
+        if escaped:
+            line = line[1:]
+        digest, path = line[:64], line[66:]  # "<digest>  <path>", or "<digest> *<path>" in binary mode
+        if not path:
+            continue
+        if escaped:
+            path = HASH_PATH_ESCAPE_PATTERN.sub(lambda match: HASH_PATH_ESCAPES.get(match[1], match[0]), path)
+        hashes[path] = digest
+    return hashes
+
+
+def get_remote_stats(sftp: 'SFTPClient', remote_paths: List[str]) -> Dict[str, Tuple[int, int]]:
+    """Returns the size and mtime of many remote files, with a single directory listing per directory
+
+    :param sftp: SFTPClient
+    :param remote_paths: Remote files paths
+    :return: Dict of {remote path: (size, mtime)}. Missing files are not included
+    """
+    folders = {}
+    for remote_path in remote_paths:
+        folders.setdefault(posixpath.dirname(remote_path), set()).add(posixpath.basename(remote_path))
+    stats = {}
+    for folder, names in folders.items():
+        try:
+            attrs = sftp.listdir_attr(folder or '.')
+        except IOError:
+            continue
+        for attr in attrs:
+            if attr.filename in names and not stat.S_ISDIR(attr.st_mode):
+                stats[posixpath.join(folder, attr.filename)] = (attr.st_size, attr.st_mtime)
+    return stats
+
+
+def get_remote_block_hashes(ssh, remote_paths: List[str]) -> Dict[str, List[str]]:
+    """Returns the sha1 of every DELTA_BLOCK_SIZE block of many remote files, computed by a single remote exec.
+     Requires python3 on the remote server, returns an empty dict if it is missing
+
+    :param ssh: Connected SSHClient
+    :param remote_paths: Remote files paths
+    :return: Dict of {remote path: [block sha1 hex digest]}
+    """
+    if not remote_paths:
+        return {}
+    script = REMOTE_BLOCK_HASHES_SCRIPT.replace('{block_size}', str(DELTA_BLOCK_SIZE))
+    status, stdout = _exec_with_input(ssh, f'python3 -c {shlex.quote(script)}',
+                                      '\0'.join(remote_paths).encode('utf-8', 'surrogateescape'))
+    if status:
+        logger.debug(f'Remote block hashing is not available (exit code {status}), sending whole files')
+        return {}
+    return json.loads(stdout.decode())
+
+
+def sftp_put_blocks(ssh, sftp: 'SFTPClient', local_path: str, remote_path: str,
+                    remote_block_hashes: List[str]) -> dict:
+    """Update a remote file, writing only the blocks that differ from the local file. The blocks are written into
+     a copy of the remote file made on the server, which then replaces the file with a rename, so a transfer that
+     fails midway leaves the remote file as it was
+
+    :param ssh: Connected SSHClient, to copy the remote file on the server
+    :param sftp: SFTPClient
+    :param local_path: Local file path
+    :param remote_path: Remote file path
+    :param remote_block_hashes: The remote file blocks sha1 (see get_remote_block_hashes)
+    :return: Transfer stats {'path': str, 'bytes': int, 'seconds': float, 'throughput': float}. The bytes are the
+     bytes actually sent
+    """
+    start_time = time.time()
+    sent = 0
+    local_size = os.path.getsize(local_path)
+    temp_path = posixpath.join(posixpath.dirname(remote_path),
+                               f'.{posixpath.basename(remote_path)}.{uuid.uuid4().hex[:8]}.part')
+    status, _ = _exec_with_input(ssh, f'cp -p -- {shlex.quote(remote_path)} {shlex.quote(temp_path)}', b'')
+    if status:
+        raise IOError(f'Failed to copy {remote_path} on the remote server (exit code {status})')
+    try:
+        with open(local_path, 'rb') as local_file, sftp.open(temp_path, 'r+b') as remote_file:
+            remote_file.set_pipelined(True)
+            for index, block in enumerate(iter(lambda: local_file.read(DELTA_BLOCK_SIZE), b'')):
+                remote_hash = remote_block_hashes[index] if index < len(remote_block_hashes) else None
+                if hashlib.sha1(block).hexdigest() == remote_hash:
+                    continue
+                remote_file.seek(index * DELTA_BLOCK_SIZE)
+                remote_file.write(block)
+                sent += len(block)
+            remote_file.truncate(local_size)
+        sftp.posix_rename(temp_path, remote_path)
+    except Exception:
+        try:
+            sftp.remove(temp_path)
+        except IOError:
+            pass
+        raise
+    return get_transfer_stats(remote_path, sent, start_time)
+
+
+def sync_files(ssh, pairs: List[Tuple[str, str]], compare='mtime', block_delta=False, max_workers=4) -> dict:
+    """Upload only the files that differ from their remote copy
+
+    :param ssh: Connected SSHClient
+    :param pairs: List of tuples (local path, remote path)
+    :param compare: How unchanged files are detected. 'size', 'mtime' (size and modification time, the remote
+     mtime is set to the local one after every upload) or 'hash' (size and sha256, all the remote hashes are
+     computed in a single remote exec)
+    :param block_delta: Changed files bigger than DELTA_MIN_SIZE are updated sending only the changed blocks, into
+     a server side copy that replaces the file once complete (see sftp_put_blocks). This finds changes that keep
+     the data offsets (patched binaries, appended logs), not insertions.
+     Requires python3 on the remote server, otherwise the whole files are sent
+    :param max_workers: Number of files uploaded at the same time
+    :return: Summary {'transferred': [remote path], 'delta': [remote path], 'skipped': [remote path],
+     'bytes': int, 'seconds': float, 'throughput': float}
+    """
+    start_time = time.time()
+    engine = SftpTransferEngine(ssh.get_transport(), max_workers=max_workers)
+    try:
+        sftp = engine.get_sftp()
+        remote_stats = get_remote_stats(sftp, [remote_path for _, remote_path in pairs])
+        changed_pairs = []
+        same_size_pairs = []
+        for local_path, remote_path in pairs:
+            local_stat = os.stat(local_path)
+            if remote_path not in remote_stats or remote_stats[remote_path][0] != local_stat.st_size:
+                changed_pairs.append((local_path, remote_path))
+            elif compare == 'mtime' and remote_stats[remote_path][1] != int(local_stat.st_mtime):
+                changed_pairs.append((local_path, remote_path))
+            elif compare == 'hash':
+                same_size_pairs.append((local_path, remote_path))
+        if same_size_pairs:
+            remote_hashes = get_remote_hashes(ssh, [remote_path for _, remote_path in same_size_pairs])
+            changed_pairs += [(local_path, remote_path) for local_path, remote_path in same_size_pairs
+                              if remote_hashes.get(remote_path) != get_local_hash(local_path)]
+
+        delta_pairs = []
+        if block_delta:
+            delta_candidates = [remote_path for local_path, remote_path in changed_pairs
+                                if remote_path in remote_stats and os.path.getsize(local_path) >= DELTA_MIN_SIZE]
+            block_hashes = get_remote_block_hashes(ssh, delta_candidates)
+            delta_pairs = [pair for pair in changed_pairs if pair[1] in block_hashes]
+            changed_pairs = [pair for pair in changed_pairs if pair[1] not in block_hashes]
+
+        changed_set = {remote_path for _, remote_path in changed_pairs + delta_pairs}
+        skipped = [remote_path for _, remote_path in pairs if remote_path not in changed_set]
+        sent = engine.put_files(changed_pairs)['bytes'] if changed_pairs else 0
+        for local_path, remote_path in delta_pairs:
+            sent += sftp_put_blocks(ssh, sftp, local_path, remote_path, block_hashes[remote_path])['bytes']
+        for local_path, remote_path in changed_pairs + delta_pairs:
+            local_stat = os.stat(local_path)
+            sftp.utime(remote_path, (local_stat.st_atime, local_stat.st_mtime))
+    finally:
+        engine.close()
+    summary = get_transfer_stats('', sent, start_time)
+    summary.update({'transferred': [remote_path for _, remote_path in changed_pairs],
+                    'delta': [remote_path for _, remote_path in delta_pairs],
+                    'skipped': skipped})
+    logger.info(f'Synced {len(pairs)} files: {len(changed_pairs)} sent, {len(delta_pairs)} delta updated, '
+                f'{len(skipped)} unchanged. {sent} bytes in {summary["seconds"]:.2f}s')
+    return summary
+
+
+def sync_directory(ssh, local_dir: str, remote_dir: str, compare='mtime', block_delta=False, max_workers=4) -> dict:
+    """Upload the content of a local directory tree into a remote directory, skipping unchanged files (see sync_files)
+
+    :param ssh: Connected SSHClient
+    :param local_dir: Local directory
+    :param remote_dir: Remote directory, created if missing
+    :param compare: 'size', 'mtime' or 'hash' (see sync_files)
+    :param block_delta: Send only the changed blocks of big changed files (see sync_files)
+    :param max_workers: Number of files uploaded at the same time
+    :return: Summary (see sync_files)
+    """
+    local_dir = os.path.realpath(local_dir)
+    pairs = []
+    remote_dirs = []
+    for root, _, files in os.walk(local_dir):
+        remote_root = posixpath.normpath(posixpath.join(remote_dir,
+                                                        os.path.relpath(root, local_dir).replace(os.sep, '/')))
+        remote_dirs.append(remote_root)
+        pairs += [(os.path.join(root, name), posixpath.join(remote_root, name)) for name in files]
+    sftp = open_sftp(ssh.get_transport())
+    try:
+        for remote_root in remote_dirs:
+            sftp_makedirs(sftp, remote_root)
+    finally:
+        sftp.close()
+    return sync_files(ssh, pairs, compare=compare, block_delta=block_delta, max_workers=max_workers)
+
+
+def sync_put(ssh, local_path: str, remote_path: str, compare='mtime', block_delta=True) -> dict:
+    """Upload a file or a directory tree, skipping unchanged files (see sync_files).
+     Like scp -r: into remote_path/<name> if remote_path is an existing directory, otherwise as remote_path
+
+    :param ssh: Connected SSHClient
+    :param local_path: Local file or directory
+    :param remote_path: Remote destination path
+    :param compare: 'size', 'mtime' or 'hash' (see sync_files)
+    :param block_delta: Send only the changed blocks of big changed files (see sync_files)
+    :return: Summary (see sync_files)
+    """
+    local_path = os.path.realpath(local_path)
+    sftp = open_sftp(ssh.get_transport())
+    try:
+        if sftp_is_dir(sftp, remote_path):
+            remote_path = posixpath.join(remote_path, os.path.basename(local_path))
+    finally:
+        sftp.close()
+    if os.path.isdir(local_path):
+        return sync_directory(ssh, local_path, remote_path, compare=compare, block_delta=block_delta)
+    return sync_files(ssh, [(local_path, remote_path)], compare=compare, block_delta=block_delta)
@@ -1,11 +1,23 @@
 import platform
 import sys
 import json
+import time
+import codecs
+import select
+import socket
+import uuid
+import shlex
 import argparse
-from typing import List
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from scp import SCPClient
 
 from pybenutils.useful import str2bool
+from pybenutils.network.ssh_pool import default_pool, set_tcp_nodelay
+from pybenutils.network.ssh_transfer import SftpTransferEngine, sync_put, tar_get, tar_put
 
 arch = platform.machine().lower()
 ARM_PROCESSOR = "arm" in arch or "aarch" in arch
@@ -16,6 +28,286 @@ from pybenutils.utils_logger.config_logger import get_logger
 
 logger = get_logger()
 
+STREAM_READ_SIZE = 32 * 1024
+STREAM_MAX_LINE_LENGTH = 64 * 1024  # Longer lines are handed over in pieces to keep the memory bounded
+STREAM_TAIL_LINES = 20  # Number of last lines of each stream kept in the return object in streaming mode
+TRANSFER_COMMAND_PREFIXES = ('RECURSIVE-GET', 'GET', 'RECURSIVE-PUT', 'PUT')
+HOST_TIMEOUT_GRACE = 5  # Seconds a server past its host_timeout gets to wind down before it is abandoned
+# Batch script helpers. Every command output is kept in temp files and emitted as a frame once it finished:
+# "<token> <index> <exit status> <duration ns> <stdout length> <stderr length>\n<stdout><stderr>"
+BATCH_SCRIPT_PRELUDE = '''__d=$(mktemp -d 2>/dev/null || mktemp -d -t pybenutils)
+trap 'rm -rf "$__d"' EXIT
+__now() { __t=$(date +%s%N 2>/dev/null); case "$__t" in *N|'') echo $(( $(date +%s) * 1000000000 ));; \
+*) echo "$__t";; esac; }
+__frame() { __e=$(__now); printf '%s %s %s %s %s %s\\n' "$1" "$2" "$3" "$(( __e - $4 ))" \
+"$(wc -c < "$__d/o" | tr -d ' ')" "$(wc -c < "$__d/e" | tr -d ' ')"; cat "$__d/o" "$__d/e"; }
+'''
+
+
+def iter_channel_chunks(channel, timeout=None) -> Iterator[Tuple[str, bytes]]:
+    """Yields the stdout and stderr data of an exec channel as it arrives, until the command exits.
+     Both streams are drained together, so a command filling its stderr window never blocks its stdout
+
+    :param channel: Paramiko channel the command was executed on
+    :param timeout: Seconds to wait for new data before raising socket.timeout. None to wait forever
+    :return: Iterator of tuples ('stdout' / 'stderr', data)
+    """
+    while True:
+        got_data = False
+        if channel.recv_ready():
+            data = channel.recv(STREAM_READ_SIZE)
+            if data:
+                got_data = True
+                yield 'stdout', data
+        if channel.recv_stderr_ready():
+            data = channel.recv_stderr(STREAM_READ_SIZE)
+            if data:
+                got_data = True
+                yield 'stderr', data
+        if got_data:
+            continue
+        if (channel.exit_status_ready() or channel.closed) and not channel.recv_ready() and \
+                not channel.recv_stderr_ready():
+            return
+        # The channel fileno becomes readable on new stdout or stderr data and on close
+        readable, _, _ = select.select([channel], [], [], timeout)
+        if not readable and timeout is not None:
+            raise socket.timeout(f'No output was received for {timeout} seconds')
+
+
+def iter_channel_lines(channel, timeout=None) -> Iterator[Tuple[str, str]]:
+    """Yields the stdout and stderr lines (without the line break) of an exec channel as they arrive
+
+    :param channel: Paramiko channel the command was executed on
+    :param timeout: Seconds to wait for new data before raising socket.timeout. None to wait forever
+    :return: Iterator of tuples ('stdout' / 'stderr', line)
+    """
+    decoders = {'stdout': codecs.getincrementaldecoder('utf-8')('replace'),
+                'stderr': codecs.getincrementaldecoder('utf-8')('replace')}
+    partial_lines = {'stdout': '', 'stderr': ''}
+    for stream, data in iter_channel_chunks(channel, timeout=timeout):
+        lines = (partial_lines[stream] + decoders[stream].decode(data)).split('\n')
+        partial_lines[stream] = lines.pop()
+        for line in lines:
+            yield stream, line
+        while len(partial_lines[stream]) > STREAM_MAX_LINE_LENGTH:
+            yield stream, partial_lines[stream][:STREAM_MAX_LINE_LENGTH]
+            partial_lines[stream] = partial_lines[stream][STREAM_MAX_LINE_LENGTH:]
+    for stream, decoder in decoders.items():
+        line = partial_lines[stream] + decoder.decode(b'', final=True)
+        if line:
+            yield stream, line
+
+
+def iter_command_output(ssh: 'SSHClient', command: str, command_timeout=None) -> Iterator[Tuple[str, str]]:
+    """Execute a command and yield its stdout and stderr lines as they arrive, with bounded memory
+
+    :param ssh: Connected SSHClient
+    :param command: Command to execute
+    :param command_timeout: Seconds to wait for new output before raising socket.timeout
+    :return: Iterator of tuples ('stdout' / 'stderr', line)
+    """
+    ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command(command, timeout=command_timeout)
+    ssh_stdin.close()
+    yield from iter_channel_lines(ssh_stdout.channel, timeout=command_timeout)
+
+
+def stream_command(ssh: 'SSHClient', command: str, output_callback: Callable[[str, str], None],
+                   command_timeout=None) -> int:
+    """Execute a command and hand its stdout and stderr lines to a callback as they arrive, with bounded memory
+
+    :param ssh: Connected SSHClient
+    :param command: Command to execute
+    :param output_callback: Callable receiving (stream name - 'stdout' / 'stderr', line)
+    :param command_timeout: Seconds to wait for new output before raising socket.timeout
+    :return: The command exit status
+    """
+    ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command(command, timeout=command_timeout)
+    ssh_stdin.close()
+    for stream, line in iter_channel_lines(ssh_stdout.channel, timeout=command_timeout):
+        output_callback(stream, line)
+    return ssh_stdout.channel.recv_exit_status()
+
+
+def connect(server: str, username: str, password: str, **kwargs) -> 'SSHClient':
+    """Returns a connected ssh client
+
+    :param server: Remote server ip
+    :param username: Remote server username
+    :param password: Remote server password
+    :param kwargs: Arguments to pass to ssh.connect
+    :return: Connected SSHClient
+    """
+    ssh = SSHClient()
+    ssh.set_missing_host_key_policy(AutoAddPolicy())
+    print(f'Connecting to {server}')
+    ssh.connect(server, username=username, password=password, **kwargs)
+    set_tcp_nodelay(ssh.get_transport())
+    return ssh
+
+
+@contextmanager
+def get_client(server: str, username: str, password: str, use_pool=True, **kwargs):
+    """Context manager of a connected ssh client, leased from the process wide pool or opened and closed for the
+     block only
+
+    :param server: Remote server ip
+    :param username: Remote server username
+    :param password: Remote server password
+    :param use_pool: Lease the client from ssh_pool.default_pool
+    :param kwargs: Arguments to pass to ssh.connect
+    :return: Connected SSHClient
+    """
+    if use_pool:
+        with default_pool.lease(server, username, password, **kwargs) as ssh:
+            yield ssh
+    else:
+        ssh = connect(server, username, password, **kwargs)
+        try:
+            yield ssh
+        finally:
+            ssh.close()
+
+
+def parse_transfer_command(command: str) -> Tuple[str, str]:
+    """Returns the (source, target) of a GET / PUT special command (see run_commands). The target is empty if the
+     command has no TO part"""
+    source, _, target = command.split(' ', 1)[-1].partition(' TO ')
+    return source.strip(), target.strip()
+
+
+def execute_command(ssh: 'SSHClient', command: str, command_timeout=None,
+                    output_callback: Callable[[str, str, str], None] = None, transfer_mode='scp',
+                    skip_unchanged: Union[bool, str] = False) -> dict:
+    """Execute a single command (or special transfer command, see run_commands) on a connected ssh client
+
+    :param ssh: Connected SSHClient
+    :param command: Command to execute
+    :param command_timeout: Seconds to wait for the command output before raising socket.timeout
+    :param output_callback: Streaming mode. Callable receiving (command, stream name, line) for every output line
+     as it arrives. The return object then holds only the last STREAM_TAIL_LINES lines of each stream
+    :param transfer_mode: Protocol of the GET / PUT special commands: 'scp', 'sftp' (see SftpTransferEngine) or
+     'tar' / 'tar.gz' / 'tar.bz2' / 'tar.xz' to move RECURSIVE-GET / RECURSIVE-PUT directories as a single tar
+     stream (see tar_put). Single files are moved with sftp in the tar modes
+    :param skip_unchanged: PUT / RECURSIVE-PUT send only the files that differ from their remote copy, compared by
+     'size', 'mtime' (True) or 'hash'. Big changed files are updated block by block when possible (see sync_files)
+    :return: Return object {'ssh_stdin': str, 'ssh_stdout': str, 'ssh_stderr': str, 'exit_status': int}
+    """
+    is_get = command.startswith('RECURSIVE-GET') or command.startswith('GET')
+    is_put = command.startswith('RECURSIVE-PUT') or command.startswith('PUT')
+    if is_put and skip_unchanged:
+        source, target = parse_transfer_command(command)
+        summary = sync_put(ssh, source, target, compare=skip_unchanged if isinstance(skip_unchanged, str) else 'mtime')
+        return {'ssh_stdin': command,
+                'ssh_stdout': f'success ({len(summary["transferred"])} sent, {len(summary["delta"])} delta updated, '
+                              f'{len(summary["skipped"])} unchanged)',
+                'ssh_stderr': '',
+                'exit_status': 0}
+    if (is_get or is_put) and command.startswith('RECURSIVE-') and transfer_mode.startswith('tar'):
+        source, target = parse_transfer_command(command)
+        compression = transfer_mode.split('.', 1)[1] if '.' in transfer_mode else ''
+        if is_get:
+            tar_get(ssh, source, target, compression=compression)
+        else:
+            tar_put(ssh, source, target, compression=compression)
+        return {'ssh_stdin': command, 'ssh_stdout': 'success', 'ssh_stderr': '', 'exit_status': 0}
+    if (is_get or is_put) and transfer_mode != 'scp':
+        source, target = parse_transfer_command(command)
+        engine = SftpTransferEngine(ssh.get_transport())
+        try:
+            summary = engine.get(source, target) if is_get else engine.put(source, target)
+        finally:
+            engine.close()
+        logger.debug(f'{command}: {summary["bytes"]} bytes, {summary["throughput"] / 1024 ** 2:.2f} MB/s')
+        return {'ssh_stdin': command, 'ssh_stdout': 'success', 'ssh_stderr': '', 'exit_status': 0}
+    if is_get:
+        with SCPClient(ssh.get_transport(), socket_timeout=command_timeout or 10.0) as scp:
+            source, target = parse_transfer_command(command)
+            scp.get(source, target or '', recursive=command.startswith('RECURSIVE-'))
+        return {'ssh_stdin': command, 'ssh_stdout': 'success', 'ssh_stderr': '', 'exit_status': 0}
+    if is_put:
+        with SCPClient(ssh.get_transport(), socket_timeout=command_timeout or 10.0) as scp:
+            source, target = parse_transfer_command(command)
+            scp.put(source, target, recursive=command.startswith('RECURSIVE-'))
+        return {'ssh_stdin': command, 'ssh_stdout': 'success', 'ssh_stderr': '', 'exit_status': 0}
+    ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command(command, timeout=command_timeout)
+    channel = ssh_stdout.channel
+    if output_callback:
+        tails = {'stdout': deque(maxlen=STREAM_TAIL_LINES), 'stderr': deque(maxlen=STREAM_TAIL_LINES)}
+        for stream, line in iter_channel_lines(channel, timeout=command_timeout):
+            tails[stream].append(line)
+            output_callback(command, stream, line)
+        stdout = '\n'.join(tails['stdout'])
+        stderr = '\n'.join(tails['stderr'])
+    else:
+        outputs = {'stdout': [], 'stderr': []}
+        for stream, data in iter_channel_chunks(channel, timeout=command_timeout):
+            outputs[stream].append(data)
+        stdout = b''.join(outputs['stdout']).decode()
+        stderr = b''.join(outputs['stderr']).decode()
+    return {'ssh_stdin': command,
+            'ssh_stdout': stdout,
+            'ssh_stderr': stderr,
+            'exit_status': channel.recv_exit_status()}
+
+
+def run_commands_on_client(ssh: 'SSHClient',
+                           commands: List[str],
+                           stop_on_exception=False,
+                           stop_on_error=False,
+                           command_timeout=None,
+                           should_stop: Callable[[], bool] = None,
+                           max_channels=1,
+                           output_callback: Callable[[str, str, str], None] = None,
+                           transfer_mode='scp',
+                           skip_unchanged: Union[bool, str] = False) -> List[dict]:
+    """Execute the given commands on a connected ssh client. See run_commands
+
+    :param ssh: Connected SSHClient
+    :param commands: List of commands to execute
+    :param stop_on_exception: Will stop executing commands if an exception occurred
+    :param stop_on_error: Will stop executing commands if an execution returned an stderr string
+    :param command_timeout: Seconds to wait for each command output
+    :param should_stop: Callable checked before every command, the run stops when it returns True
+    :param max_channels: Number of commands to run at the same time, each in its own channel over the same
+     connection. 1 runs the commands one after the other. When running in parallel, stopping only prevents new
+     commands from starting. Keep it under the server sshd MaxSessions (10 by default)
+    :param output_callback: Streaming mode, see execute_command
+    :param transfer_mode: Protocol of the GET / PUT special commands, see execute_command
+    :param skip_unchanged: Send only changed files on PUT, see execute_command
+    :return: List of return objects [{'ssh_stdin': str, 'ssh_stdout': str, 'ssh_stderr': str, 'exit_status': int}],
+     in the commands order
+    """
+    stop_event = threading.Event()
+
+    def _run_command(command: str):
+        """Run a single command, returns None if the run was stopped before it started"""
+        if stop_event.is_set() or (should_stop and should_stop()):
+            return None
+        try:
+            response = execute_command(ssh, command, command_timeout=command_timeout,
+                                       output_callback=output_callback, transfer_mode=transfer_mode,
+                                       skip_unchanged=skip_unchanged)
+            try:
+                print(response)
+            except Exception as e:
+                print(e)
+            if stop_on_error and response['ssh_stderr']:
+                stop_event.set()
+        except Exception as ex:
+            response = {'ssh_stdin': command, 'ssh_stdout': '', 'ssh_stderr': str(ex), 'exit_status': -1}
+            print(response)
+            if stop_on_exception:
+                stop_event.set()
+        return response
+
+    if max_channels > 1:
+        with ThreadPoolExecutor(max_workers=max_channels) as executor:
+            transition_responses = list(executor.map(_run_command, commands))
+    else:
+        transition_responses = [_run_command(command) for command in commands]
+    return [response for response in transition_responses if response is not None]
+
 
 def run_commands(server: str,
                  username: str,
@@ -23,11 +315,17 @@ def run_commands(server: str,
                  commands: List[str],
                  stop_on_exception=False,
                  stop_on_error=False,
+                 command_timeout=None,
+                 max_channels=1,
+                 output_callback: Callable[[str, str, str], None] = None,
+                 transfer_mode='scp',
+                 skip_unchanged: Union[bool, str] = False,
+                 use_pool=True,
                  **kwargs):
     """Execute the given commands through ssh connection
 
      Special commands:
-      - RECURSIVE-PUT file_path/folder_path [To local_path] - Copy the target from remote to local recursively
+      - RECURSIVE-GET file_path/folder_path [To local_path] - Copy the target from remote to local recursively
       - GET file_path/folder_path [To local_path] - Copy the target from remote to local
       - RECURSIVE-PUT file_path/folder_path TO remote_path - Sends file from local to remote recursively
       - PUT file_path/folder_path TO remote_path - Sends file from local to remote
@@ -38,53 +336,279 @@ def run_commands(server: str,
     :param commands: List of commands to execute
     :param stop_on_exception: Will stop executing commands if an exception occurred
     :param stop_on_error: Will stop executing commands if an execution returned an stderr string
+    :param command_timeout: Seconds to wait for each command output before failing it
+    :param max_channels: Run up to this many independent commands at the same time, in parallel channels over the
+     single connection. The results keep the commands order
+    :param output_callback: Streaming mode. Callable receiving (command, stream name - 'stdout' / 'stderr', line)
+     for every output line as it arrives, so the memory stays bounded for commands with huge outputs. The return
+     objects then hold only the last lines of each stream
+    :param transfer_mode: Protocol of the GET / PUT special commands. 'scp', 'sftp' for pipelined transfers
+     with a large window that move the files of a directory concurrently over the same connection, or 'tar' /
+     'tar.gz' / 'tar.bz2' / 'tar.xz' to move RECURSIVE-GET / RECURSIVE-PUT directories as a single tar stream
+     (symlinks and permissions are preserved, requires tar on the remote server)
+    :param skip_unchanged: PUT / RECURSIVE-PUT send only the files that differ from their remote copy, compared by
+     'size', 'mtime' (True) or 'hash' (hashes computed remotely in a single exec). Big changed files are updated
+     block by block when python3 is available on the remote server
+    :param use_pool: Lease the connection from the process wide pool (see ssh_pool), so repeated calls to the same
+     server reuse an authenticated connection instead of a new handshake
     :param kwargs: Arguments to pass to ssh.connect
-    :return: List of return objects [{'ssh_stdin': str, 'ssh_stdout': str, 'ssh_stderr': str}]
+    :return: List of return objects [{'ssh_stdin': str, 'ssh_stdout': str, 'ssh_stderr': str, 'exit_status': int}]
     """
-    transition_responses = []
-    ssh = SSHClient()
-    ssh.set_missing_host_key_policy(AutoAddPolicy())
-    print(f'Connecting to {server}')
-    ssh.connect(server, username=username, password=password, **kwargs)
+    with get_client(server, username, password, use_pool=use_pool, **kwargs) as ssh:
+        return run_commands_on_client(ssh, commands, stop_on_exception=stop_on_exception,
+                                      stop_on_error=stop_on_error, command_timeout=command_timeout,
+                                      max_channels=max_channels, output_callback=output_callback,
+                                      transfer_mode=transfer_mode, skip_unchanged=skip_unchanged)
+
+
+def compile_batch_script(commands: List[str], token: str, stop_on_error=False) -> str:
+    """Compile a command list into a single shell script emitting framed per command results (see
+     parse_batch_output). Every command runs in its own shell, like it would in its own exec channel
+
+    :param commands: List of shell commands (no special transfer commands)
+    :param token: Unique frame marker
+    :param stop_on_error: Stop the script after the first command that wrote to its stderr
+    :return: Script text, to be run by sh
+    """
+    lines = [BATCH_SCRIPT_PRELUDE]
+    for index, command in enumerate(commands):
+        lines.append(f'__s=$(__now); "${{SHELL:-/bin/sh}}" -c {shlex.quote(command)} >"$__d/o" 2>"$__d/e" </dev/null; '
+                     f'__frame {token} {index} $? $__s')
+        if stop_on_error:
+            lines.append('[ -s "$__d/e" ] && exit 0')
+    return '\n'.join(lines) + '\n'
+
+
+def parse_batch_output(data: bytes, token: str, commands: List[str]) -> List[dict]:
+    """Parse the framed output of a batch script (see compile_batch_script)
+
+    :param data: The script stdout
+    :param token: The frame marker the script was compiled with
+    :param commands: The compiled commands list
+    :return: List of return objects [{'ssh_stdin': str, 'ssh_stdout': str, 'ssh_stderr': str, 'exit_status': int,
+     'duration': float}] for the commands that ran
+    """
+    responses = []
+    header_prefix = token.encode() + b' '
+    position = 0
+    while True:
+        header_start = data.find(header_prefix, position)
+        if header_start == -1:
+            break
+        header_end = data.index(b'\n', header_start)
+        _, index, exit_status, duration, stdout_length, stderr_length = data[header_start:header_end].split()
+        stdout_start = header_end + 1
+        stderr_start = stdout_start + int(stdout_length)
+        position = stderr_start + int(stderr_length)
+        responses.append({'ssh_stdin': commands[int(index)],
+                          'ssh_stdout': data[stdout_start:stderr_start].decode(errors='replace'),
+                          'ssh_stderr': data[stderr_start:position].decode(errors='replace'),
+                          'exit_status': int(exit_status),
+                          'duration': int(duration) / 10 ** 9})
+    return responses
+
+
+def run_batch_on_client(ssh: 'SSHClient', commands: List[str], stop_on_error=False, command_timeout=None,
+                        **kwargs) -> List[dict]:
+    """Execute a command list as a single remote script, one round trip instead of one per command.
+     Special transfer commands (see run_commands) split the list: they run on their own between the batches
+
+    :param ssh: Connected SSHClient
+    :param commands: List of commands to execute
+    :param stop_on_error: Stop after the first command that returned an stderr string. Enforced by the remote script
+    :param command_timeout: Seconds to wait for each command to finish
+    :param kwargs: Arguments to pass to execute_command for the special transfer commands
+    :return: List of return objects [{'ssh_stdin': str, 'ssh_stdout': str, 'ssh_stderr': str, 'exit_status': int,
+     'duration': float}]
+    """
+    responses = []
+    segments = []
     for command in commands:
+        if command.startswith(TRANSFER_COMMAND_PREFIXES):
+            segments.append(command)
+        elif segments and isinstance(segments[-1], list):
+            segments[-1].append(command)
+        else:
+            segments.append([command])
+    for segment in segments:
+        if isinstance(segment, str):
+            try:
+                responses.append(execute_command(ssh, segment, command_timeout=command_timeout, **kwargs))
+            except Exception as ex:
+                responses.append({'ssh_stdin': segment, 'ssh_stdout': '', 'ssh_stderr': str(ex), 'exit_status': -1})
+        else:
+            token = f'__PYBENUTILS_FRAME_{uuid.uuid4().hex}__'
+            ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command('sh -s', timeout=command_timeout)
+            ssh_stdin.write(compile_batch_script(segment, token, stop_on_error=stop_on_error))
+            ssh_stdin.channel.shutdown_write()
+            output = b''.join(data for stream, data in iter_channel_chunks(ssh_stdout.channel, timeout=command_timeout)
+                              if stream == 'stdout')
+            ssh_stdout.channel.recv_exit_status()
+            segment_responses = parse_batch_output(output, token, segment)
+            responses += segment_responses
+            if len(segment_responses) < len(segment):
+                if not stop_on_error or not segment_responses or not segment_responses[-1]['ssh_stderr']:
+                    raise IOError(f'The batch script stopped after {len(segment_responses)} of {len(segment)} '
+                                  f'commands')
+        if stop_on_error and responses[-1]['ssh_stderr']:
+            break
+    return responses
+
+
+def run_commands_batch(server: str,
+                       username: str,
+                       password: str,
+                       commands: List[str],
+                       stop_on_error=False,
+                       command_timeout=None,
+                       use_pool=True,
+                       **kwargs) -> List[dict]:
+    """Execute the given commands through ssh connection as a single remote script (see run_batch_on_client).
+     The results are the same as run_commands, with the duration of each command in seconds
+
+    :param server: Remote server ip
+    :param username: Remote server username
+    :param password: Remote server password
+    :param commands: List of commands to execute. Special commands are supported (see run_commands)
+    :param stop_on_error: Will stop executing commands if an execution returned an stderr string
+    :param command_timeout: Seconds to wait for each command to finish
+    :param use_pool: Lease the connection from the process wide pool (see run_commands)
+    :param kwargs: Arguments to pass to ssh.connect
+    :return: List of return objects [{'ssh_stdin': str, 'ssh_stdout': str, 'ssh_stderr': str, 'exit_status': int,
+     'duration': float}]
+    """
+    with get_client(server, username, password, use_pool=use_pool, **kwargs) as ssh:
+        return run_batch_on_client(ssh, commands, stop_on_error=stop_on_error, command_timeout=command_timeout)
+
+
+def run_commands_on_hosts(hosts: List[dict],
+                          commands: List[str] = None,
+                          max_workers=20,
+                          host_timeout=None,
+                          fail_fast=False,
+                          stop_on_exception=False,
+                          stop_on_error=False,
+                          max_channels=1,
+                          use_pool=False,
+                          **kwargs) -> Dict[str, dict]:
+    """Execute a command list on many servers in parallel, with a bounded number of concurrent connections.
+     The commands of each server run one after the other (see run_commands)
+
+    :param hosts: List of dicts with the keys: server, username, password. Optional: commands (overrides the shared
+     commands list) and any ssh.connect argument. Each server may appear once
+    :param commands: List of commands to execute on every server
+    :param max_workers: Maximal number of servers handled at the same time
+    :param host_timeout: Seconds each server is given for connecting and running all of its commands, from the
+     moment it is started. The connection is closed when they pass, and a server still not done
+     HOST_TIMEOUT_GRACE seconds later is abandoned with a timeout status. The call returns without it, but its
+     worker thread is left running (e.g. blocked in a connect or a local file operation) and the interpreter still
+     waits for it on exit
+    :param fail_fast: Stop all the servers (between commands) and skip the ones not started yet after the first
+     server that failed
+    :param stop_on_exception: Will stop executing a server commands if an exception occurred
+    :param stop_on_error: Will stop executing a server commands if an execution returned an stderr string
+    :param max_channels: Number of commands to run at the same time on each server (see run_commands_on_client)
+    :param use_pool: Lease the connections from the process wide pool (see run_commands). Repeated fan-outs to the
+     same servers then skip the handshakes, at the cost of an idle connection per server kept open for
+     SshConnectionPool.IDLE_TIMEOUT seconds. Off by default, a fan-out is usually a one shot
+    :param kwargs: Arguments to pass to ssh.connect for all the servers
+    :return: Dict of {server: {'status': str, 'responses': list, 'error': str, 'duration': float}}.
+     The status is one of: success, failed (a command failed), error (connection failed), timeout, cancelled
+    """
+    servers = [host_conf['server'] for host_conf in hosts]
+    duplicates = sorted(server for server, count in Counter(servers).items() if count > 1)
+    if duplicates:
+        raise ValueError(f'Servers given more than once: {", ".join(duplicates)}')
+    stop_event = threading.Event()
+    start_times = {}  # Server to the time its worker started it
+
+    def _run_host(host_conf: dict) -> dict:
+        """Connect and run the commands of a single server, never raises"""
+        host_conf = dict(host_conf)
+        server = host_conf.pop('server')
+        username = host_conf.pop('username')
+        password = host_conf.pop('password')
+        host_commands = host_conf.pop('commands', commands) or []
+        connect_kwargs = dict(kwargs, **host_conf)
+        start_time = start_times[server] = time.time()
+        deadline = start_time + host_timeout if host_timeout else None
+        result = {'status': 'success', 'responses': [], 'error': '', 'duration': 0.0}
+        if stop_event.is_set():
+            result['status'] = 'cancelled'
+            return result
         try:
-            if command.startswith('RECURSIVE-GET') or command.startswith('GET'):
-                with SCPClient(ssh.get_transport()) as scp:
-                    source = command.split(' GET ', 1)[-1].split(' TO ', 1)[0].strip()
-                    target = command.split(' TO ', 1)[-1].strip()
-                    scp.get(source, target, recursive=command.startswith('RECURSIVE-'))
-                    transition_responses.append({'ssh_stdin': command,
-                                                 'ssh_stdout': 'success',
-                                                 'ssh_stderr': ''})
-                    print(transition_responses[-1])
-            elif command.startswith('RECURSIVE-PUT') or command.startswith('PUT'):
-                with SCPClient(ssh.get_transport()) as scp:
-                    source = command.split('PUT', 1)[-1].split(' TO ')[0].strip()
-                    target = command.split('PUT', 1)[-1].split(' TO ')[-1].strip()
-                    scp.put(source, target, recursive=command.startswith('RECURSIVE-'))
-                    transition_responses.append({'ssh_stdin': command,
-                                                 'ssh_stdout': 'success',
-                                                 'ssh_stderr': ''})
-                    print(transition_responses[-1])
-            else:
-                ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command(command)
-                stdout = ssh_stdout.read().decode()
-                stderr = ssh_stderr.read().decode()
-                transition_responses.append({'ssh_stdin': command,
-                                             'ssh_stdout': stdout,
-                                             'ssh_stderr': stderr})
+            if host_timeout:
+                connect_kwargs.setdefault('timeout', host_timeout)
+                connect_kwargs.setdefault('banner_timeout', host_timeout)
+                connect_kwargs.setdefault('auth_timeout', host_timeout)
+            with get_client(server, username, password, use_pool=use_pool, **connect_kwargs) as ssh:
+                watchdog = None
+                if deadline:  # Closing the transport at the deadline unblocks the channels and transfers on it
+                    watchdog = threading.Timer(max(deadline - time.time(), 0), ssh.get_transport().close)
+                    watchdog.daemon = True
+                    watchdog.start()
                 try:
-                    print(transition_responses[-1])
-                except Exception as e:
-                    print(e)
-                if stop_on_error and stderr:
-                    break
+                    result['responses'] = run_commands_on_client(
+                        ssh, host_commands, stop_on_exception=stop_on_exception, stop_on_error=stop_on_error,
+                        command_timeout=max(deadline - time.time(), 0.1) if deadline else None,
+                        should_stop=lambda: stop_event.is_set() or bool(deadline and time.time() > deadline),
+                        max_channels=max_channels)
+                finally:
+                    if watchdog:
+                        watchdog.cancel()
+            if deadline and time.time() > deadline:
+                result['status'] = 'timeout'
+            elif len(result['responses']) < len(host_commands) and stop_event.is_set():
+                result['status'] = 'cancelled'
+            elif any(response['exit_status'] != 0 for response in result['responses']):
+                result['status'] = 'failed'
         except Exception as ex:
-            transition_responses.append({'ssh_stdin': command, 'ssh_stdout': '', 'ssh_stderr': str(ex)})
-            print(transition_responses[-1])
-            if stop_on_exception:
-                break
-    return transition_responses
+            result['status'] = 'timeout' if deadline and time.time() > deadline else 'error'
+            result['error'] = str(ex)
+        result['duration'] = time.time() - start_time
+        if fail_fast and result['status'] not in ('success', 'cancelled'):
+            stop_event.set()
+        return result
+
+    results = {}
+    abandoned = False
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(_run_host, host_conf): host_conf['server'] for host_conf in hosts}
+        pending = set(futures)
+        while pending:
+            wait_timeout = None
+            if host_timeout:  # Wake up by the first deadline of the started servers
+                deadlines = [start_times[futures[future]] + host_timeout + HOST_TIMEOUT_GRACE for future in pending
+                             if futures[future] in start_times]
+                wait_timeout = max(min(deadlines + [time.time() + host_timeout]) - time.time(), 0)
+            done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                results[futures[future]] = future.result()
+                logger.debug(f'{futures[future]}: {results[futures[future]]["status"]}')
+            for future in list(pending):
+                server = futures[future]
+                if host_timeout and server in start_times and \
+                        time.time() > start_times[server] + host_timeout + HOST_TIMEOUT_GRACE:
+                    pending.discard(future)
+                    abandoned = True
+                    results[server] = {'status': 'timeout', 'responses': [],
+                                       'error': f'Did not finish within {host_timeout} seconds',
+                                       'duration': time.time() - start_times[server]}
+                    logger.debug(f'{server}: abandoned after {host_timeout} seconds')
+            if stop_event.is_set():
+                for pending_future in pending:
+                    pending_future.cancel()
+    finally:
+        executor.shutdown(wait=not abandoned)  # An abandoned worker is left to finish on its own
+    for future, server in futures.items():
+        if future.cancelled() and server not in results:
+            results[server] = {'status': 'cancelled', 'responses': [], 'error': '', 'duration': 0.0}
+    summary = Counter(result['status'] for result in results.values())
+    logger.info(f'Ran commands on {len(hosts)} servers: {dict(summary)}')
+    return {host_conf['server']: results[host_conf['server']] for host_conf in hosts}
 
 
 if __name__ == '__main__':
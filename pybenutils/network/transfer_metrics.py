@@ -0,0 +1,148 @@
+import json
+import time
+import bisect
+import threading
+from typing import Callable, Dict, List
+from pybenutils.utils_logger.config_logger import get_logger
+
+logger = get_logger()
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)  # Seconds
+SIZE_BUCKETS = (1024, 16 * 1024, 256 * 1024, 1024 ** 2, 16 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3)  # Bytes
+
+
+def get_histogram(values: List[float], buckets) -> Dict[str, int]:
+    """Returns a histogram dict of the given values. Each key is the upper bound of a bucket ("+inf" for the last)
+
+    :param values: Values to count
+    :param buckets: Sorted upper bounds of the buckets
+    :return: Dict of {"le_<bound>": count}
+    """
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        counts[bisect.bisect_left(buckets, value)] += 1
+    return {f'le_{bound}': count for bound, count in zip(list(buckets) + ['+inf'], counts)}
+
+
+def get_percentiles(values: List[float]) -> Dict[str, float]:
+    """Returns the p50, p90, p99 and max of the given values (nearest rank)"""
+    if not values:
+        return {'p50': 0, 'p90': 0, 'p99': 0, 'max': 0}
+    values = sorted(values)
+    percentiles = {f'p{p}': values[min(len(values) - 1, int(len(values) * p / 100))] for p in (50, 90, 99)}
+    percentiles['max'] = values[-1]
+    return percentiles
+
+
+def log_exporter(report: dict):
+    """Metrics exporter writing a summary line per operation to the logger"""
+    for operation, stats in report['operations'].items():
+        logger.info(f'{report["batch"] or "Transfer"} {operation}: {stats["count"]} objects '
+                    f'({stats["failed"]} failed), {stats["bytes"]} bytes in {stats["wall_time"]:.2f}s = '
+                    f'{stats["throughput"] / 1024 ** 2:.2f} MB/s, '
+                    f'latency p50/p90/max {stats["latency"]["p50"]:.3f}/{stats["latency"]["p90"]:.3f}/'
+                    f'{stats["latency"]["max"]:.3f}s, queue wait p90 {stats["queue_wait"]["p90"]:.3f}s, '
+                    f'{stats["retries"]} retries')
+
+
+class JsonFileExporter(object):
+    """Metrics exporter appending each report as a json line to a file"""
+
+    def __init__(self, file_path, include_objects=True):
+        """
+        :param file_path: Path of the json lines file
+        :param include_objects: Write the per object samples along with the aggregated stats
+        """
+        self.file_path = file_path
+        self.include_objects = include_objects
+
+    def __call__(self, report: dict):
+        if not self.include_objects:
+            report = {key: value for key, value in report.items() if key != 'objects'}
+        with open(self.file_path, 'a') as json_file:
+            json_file.write(json.dumps(report, default=str) + '\n')
+
+
+class TransferMetrics(object):
+    """Collects per object transfer samples (latency, bytes, retries, queue wait) and reports aggregated stats and
+     histograms to pluggable exporters. An exporter is any callable receiving the report dict"""
+
+    def __init__(self, exporters: List[Callable[[dict], None]] = None):
+        """
+        :param exporters: List of callables to receive the reports. Defaults to log_exporter
+        """
+        self.exporters = exporters if exporters is not None else [log_exporter]
+        self.lock = threading.Lock()
+        self.samples = []
+
+    def record(self, operation: str, name: str, size: int, start_time: float, retries=0, queue_wait=0.0,
+               success=True):
+        """Record a single object transfer. Thread safe
+
+        :param operation: Operation name, e.g. 'upload' or 'download'
+        :param name: Object name
+        :param size: Transferred bytes
+        :param start_time: Time the transfer started (time.time()). The transfer is considered finished now
+        :param retries: Number of failed attempts before the last one
+        :param queue_wait: Seconds the transfer waited in the thread pool queue before it started
+        :param success: If the transfer succeeded
+        """
+        end_time = time.time()
+        sample = {'operation': operation, 'name': name, 'bytes': size, 'start': start_time, 'end': end_time,
+                  'latency': end_time - start_time, 'retries': retries, 'queue_wait': queue_wait,
+                  'success': success}
+        with self.lock:
+            self.samples.append(sample)
+
+    def summary(self, batch_name='') -> dict:
+        """Returns the aggregated stats of the recorded samples, per operation
+
+        :param batch_name: Name to attach to the report
+        :return: Report dict
+        """
+        with self.lock:
+            samples = list(self.samples)
+        operations = {}
+        for operation in sorted({sample['operation'] for sample in samples}):
+            op_samples = [sample for sample in samples if sample['operation'] == operation]
+            succeeded = [sample for sample in op_samples if sample['success']]
+            latencies = [sample['latency'] for sample in succeeded]
+            queue_waits = [sample['queue_wait'] for sample in op_samples]
+            total_bytes = sum(sample['bytes'] for sample in succeeded)
+            wall_time = max(sample['end'] for sample in op_samples) - min(sample['start'] for sample in op_samples)
+            operations[operation] = {
+                'count': len(op_samples),
+                'failed': len(op_samples) - len(succeeded),
+                'bytes': total_bytes,
+                'wall_time': wall_time,
+                'throughput': total_bytes / wall_time if wall_time else 0,
+                'retries': sum(sample['retries'] for sample in op_samples),
+                'latency': get_percentiles(latencies),
+                'queue_wait': get_percentiles(queue_waits),
+                'object_throughput': get_percentiles([sample['bytes'] / sample['latency']
+                                                      for sample in succeeded if sample['latency']]),
+                'latency_histogram': get_histogram(latencies, LATENCY_BUCKETS),
+                'queue_wait_histogram': get_histogram(queue_waits, LATENCY_BUCKETS),
+                'size_histogram': get_histogram([sample['bytes'] for sample in succeeded], SIZE_BUCKETS),
+            }
+        return {'batch': batch_name, 'time': time.time(), 'operations': operations, 'objects': samples}
+
+    def report(self, batch_name='') -> dict:
+        """Send the aggregated stats to all the exporters and start a new batch
+
+        :param batch_name: Name to attach to the report
+        :return: Report dict
+        """
+        report = self.summary(batch_name)
+        self.reset()
+        for exporter in self.exporters:
+            try:
+                exporter(report)
+            except Exception as ex:
+                logger.error(f'Metrics exporter {exporter} failed with error: {ex}')
+        return report
+
+    def reset(self):
+        """Drop all the recorded samples"""
+        with self.lock:
+            self.samples = []
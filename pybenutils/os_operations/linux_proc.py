@@ -0,0 +1,319 @@
+import os
+import re
+import sys
+import time
+import functools
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import pwd
+except ImportError:  # Windows
+    pwd = None
+
+PROC_PATH = '/proc'
+COMM_MAX_LENGTH = 15  # The kernel truncates the process name (comm) to 15 characters
+FS_ENCODING = sys.getfilesystemencoding()
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100  # Units of the process start times
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096  # Units of the process memory sizes
+MODULE_WATCHERS_MAX = 128  # Cached module watchers (see get_module_watcher), the least recently used are dropped
+MAPS_PATH_PATTERN = re.compile(rb'^[^/\n]*(/[^\n]*)$', re.MULTILINE)  # The path of a file backed mapping line
+
+
+def is_supported() -> bool:
+    """Returns True if the /proc fast path can be used (Linux with a mounted procfs)"""
+    return sys.platform.startswith('linux') and os.path.isdir(os.path.join(PROC_PATH, 'self'))
+
+
+def iter_pids() -> Iterator[int]:
+    """Yields the pids of the running processes"""
+    with os.scandir(PROC_PATH) as entries:
+        for entry in entries:
+            if entry.name.isdigit():
+                yield int(entry.name)
+
+
+def _read(path: str) -> Optional[bytes]:
+    """Returns the content of a /proc file, None if the process is gone or the file is unreadable"""
+    try:
+        with open(path, 'rb', buffering=0) as proc_file:
+            return proc_file.read()
+    except OSError:
+        return None
+
+
+def read_comm(pid: int) -> Optional[str]:
+    """Returns the process name as known to the kernel (truncated to 15 characters), None if the process is gone"""
+    data = _read(f'{PROC_PATH}/{pid}/comm')
+    return data[:-1].decode(FS_ENCODING, 'surrogateescape') if data else None
+
+
+def read_cmdline_bytes(pid: int) -> Optional[bytes]:
+    """Returns the raw cmdline of the process with the arguments separated by null bytes, None if the process is
+     gone. Empty for kernel threads and zombies"""
+    return _read(f'{PROC_PATH}/{pid}/cmdline')
+
+
+def split_cmdline(data: bytes) -> List[str]:
+    """Split a raw cmdline into its arguments, the way psutil does (some processes rewrite their cmdline with
+     spaces instead of null bytes)"""
+    if not data:
+        return []
+    text = data.decode(FS_ENCODING, 'surrogateescape')
+    separator = '\x00' if text.endswith('\x00') else ' '
+    if text.endswith(separator):
+        text = text[:-1]
+    cmdline = text.split(separator)
+    if separator == '\x00' and len(cmdline) == 1 and ' ' in text:
+        cmdline = text.split(' ')
+    return cmdline
+
+
+def join_cmdline_bytes(data: bytes) -> bytes:
+    """Returns the space joined form of a raw cmdline, still as bytes, so a text can be searched in it without
+     decoding or splitting the cmdlines that do not match"""
+    return data.rstrip(b'\x00').replace(b'\x00', b' ')
+
+
+def read_cmdline(pid: int) -> Optional[List[str]]:
+    """Returns the process cmdline as a list of arguments, None if the process is gone"""
+    data = read_cmdline_bytes(pid)
+    return None if data is None else split_cmdline(data)
+
+
+def read_stat(pid: int) -> Optional[Tuple[str, str, int, int]]:
+    """Returns the (name, state, ppid, start time in clock ticks since boot) of the process, None if the process is
+     gone. The state is a single letter, e.g. 'R' running, 'S' sleeping, 'Z' zombie"""
+    data = _read(f'{PROC_PATH}/{pid}/stat')
+    if not data:
+        return None
+    name_end = data.rfind(b')')  # The name may hold spaces and parentheses
+    fields = data[name_end + 2:].split(b' ', 20)
+    return (data[data.find(b'(') + 1:name_end].decode(FS_ENCODING, 'surrogateescape'), fields[0].decode(),
+            int(fields[1]), int(fields[19]))
+
+
+def read_rss(pid: int) -> Optional[int]:
+    """Returns the resident set size of the process in bytes (from statm, like psutil), None if the process is gone"""
+    data = _read(f'{PROC_PATH}/{pid}/statm')
+    return int(data.split(None, 2)[1]) * PAGE_SIZE if data else None
+
+
+def read_uid(pid: int) -> Optional[int]:
+    """Returns the real user id of the process, None if the process is gone"""
+    data = _read(f'{PROC_PATH}/{pid}/status')
+    start = data.find(b'\nUid:') if data else -1
+    return int(data[start + 5:].split(None, 1)[0]) if start != -1 else None
+
+
+@functools.lru_cache(maxsize=256)
+def get_username(uid: int) -> str:
+    """Returns the user name of a user id, or the uid as text if it has no passwd entry (like psutil)"""
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+def iter_stats() -> Iterator[Tuple[int, str, str, int, int]]:
+    """Yields the (pid, name, state, ppid, start time in clock ticks since boot) of every running process. Only the
+     stat file of every process is read"""
+    for pid in iter_pids():
+        stat = read_stat(pid)
+        if stat:
+            yield (pid,) + stat
+
+
+def get_boot_time() -> float:
+    """Returns the system boot time in seconds since the epoch (the btime line of /proc/stat)"""
+    for line in (_read(f'{PROC_PATH}/stat') or b'').splitlines():
+        if line.startswith(b'btime'):
+            return float(line.split()[1])
+    return 0.0
+
+
+def get_create_time(start_ticks: int, boot_time: float) -> float:
+    """Returns the creation time of a process in seconds since the epoch, like psutil.Process.create_time
+
+    :param start_ticks: Start time in clock ticks since boot (see read_stat)
+    :param boot_time: System boot time (see get_boot_time)
+    """
+    return boot_time + start_ticks / CLOCK_TICKS
+
+
+def get_full_name(pid: int, comm: str) -> str:
+    """Returns the full process name of a process whose comm may be truncated, like psutil.Process.name does:
+     the base name of the executable in the cmdline, if it starts with the comm"""
+    if len(comm) < COMM_MAX_LENGTH:
+        return comm
+    cmdline = read_cmdline(pid)
+    if cmdline:
+        exe_name = os.path.basename(cmdline[0])
+        if exe_name.startswith(comm):
+            return exe_name
+    return comm
+
+
+def find_pids_by_name(process_name: str) -> List[int]:
+    """Returns the pids of the processes with the given name (case insensitive, path is ignored).
+     Only the comm file of every process is read. The cmdline is read only to resolve truncated names
+
+    :param process_name: Process name
+    :return: List of pids
+    """
+    name = os.path.basename(process_name).lower()
+    comm_prefix = name[:COMM_MAX_LENGTH]
+    pids = []
+    for pid in iter_pids():
+        comm = read_comm(pid)
+        if comm is None or comm.lower() != comm_prefix:
+            continue
+        if len(name) < COMM_MAX_LENGTH or get_full_name(pid, comm).lower() == name:
+            pids.append(pid)
+    return pids
+
+
+def iter_processes(attrs=('pid', 'name')) -> Iterator[dict]:
+    """Yields a dict of the requested attributes for every running process. Supported attributes: pid, name,
+     ppid, cmdline, rss. Processes that exit during the scan are skipped
+
+    :param attrs: Attributes to collect
+    :return: Iterator of dicts
+    """
+    with_stat = 'ppid' in attrs
+    with_name = 'name' in attrs
+    with_cmdline = 'cmdline' in attrs
+    with_rss = 'rss' in attrs
+    for pid in iter_pids():
+        info = {}
+        if 'pid' in attrs:
+            info['pid'] = pid
+        if with_stat:
+            stat = read_stat(pid)
+            if stat is None:
+                continue
+            comm, _, info['ppid'], _ = stat
+        elif with_name:
+            comm = read_comm(pid)
+            if comm is None:
+                continue
+        if with_cmdline:
+            data = read_cmdline_bytes(pid)
+            if data is None:
+                continue
+            info['cmdline'] = split_cmdline(data)
+        if with_rss:
+            info['rss'] = read_rss(pid)
+            if info['rss'] is None:
+                continue
+        if with_name:
+            if len(comm) >= COMM_MAX_LENGTH and with_cmdline:
+                exe_name = os.path.basename(info['cmdline'][0]) if info['cmdline'] else ''
+                info['name'] = exe_name if exe_name.startswith(comm) else comm
+            else:
+                info['name'] = get_full_name(pid, comm)
+        yield info
+
+
+class ModuleLoadWatcher(object):
+    """Reports the modules (shared libraries and other mapped files) a process loads, from /proc/<pid>/maps.
+     Every poll reads the maps once and dedupes the mapping lines to unique paths as bytes. Nothing is parsed if the
+     maps did not change since the previous poll, and only the new paths are decoded"""
+
+    def __init__(self, pid: int, start_ticks: int = None):
+        """
+        :param pid: Process id
+        :param start_ticks: Start time of the process in clock ticks since boot (see read_stat), read if not given
+        """
+        if start_ticks is None:
+            stat = read_stat(pid)
+            if not stat:
+                raise ProcessLookupError(f'No process with pid {pid}')
+            start_ticks = stat[3]
+        self.pid = pid
+        self.start_ticks = start_ticks
+        self.polls = 0
+        self.seen: Set[bytes] = set()  # Every path mapped since the first poll
+        self.loaded: Set[bytes] = set()  # The paths mapped at the last poll
+        self.maps_hash = None
+        self.lock = threading.Lock()
+
+    def poll(self) -> List[str]:
+        """Returns the paths of the modules loaded since the previous poll, sorted. The first poll returns all the
+         loaded modules. Returns an empty list once the process is gone
+
+        :raises PermissionError: If the maps of the process are not readable (another user's process)
+        """
+        try:
+            with open(f'{PROC_PATH}/{self.pid}/maps', 'rb') as maps_file:
+                data = maps_file.read()
+        except (FileNotFoundError, ProcessLookupError):
+            return []
+        with self.lock:
+            self.polls += 1
+            maps_hash = hash(data)
+            if maps_hash == self.maps_hash:
+                return []
+            self.maps_hash = maps_hash
+            self.loaded = set(MAPS_PATH_PATTERN.findall(data))
+            new_paths = self.loaded - self.seen
+            self.seen |= new_paths
+        return sorted(path.decode(FS_ENCODING, 'surrogateescape') for path in new_paths)
+
+    def get_loaded(self) -> List[str]:
+        """Returns the paths of the modules loaded at the last poll, sorted"""
+        with self.lock:
+            return sorted(path.decode(FS_ENCODING, 'surrogateescape') for path in self.loaded)
+
+    def find_loaded(self, module_name: str) -> Optional[str]:
+        """Returns the path of a module loaded at the last poll, None if it is not loaded
+
+        :param module_name: File name of the module (case insensitive). Versions and suffixes after a dot may be
+         omitted, e.g. 'libssl.so' matches libssl.so.3 and '_ssl' matches _ssl.cpython-311-x86_64-linux-gnu.so
+        """
+        module_name = module_name.lower()
+        for path in self.get_loaded():
+            base_name = os.path.basename(path).lower()
+            if base_name == module_name or base_name.startswith(module_name + '.'):
+                return path
+        return None
+
+    def wait_for_module(self, module_name: str, timeout=10, interval=0.1) -> Optional[str]:
+        """Poll until the process loaded the given module
+
+        :param module_name: File name of the module (see find_loaded)
+        :param timeout: Seconds to wait
+        :param interval: Seconds between polls
+        :return: Path of the loaded module, None if it was not loaded within the timeout
+        """
+        end_time = time.monotonic() + timeout
+        while True:
+            self.poll()
+            path = self.find_loaded(module_name)
+            if path or time.monotonic() >= end_time or not os.path.exists(f'{PROC_PATH}/{self.pid}'):
+                return path
+            time.sleep(interval)
+
+
+_module_watchers: Dict[Tuple[int, int], ModuleLoadWatcher] = OrderedDict()
+_module_watchers_lock = threading.Lock()
+
+
+def get_module_watcher(pid: int) -> ModuleLoadWatcher:
+    """Returns the cached module watcher of a process, keyed by (pid, start time) so a reused pid gets a new one
+
+    :param pid: Process id
+    :return: ModuleLoadWatcher
+    :raises ProcessLookupError: If the process is gone
+    """
+    stat = read_stat(pid)
+    if not stat:
+        raise ProcessLookupError(f'No process with pid {pid}')
+    key = (pid, stat[3])
+    with _module_watchers_lock:
+        watcher = _module_watchers.pop(key, None) or ModuleLoadWatcher(pid, start_ticks=stat[3])
+        _module_watchers[key] = watcher
+        while len(_module_watchers) > MODULE_WATCHERS_MAX:
+            _module_watchers.popitem(last=False)
+    return watcher
@@ -1,26 +1,302 @@
 import os
+import re
 import time
+import queue
+import select
+import threading
 import psutil
+from array import array
+from itertools import compress, repeat
+from collections import deque, namedtuple
 from psutil import AccessDenied
 from psutil import process_iter
+from pybenutils.os_operations import linux_proc
 from pybenutils.utils_logger.config_logger import get_logger
-from typing import Callable, Any, List
+from typing import Callable, Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # NumPy output of ProcessColumns is optional, the columns are plain arrays and lists
 
 logger = get_logger()
 
+SNAPSHOT_ATTRS = ('pid', 'ppid', 'name', 'cmdline', 'create_time')
+TERMINATE_TIMEOUT = 3  # Seconds given to processes to exit after SIGTERM, before they are killed
+KILL_TIMEOUT = 5  # Seconds to wait for killed processes to disappear
+LINUX_PROC = linux_proc.is_supported()  # Scan /proc directly instead of through psutil process objects
+LINUX_PROC_ATTRS = {'pid', 'name', 'ppid', 'cmdline'}  # Attributes get_all_running_processes reads from /proc
+LINUX_PROC_COLUMNS = LINUX_PROC_ATTRS | {'rss'}  # Columns ProcessColumns reads from /proc
+COLUMN_TYPECODES = {'pid': 'i', 'ppid': 'i', 'rss': 'q', 'vms': 'q', 'num_threads': 'i', 'num_fds': 'i',
+                    'num_handles': 'i', 'nice': 'i', 'create_time': 'd', 'cpu_percent': 'd', 'memory_percent': 'd'}
+MEMORY_INFO_COLUMNS = ('rss', 'vms')  # Columns taken from the memory_info attribute
+GROUP_AGGREGATES = ('count', 'sum', 'min', 'max', 'mean')
+LOADED_DLLS_CACHE: Dict[Tuple[int, float], set] = {}  # (pid, create_time) to the dll paths seen, outside Linux
+WAIT_RESCAN_INTERVAL = 1  # Seconds between the checks for newly started processes while waiting for processes to close
+MONITOR_METRICS = ('cpu_percent', 'rss', 'threads', 'fds', 'read_rate', 'write_rate')
+EVENT_KINDS = ('started', 'exited')
+QUERY_ATTRIBUTE_COSTS = {'pid': 0, 'name': 1, 'ppid': 2, 'create_time': 2, 'username': 3, 'cmdline': 4}
+
+ProcessEvent = namedtuple(field_names='kind pid create_time name ppid time', typename='ProcessEvent')
+
+
+def get_process_objects(pids: List[int]) -> List[psutil.Process]:
+    """Returns the psutil.Process objects of the given pids, skipping the processes that are gone"""
+    processes = []
+    for pid in pids:
+        try:
+            processes.append(psutil.Process(pid))
+        except psutil.NoSuchProcess:
+            pass
+    return processes
+
+
+class ProcessSnapshot(object):
+    """A point in time view of the process table, collected in a single process_iter pass (one attributes fetch
+     per process), with name, parent to children and cmdline token indexes. Lookups and tree walks are dict hits,
+     so a polling loop can take one snapshot per iteration and query it many times"""
+
+    def __init__(self, attrs=SNAPSHOT_ATTRS):
+        """
+        :param attrs: Process attributes to collect (see psutil.Process.as_dict). pid, ppid and name are always
+         collected. Unreadable attributes (access denied) are None
+        """
+        attrs = list(dict.fromkeys(('pid', 'ppid', 'name') + tuple(attrs)))
+        self.time = time.time()
+        self.processes: Dict[int, dict] = {}
+        self.process_objects: Dict[int, psutil.Process] = {}
+        self.pids_by_name: Dict[str, List[int]] = {}
+        self.children_by_ppid: Dict[int, List[int]] = {}
+        self.pids_by_cmdline_token: Dict[str, List[int]] = {}
+        for proc in psutil.process_iter(attrs, ad_value=None):
+            info = proc.info
+            pid = info['pid']
+            self.processes[pid] = info
+            self.process_objects[pid] = proc
+            self.pids_by_name.setdefault((info['name'] or '').lower(), []).append(pid)
+            if info['ppid'] is not None and info['ppid'] != pid:
+                self.children_by_ppid.setdefault(info['ppid'], []).append(pid)
+            for token in set(self._get_cmdline_tokens(info.get('cmdline'))):
+                self.pids_by_cmdline_token.setdefault(token, []).append(pid)
+
+    @staticmethod
+    def _get_cmdline_tokens(cmdline: Optional[List[str]]) -> Iterator[str]:
+        """Yields the index tokens of a cmdline: every argument and the base name of every path argument"""
+        for arg in cmdline or ():
+            yield arg
+            base_name = os.path.basename(arg)
+            if base_name and base_name != arg:
+                yield base_name
+
+    def __len__(self):
+        return len(self.processes)
+
+    def __contains__(self, pid):
+        return pid in self.processes
+
+    def get(self, pid: int) -> Optional[dict]:
+        """Returns the collected attributes of the given pid, None if it was not running"""
+        return self.processes.get(pid)
+
+    def get_process(self, pid: int) -> Optional[psutil.Process]:
+        """Returns the psutil.Process object of the given pid, None if it was not running"""
+        return self.process_objects.get(pid)
+
+    def get_pids_by_name(self, process_name: str) -> List[int]:
+        """Returns the pids of the processes with the given name (case insensitive, path is ignored)"""
+        return list(self.pids_by_name.get(os.path.basename(process_name).lower(), ()))
+
+    def get_processes_by_name(self, process_name: str) -> List[psutil.Process]:
+        """Returns the psutil.Process objects of the processes with the given name (see get_pids_by_name)"""
+        return [self.process_objects[pid] for pid in self.get_pids_by_name(process_name)]
+
+    def get_pids_by_cmdline_token(self, token: str) -> List[int]:
+        """Returns the pids of the processes with the given exact cmdline argument, or argument base name
+         (e.g. 'chrome' matches '/opt/google/chrome/chrome')"""
+        return list(self.pids_by_cmdline_token.get(token, ()))
+
+    def get_pids_by_cmdline(self, partial_cmd_line: str) -> List[int]:
+        """Returns the pids of the processes which space joined cmdline contains the given text"""
+        return [pid for pid, info in self.processes.items()
+                if info.get('cmdline') and partial_cmd_line in ' '.join(info['cmdline'])]
+
+    def get_parent_pid(self, pid: int) -> Optional[int]:
+        """Returns the parent pid of the given pid, None if unknown"""
+        info = self.processes.get(pid)
+        return info['ppid'] if info else None
+
+    def get_children(self, pid: int, recursive=False) -> List[int]:
+        """Returns the pids of the children of the given pid
+
+        :param pid: Parent pid
+        :param recursive: Return all the descendants, parents before their children
+        :return: List of pids
+        """
+        if not recursive:
+            return list(self.children_by_ppid.get(pid, ()))
+        return list(self.walk_tree(pid))[1:]
+
+    def walk_tree(self, pid: int) -> Iterator[int]:
+        """Yields the given pid and all its descendants, breadth first"""
+        queue = [pid]
+        seen = set()
+        while queue:
+            current = queue.pop(0)
+            if current in seen:  # Guards against pid reuse loops
+                continue
+            seen.add(current)
+            yield current
+            queue.extend(self.children_by_ppid.get(current, ()))
+
+
+class ProcessQuery(object):
+    """A declarative process matcher. The given conditions are compiled into a plan that evaluates the cheapest
+     attributes first (see QUERY_ATTRIBUTE_COSTS), and every attribute is fetched only for the processes that
+     passed the previous conditions, e.g. the cmdline is read only for the processes with the right name.
+     A pid condition skips the process table scan. On Linux the attributes are read from /proc directly
+
+    > ProcessQuery(name='chrome', cmdline_contains='--type=renderer', min_age=60).find()
+    > kill_process_by(ProcessQuery(name_regex=r'^setup.*\\.exe$', username='qa'), kill_all_instances=True)
+    """
+
+    def __init__(self, pid: int = None, name='', name_regex='', cmdline_contains='', ppid: int = None, username='',
+                 min_age: float = None, max_age: float = None):
+        """
+        :param pid: Process id
+        :param name: Process name (case insensitive, path is ignored)
+        :param name_regex: Regex pattern (or compiled pattern) to search in the process name
+        :param cmdline_contains: Text the space joined cmdline must contain
+        :param ppid: Parent process id
+        :param username: Owner user name
+        :param min_age: Minimal seconds since the process started
+        :param max_age: Maximal seconds since the process started
+        """
+        self.pid = pid
+        conditions = []
+        if pid is not None:
+            conditions.append(('pid', f'pid == {pid}', lambda value: value == pid))
+        if name:
+            name = os.path.basename(name).lower()
+            conditions.append(('name', f'name == {name!r}', lambda value: value.lower() == name))
+        if name_regex:
+            pattern = re.compile(name_regex)
+            conditions.append(('name', f'name =~ {pattern.pattern!r}', lambda value: bool(pattern.search(value))))
+        if ppid is not None:
+            conditions.append(('ppid', f'ppid == {ppid}', lambda value: value == ppid))
+        if min_age is not None:
+            conditions.append(('create_time', f'age >= {min_age}', lambda value: time.time() - value >= min_age))
+        if max_age is not None:
+            conditions.append(('create_time', f'age <= {max_age}', lambda value: time.time() - value <= max_age))
+        if username:
+            conditions.append(('username', f'username == {username!r}', lambda value: value == username))
+        if cmdline_contains:
+            # The /proc reader returns the raw cmdline bytes, the psutil one the joined text
+            needle = cmdline_contains.encode(linux_proc.FS_ENCODING, 'surrogateescape')
+            conditions.append(('cmdline', f'cmdline contains {cmdline_contains!r}',
+                               lambda value: (needle if isinstance(value, bytes) else cmdline_contains) in value))
+        self.plan: List[Tuple[str, str, Callable[[Any], bool]]] = sorted(
+            conditions, key=lambda condition: QUERY_ATTRIBUTE_COSTS[condition[0]])
+        self.fetches = dict.fromkeys(QUERY_ATTRIBUTE_COSTS, 0)  # Attribute reads of the last find, by attribute
+
+    def __repr__(self):
+        return f'ProcessQuery({" and ".join(description for _, description, _ in self.plan) or "all"})'
+
+    @staticmethod
+    def _read_psutil_attribute(proc: psutil.Process, attribute: str):
+        if attribute == 'cmdline':
+            return ' '.join(proc.cmdline())
+        return getattr(proc, attribute)()
+
+    @staticmethod
+    def _read_linux_attributes(pid: int, attribute: str) -> Optional[dict]:
+        """Returns the attribute read from /proc, with the attributes read along with it. None if the process is
+         gone or the attribute is unreadable"""
+        if attribute == 'name':
+            comm = linux_proc.read_comm(pid)
+            return {'name': linux_proc.get_full_name(pid, comm)} if comm is not None else None
+        if attribute in ('ppid', 'create_time'):
+            stat = linux_proc.read_stat(pid)
+            if not stat or stat[1] == 'Z':  # Zombies are not matched, like psutil raises ZombieProcess
+                return None
+            return {'ppid': stat[2], 'create_time': linux_proc.get_create_time(stat[3], linux_proc.get_boot_time())}
+        if attribute == 'username':
+            uid = linux_proc.read_uid(pid)
+            return {'username': linux_proc.get_username(uid)} if uid is not None else None
+        data = linux_proc.read_cmdline_bytes(pid)
+        return {'cmdline': linux_proc.join_cmdline_bytes(data)} if data is not None else None
+
+    def _matches(self, pid: int, proc: psutil.Process = None) -> bool:
+        """Evaluate the plan on a process, reading each attribute once. On Linux (without a given process object)
+         the attributes are read from /proc"""
+        values = {'pid': pid}
+        for attribute, _, condition in self.plan:
+            if attribute not in values:
+                self.fetches[attribute] += 1
+                try:
+                    if proc is not None or not LINUX_PROC:
+                        proc = proc or psutil.Process(pid)
+                        values[attribute] = self._read_psutil_attribute(proc, attribute)
+                    else:
+                        read_values = self._read_linux_attributes(pid, attribute)
+                        if read_values is None:
+                            return False
+                        values.update(read_values)
+                except (AccessDenied, psutil.NoSuchProcess):
+                    return False
+            if not condition(values[attribute]):
+                return False
+        return True
+
+    def matches(self, proc: psutil.Process) -> bool:
+        """Returns True if the given psutil.Process matches all the conditions"""
+        return self._matches(proc.pid, proc)
+
+    def iter_pids(self) -> Iterator[int]:
+        """Yields the pids of the matching processes"""
+        self.fetches = dict.fromkeys(QUERY_ATTRIBUTE_COSTS, 0)
+        if self.pid is not None:
+            candidates = [self.pid] if psutil.pid_exists(self.pid) else []
+        else:
+            candidates = linux_proc.iter_pids() if LINUX_PROC else psutil.pids()
+        for pid in candidates:
+            if self._matches(pid):
+                yield pid
+
+    def find(self, limit=0) -> List[psutil.Process]:
+        """Returns the psutil.Process objects of the matching processes
+
+        :param limit: Stop after this many matches. 0 for all
+        :return: List of psutil.Process objects
+        """
+        pids = []
+        for pid in self.iter_pids():
+            pids.append(pid)
+            if limit and len(pids) >= limit:
+                break
+        return get_process_objects(pids)
+
 
 class ProcessHandler(object):
-    def __init__(self, process_name):
-        self.proc_list = self.get_processes_by_name(process_name)
+    def __init__(self, process_name, snapshot: ProcessSnapshot = None):
+        """
+        :param process_name: Process name
+        :param snapshot: Look the processes up in an existing snapshot instead of scanning the process table
+        """
+        self.proc_list = self.get_processes_by_name(process_name, snapshot=snapshot)
         self.process_name = process_name
 
     @staticmethod
-    def get_processes_by_name(process_name: str) -> List:
+    def get_processes_by_name(process_name: str, snapshot: ProcessSnapshot = None) -> List:
         """Return processes object list
 
         :param process_name: Process name
+        :param snapshot: Look the name up in an existing snapshot instead of scanning the process table
         :return: Process object list
         """
+        if snapshot:
+            return snapshot.get_processes_by_name(process_name)
+        if LINUX_PROC:
+            return get_process_objects(linux_proc.find_pids_by_name(process_name))
         processes_list = []
         process_name = os.path.basename(process_name)
         for p in process_iter():
@@ -32,22 +308,21 @@ class ProcessHandler(object):
                 pass
         return processes_list
 
-    def get_processes_child_process_name_list(self):
-        """Get children processes"""
-        processes = []
-        process_name = os.path.basename(self.process_name)
+    def get_processes_child_process_name_list(self, snapshot: ProcessSnapshot = None):
+        """Get children processes
 
+        :param snapshot: Use an existing snapshot instead of scanning the process table
+        """
+        processes = []
         excluded_list = ["searindexer", "java", "services", "winlogon", "csrss", "smss", "audiodg", "System", "sppsvc",
                          "dllhost", "conhost", "SearchFilterHost", "SearchProtocolHost", "svchost"]
 
-        for p in psutil.process_iter():
-            try:
-                if process_name.lower() == p.parent().name().lower():
-                    name = p.name()
-                    if not any(True for w in excluded_list if w in name):
-                        processes.append(name)
-            except Exception:
-                pass
+        snapshot = snapshot or ProcessSnapshot(attrs=())
+        for parent_pid in snapshot.get_pids_by_name(self.process_name):
+            for pid in snapshot.get_children(parent_pid):
+                name = snapshot.get(pid)['name'] or ''
+                if not any(True for w in excluded_list if w in name):
+                    processes.append(name)
         logger.debug(', '.join(processes))
         return processes
 
@@ -72,15 +347,17 @@ class ProcessHandler(object):
             return False
 
     @staticmethod
-    def get_loaded_dll_list_in_file(process_obj=None, pid=None, process_name=None):
+    def get_loaded_dll_list_in_file(process_obj=None, pid=None, process_name=None, new_only=False):
         """Returns a list of dll loaded in the process. Input can be given for the inspected process in 3 ways:
         process name, pid and process object (psutil.Process instance). Only one will be used, according to the order
-        in the method's signature
+        in the method's signature. On Linux the file backed mappings are read from /proc/<pid>/maps by a module watcher
+        cached per process (see linux_proc.get_module_watcher), so repeated calls are cheap
 
         :param process_obj: Psutil.Process instance of the process to inspect
         :param pid: Pid of the process to inspect
         :param process_name: Process name to inspect, if no processes are running with the given name, an assertion
         error will be raised and if more than one is running, the first found will be used
+        :param new_only: Return only the dlls loaded since the previous call for the same process
         :return: List of dll names that were loaded in the process
         """
         assert bool(process_obj) | bool(pid) | bool(process_name), 'Dll inspection aborted, no input was given'
@@ -90,27 +367,114 @@ class ProcessHandler(object):
             process_obj = process_list[0]
         if not process_obj:
             process_obj = psutil.Process(pid)
-        dll_list = sorted([os.path.basename(dll.path.lower()) for dll in process_obj.memory_maps()])
+        if LINUX_PROC:
+            try:
+                watcher = linux_proc.get_module_watcher(process_obj.pid)
+                new_paths = watcher.poll()
+            except ProcessLookupError:
+                raise psutil.NoSuchProcess(process_obj.pid)
+            except PermissionError:  # Like psutil memory_maps of another user's process
+                raise psutil.AccessDenied(process_obj.pid)
+            paths = new_paths if new_only else watcher.get_loaded()
+        else:
+            paths = {dll.path for dll in process_obj.memory_maps()}
+            if new_only:
+                key = (process_obj.pid, process_obj.create_time())
+                seen = LOADED_DLLS_CACHE.pop(key, set())
+                paths, LOADED_DLLS_CACHE[key] = paths - seen, seen | paths
+                while len(LOADED_DLLS_CACHE) > linux_proc.MODULE_WATCHERS_MAX:
+                    LOADED_DLLS_CACHE.pop(next(iter(LOADED_DLLS_CACHE)))
+        dll_list = sorted([os.path.basename(path.lower()) for path in paths])
         logger.debug('The installer loaded the following dlls: {}'.format(dll_list))
         return dll_list
 
 
-def wait_for_process_to_close(process_name: str, timeout=10):
-    """Returns True if a process closed within the given timeout
+def wait_for_processes(processes: List[psutil.Process], timeout=None,
+                       callback: Callable[[psutil.Process], Any] = None) -> Tuple[List, List]:
+    """Block until all the given processes exit or the timeout passed, without polling the process table.
+     On Linux (python 3.9+, kernel 5.3+) the exits are waited for on pidfds, so the wait costs no CPU and returns
+     as soon as the last process exits. Elsewhere psutil.wait_procs is used
+
+    :param processes: List of psutil.Process objects
+    :param timeout: Seconds to wait. None to wait forever
+    :param callback: Called with each process as soon as it exits
+    :return: Tuple of (gone, alive) process lists
+    """
+    if not hasattr(os, 'pidfd_open') or not hasattr(select, 'poll'):
+        return psutil.wait_procs(processes, timeout=timeout, callback=callback)
+    gone = []
+    fds = {}
+    try:
+        for proc in processes:
+            try:
+                fd = os.pidfd_open(proc.pid)
+            except ProcessLookupError:
+                gone.append(proc)
+                continue
+            except OSError:  # The kernel does not support pidfds
+                for fd in fds:
+                    os.close(fd)
+                fds = {}
+                return psutil.wait_procs(processes, timeout=timeout, callback=callback)
+            fds[fd] = proc
+            if not proc.is_running():  # Exited before the pidfd was opened, and the pid was reused
+                os.close(fds.pop(fd))
+                gone.append(proc)
+        if callback:
+            for proc in gone:
+                callback(proc)
+        poller = select.poll()
+        for fd in fds:
+            poller.register(fd, select.POLLIN)
+        end_time = time.monotonic() + timeout if timeout is not None else None
+        while fds:
+            remaining = end_time - time.monotonic() if end_time is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            for fd, _ in poller.poll(remaining * 1000 if remaining is not None else None):
+                poller.unregister(fd)
+                os.close(fd)
+                gone.append(fds.pop(fd))
+                if callback:
+                    callback(gone[-1])
+        return gone, list(fds.values())
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def wait_for_process_to_close(process_name: str, timeout=10, rescan_interval=WAIT_RESCAN_INTERVAL):
+    """Returns True if all the processes with the given name closed within the given timeout.
+     The running processes are resolved once and waited for (see wait_for_processes). Processes started with the
+     same name while waiting are found by checking only the pids that are new since the last check
 
     :param process_name: Process name
     :param timeout: Timeout in seconds
-    :return: True if a process closed within the given timeout
+    :param rescan_interval: Seconds between the checks for newly started processes with the same name
+    :return: True if all the processes closed within the given timeout
     """
-    end_time = time.time() + int(timeout) * 60
-    while time.time() < end_time:
-        if not ProcessHandler(process_name).process_exists():
+    end_time = time.time() + timeout
+    process_name = os.path.basename(process_name).lower()
+    known_pids = set(psutil.pids())
+    processes = ProcessHandler.get_processes_by_name(process_name)
+    while True:
+        if not processes:
             logger.debug(f"The process: {process_name} was closed")
             return True
-        time.sleep(1)
-    else:
-        logger.error(f"Time-out accorded before the process: {process_name} was closed")
-        return False
+        remaining = end_time - time.time()
+        if remaining <= 0:
+            logger.error(f"Time-out accorded before the process: {process_name} was closed")
+            return False
+        _, processes = wait_for_processes(processes, timeout=min(rescan_interval, remaining))
+        current_pids = set(psutil.pids())
+        for pid in current_pids - known_pids:
+            try:
+                proc = psutil.Process(pid)
+                if proc.name().lower() == process_name:
+                    processes.append(proc)
+            except (AccessDenied, psutil.NoSuchProcess):
+                pass
+        known_pids = current_pids
 
 
 def kill_process(process_obj):
@@ -140,6 +504,89 @@ def kill_process(process_obj):
     return process_killed
 
 
+def terminate_processes(processes: List[psutil.Process], term_timeout=TERMINATE_TIMEOUT,
+                        kill_timeout=KILL_TIMEOUT) -> dict:
+    """Stop a group of processes together: SIGTERM all of them at once, wait for all of them together, then SIGKILL
+     all the survivors at once. The waits return as soon as the last process exits (see wait_for_processes)
+
+    :param processes: List of psutil.Process objects
+    :param term_timeout: Seconds to wait after SIGTERM. 0 to skip SIGTERM and kill right away
+    :param kill_timeout: Seconds to wait after SIGKILL
+    :return: Report {'terminated': [entry], 'killed': [entry], 'alive': [entry], 'seconds': float}. Entries are
+     {'pid': int, 'name': str, 'seconds': float} with the seconds from the start until the exit was observed, and
+     an 'error' instead of the seconds for the processes still alive
+    """
+    start_time = time.monotonic()
+    report = {'terminated': [], 'killed': [], 'alive': [], 'seconds': 0.0}
+    names = {}
+    for proc in processes:
+        try:
+            names[proc.pid] = proc.name()
+        except psutil.Error:
+            names[proc.pid] = ''
+
+    def _entry(proc, error=''):
+        entry = {'pid': proc.pid, 'name': names.get(proc.pid, '')}
+        if error:
+            entry['error'] = error
+        else:
+            entry['seconds'] = time.monotonic() - start_time
+        return entry
+
+    def _signal_and_wait(pending: List[psutil.Process], method: str, timeout, status: str) -> List[psutil.Process]:
+        signaled = []
+        for proc in pending:
+            try:
+                getattr(proc, method)()
+                signaled.append(proc)
+            except psutil.NoSuchProcess:
+                report[status].append(_entry(proc))
+            except AccessDenied as ex:
+                report['alive'].append(_entry(proc, error=f'Access denied: {ex}'))
+        _, alive = wait_for_processes(signaled, timeout=timeout, callback=lambda p: report[status].append(_entry(p)))
+        return alive
+
+    pending = list({proc.pid: proc for proc in processes}.values())
+    if term_timeout:
+        pending = _signal_and_wait(pending, 'terminate', term_timeout, 'terminated')
+    if pending:
+        pending = _signal_and_wait(pending, 'kill', kill_timeout, 'killed')
+    for proc in pending:
+        report['alive'].append(_entry(proc, error=f'Still alive {kill_timeout} seconds after it was killed'))
+    report['seconds'] = time.monotonic() - start_time
+    logger.debug(f'Stopped {len(report["terminated"])} processes with SIGTERM and {len(report["killed"])} with '
+                 f'SIGKILL in {report["seconds"]:.2f} seconds. {len(report["alive"])} processes are still alive')
+    return report
+
+
+def kill_process_tree(process, include_parent=True, term_timeout=TERMINATE_TIMEOUT, kill_timeout=KILL_TIMEOUT,
+                      snapshot: ProcessSnapshot = None) -> dict:
+    """Stop a process and all its descendants together (see terminate_processes). The tree is collected before
+     any signal is sent, so descendants re-parented on their parent exit are not missed
+
+    :param process: psutil.Process object or pid of the tree root
+    :param include_parent: Stop the root process too, not only its descendants
+    :param term_timeout: Seconds to wait after SIGTERM. 0 to skip SIGTERM and kill right away
+    :param kill_timeout: Seconds to wait after SIGKILL
+    :param snapshot: Walk the tree in an existing snapshot instead of scanning the process table
+    :return: Report {'terminated': [entry], 'killed': [entry], 'alive': [entry], 'seconds': float}
+    """
+    if snapshot:
+        pid = process if isinstance(process, int) else process.pid
+        tree = [snapshot.get_process(tree_pid) for tree_pid in snapshot.walk_tree(pid) if tree_pid in snapshot]
+    else:
+        process = psutil.Process(process) if isinstance(process, int) else process
+        pid = process.pid
+        try:
+            tree = [process] + process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            tree = [process]
+    if not include_parent:
+        # By pid, as the root is missing from the snapshot tree when it already exited
+        tree = [tree_process for tree_process in tree if tree_process.pid != pid]
+    return terminate_processes(tree, term_timeout=term_timeout, kill_timeout=kill_timeout)
+
+
 def process_should_not_be_running(process_name, error=True):
     """Check if a process is still running
 
@@ -182,18 +629,22 @@ def process_should_be_running(process_name, error=True):
     return False
 
 
-def kill_process_by(condition: Callable[[Any], bool], kill_children=False, kill_all_instances=False):
-    """Kill process by boolean condition
+def kill_process_by(condition, kill_children=False, kill_all_instances=False, term_timeout=0):
+    """Kill process by condition. All the found processes (and their children) are stopped together
+     (see terminate_processes)
 
-    :param condition: Any boolean condition for the process to kill (Using lambda is advised)
-    :param kill_children: True/False
+    :param condition: A ProcessQuery (its conditions are evaluated cheapest first), or any boolean condition called
+     with every psutil.Process (Using lambda is advised)
     :param kill_children: Kill child processes along with the main one
     :param kill_all_instances: Don't finish after the first found process was killed
+    :param term_timeout: Seconds to give the processes to exit after SIGTERM before they are killed. 0 to kill right
+     away
     :returns True if any processes were killed
     """
-    process_killed = False
-    found = 0
-    killed = 0
+    if isinstance(condition, ProcessQuery):
+        found_list = condition.find(limit=0 if kill_all_instances else 1)
+        return kill_found_processes(found_list, kill_children=kill_children, term_timeout=term_timeout)
+    found_list = []
     for p in psutil.process_iter():
         try:
             condition_result = condition(p)
@@ -202,16 +653,34 @@ def kill_process_by(condition: Callable[[Any], bool], kill_children=False, kill_
             continue
 
         if condition_result:
-            found += 1
-            if kill_children:
-                logger.debug('Kill child processes')
-                for child in p.children(recursive=True):
-                    kill_process(child)
-                logger.debug('All child processes were killed')
-            if kill_process(p):
-                killed += 1
+            found_list.append(p)
             if not kill_all_instances:
                 break
+    return kill_found_processes(found_list, kill_children=kill_children, term_timeout=term_timeout)
+
+
+def kill_found_processes(found_list: List[psutil.Process], kill_children=False, term_timeout=0) -> bool:
+    """Kill the given processes together (see terminate_processes) and log the result
+
+    :param found_list: List of psutil.Process objects
+    :param kill_children: Kill child processes along with the given ones
+    :param term_timeout: Seconds to give the processes to exit after SIGTERM before they are killed. 0 to kill right
+     away
+    :returns True if any processes were killed
+    """
+    process_killed = False
+    targets = list(found_list)
+    if kill_children:
+        logger.debug('Kill child processes')
+        for p in found_list:
+            try:
+                targets += p.children(recursive=True)
+            except psutil.NoSuchProcess:
+                pass
+    report = terminate_processes(targets, term_timeout=term_timeout)
+    alive_pids = {entry['pid'] for entry in report['alive']}
+    found = len(found_list)
+    killed = len([p for p in found_list if p.pid not in alive_pids])
     if found == 0:
         logger.debug(f'No process was found matching the input condition')
     else:
@@ -234,7 +703,7 @@ def kill_process_by_cmd(partial_cmd_line: str, kill_children=False, kill_all_ins
     :return True if all processes killed successfully
     """
     logger.debug(f'Looking for a process who\'s cmd line contains "{partial_cmd_line}" to kill')
-    return kill_process_by(condition=lambda p: partial_cmd_line in ' '.join(p.cmdline()),
+    return kill_process_by(condition=ProcessQuery(cmdline_contains=partial_cmd_line),
                            kill_children=kill_children,
                            kill_all_instances=kill_all_instances)
 
@@ -253,7 +722,7 @@ def kill_process_by_name(process_name: str, kill_children=False, kill_all_instan
         process_name = process_name + ".exe"
     process_name_to_find = process_name.lower()
     logger.debug(f'Looking for a process with the name "{process_name_to_find}" to kill')
-    return kill_process_by(condition=lambda p: p.name().lower() == process_name_to_find,
+    return kill_process_by(condition=ProcessQuery(name=process_name_to_find),
                            kill_children=kill_children,
                            kill_all_instances=kill_all_instances)
 
@@ -266,18 +735,633 @@ def kill_process_by_pid(pid: int, kill_children=False):
     :return True if all processes killed successfully
     """
     logger.debug(f'Looking for a process with the pid "{pid}" to kill')
-    return kill_process_by(condition=lambda p: p.pid == pid,
+    return kill_process_by(condition=ProcessQuery(pid=pid),
                            kill_children=kill_children)
 
 
-def get_all_running_processes(attrs_filter=('pid', 'name')):
+class ProcessColumns(object):
+    """Process attributes stored by column, all in the same process order. The numeric attributes (see
+     COLUMN_TYPECODES) are kept in compact arrays and the others in lists, which is much lighter than a dict per
+     process on hosts with many processes and fast to filter and aggregate. Besides the psutil attributes, the
+     'rss' and 'vms' columns (from memory_info) are supported. On Linux the pid, name, ppid, cmdline and rss columns
+     are read from /proc
+
+    > columns = get_all_running_processes(('pid', 'name', 'rss'), columnar=True)
+    > columns.group_by('name', 'rss')  # Total rss per process name
+    > columns.where('rss', lambda rss: rss > 100 * 1024 ** 2)['name']
+    > columns.to_numpy()['rss'].sum()
+    """
+
+    def __init__(self, columns: Dict[str, Any]):
+        """
+        :param columns: Dict of {attribute: array or list}, all of the same length
+        """
+        self.columns = columns
+
+    @classmethod
+    def collect(cls, attrs=('pid', 'name')) -> 'ProcessColumns':
+        """Collect the given attributes of all the running processes. Unreadable values (access denied) are None in
+         the list columns and 0 in the array columns
+
+        :param attrs: Attributes (columns) to collect. Empty for all the psutil attributes
+        :return: ProcessColumns
+        """
+        attrs = tuple(dict.fromkeys(attrs or psutil.Process().as_dict()))
+        columns = {attr: array(COLUMN_TYPECODES[attr]) if attr in COLUMN_TYPECODES else [] for attr in attrs}
+        appenders = [(attr, columns[attr].append, attr in COLUMN_TYPECODES) for attr in attrs]
+        if LINUX_PROC and LINUX_PROC_COLUMNS.issuperset(attrs):
+            rows = linux_proc.iter_processes(attrs)
+        else:
+            rows = cls._iter_psutil_rows(attrs)
+        for row in rows:
+            for attr, append, numeric in appenders:
+                value = row[attr]
+                append(0 if value is None and numeric else value)
+        return cls(columns)
+
+    @staticmethod
+    def _iter_psutil_rows(attrs: Tuple[str, ...]) -> Iterator[dict]:
+        """Yields the info dict of every process, with the memory_info columns extracted"""
+        memory_columns = [attr for attr in MEMORY_INFO_COLUMNS if attr in attrs]
+        psutil_attrs = [attr for attr in attrs if attr not in memory_columns]
+        if memory_columns and 'memory_info' not in psutil_attrs:
+            psutil_attrs.append('memory_info')
+        for proc in psutil.process_iter(psutil_attrs, ad_value=None):
+            info = proc.info
+            for attr in memory_columns:
+                info[attr] = getattr(info['memory_info'], attr) if info['memory_info'] else None
+            yield info
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, attr: str):
+        return self.columns[attr]
+
+    def __contains__(self, attr: str):
+        return attr in self.columns
+
+    def filter(self, mask) -> 'ProcessColumns':
+        """Returns the processes selected by a mask
+
+        :param mask: Sequence of booleans, one per process (e.g. a NumPy boolean array)
+        :return: ProcessColumns
+        """
+        if numpy is not None and isinstance(mask, numpy.ndarray):
+            mask = mask.tolist()
+        return ProcessColumns({attr: array(column.typecode, compress(column, mask)) if isinstance(column, array)
+                               else list(compress(column, mask)) for attr, column in self.columns.items()})
+
+    def where(self, attr: str, condition: Callable[[Any], bool]) -> 'ProcessColumns':
+        """Returns the processes whose attribute value passes the condition
+
+        > columns.where('name', lambda name: name.startswith('chrome'))
+        """
+        return self.filter([condition(value) for value in self.columns[attr]])
+
+    def group_by(self, key_attr: str, value_attr: str = None, aggregate='sum') -> Dict[Any, float]:
+        """Aggregate a column per value of another, in one pass over the two columns
+
+        :param key_attr: Column to group by (e.g. 'name')
+        :param value_attr: Column to aggregate (e.g. 'rss'). Not needed for 'count'
+        :param aggregate: One of GROUP_AGGREGATES
+        :return: Dict of {key: aggregated value}
+        """
+        if aggregate not in GROUP_AGGREGATES:
+            raise ValueError(f'Unsupported aggregate "{aggregate}". Use one of {GROUP_AGGREGATES}')
+        values = repeat(1) if aggregate == 'count' else self.columns[value_attr]
+        pick = {'min': min, 'max': max}.get(aggregate)
+        results = {}
+        counts = {}
+        for key, value in zip(self.columns[key_attr], values):
+            if key in results:
+                results[key] = pick(results[key], value) if pick else results[key] + value
+                counts[key] += 1
+            else:
+                results[key] = value
+                counts[key] = 1
+        if aggregate == 'mean':
+            return {key: total / counts[key] for key, total in results.items()}
+        return results
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """Returns the columns as NumPy arrays. The array columns are shared without copying, the list columns become
+         object arrays. Requires NumPy
+
+        :return: Dict of {attribute: numpy.ndarray}
+        """
+        if numpy is None:
+            raise ImportError('ProcessColumns.to_numpy requires the "numpy" package')
+        return {attr: numpy.frombuffer(column, dtype=column.typecode) if isinstance(column, array)
+                else numpy.array(column, dtype=object) for attr, column in self.columns.items()}
+
+    def to_dicts(self) -> List[dict]:
+        """Returns a dict per process, like get_all_running_processes without columnar"""
+        attrs = list(self.columns)
+        return [dict(zip(attrs, values)) for values in zip(*self.columns.values())]
+
+
+def get_all_running_processes(attrs_filter=('pid', 'name'), columnar=False):
     """The function returns information on all currently running processes
 
     :param attrs_filter: List of attribute that will be returned for each process. Pass empty to get all attributes.
         Example attributes: 'name', 'pid', 'ppid', 'cmdline', 'cpu_num', 'open_files', 'threads', 'uids', 'username'.
         For a list of all available attributes see: https://psutil.readthedocs.io/en/latest/#psutil.Process.as_dict
+    :param columnar: Return a ProcessColumns (parallel columns, with group by and filter helpers) instead of a
+        dict per process. Supports the 'rss' and 'vms' attributes too
     :return: List of Dictionaries, each representing the requested attributes of the running process
     """
+    if columnar:
+        return ProcessColumns.collect(attrs_filter)
     if not attrs_filter:
         attrs_filter = ()
+    if LINUX_PROC and attrs_filter and LINUX_PROC_ATTRS.issuperset(attrs_filter):
+        return list(linux_proc.iter_processes(attrs_filter))
     return [process.info for process in psutil.process_iter(attrs_filter)]
+
+
+class RingBuffer(object):
+    """A fixed size, array backed buffer of numbers. Once full, every append overwrites the oldest value, so the
+     memory use is bounded regardless of how many values are appended"""
+
+    def __init__(self, size: int, typecode='d'):
+        """
+        :param size: Maximal number of values kept
+        :param typecode: array typecode of the values (see the array module)
+        """
+        self.values = array(typecode, [0]) * size
+        self.size = size
+        self.count = 0  # Total values appended
+        self.index = 0  # Position of the next append
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __iter__(self) -> Iterator:
+        """Yields the kept values, oldest first"""
+        if self.count > self.size:
+            yield from self.values[self.index:]
+        yield from self.values[:self.index]
+
+    def append(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count += 1
+
+    def last(self):
+        """Returns the newest value, None if the buffer is empty"""
+        return self.values[self.index - 1] if self.count else None
+
+    def to_list(self) -> list:
+        return list(self)
+
+
+class _MonitoredProcess(object):
+    """The ring buffered samples of a single monitored process (or of the monitored processes total)"""
+
+    def __init__(self, pid: int, name: str, samples: int, process: psutil.Process = None):
+        self.pid = pid
+        self.name = name
+        self.process = process
+        self.exited_at = None
+        self.times = RingBuffer(samples)
+        self.metrics = {metric: RingBuffer(samples) for metric in MONITOR_METRICS}
+        self.last_counters = None  # (monotonic time, cpu seconds, read bytes, write bytes) of the previous sample
+
+    def append(self, timestamp: float, values: dict):
+        self.times.append(timestamp)
+        for metric, ring in self.metrics.items():
+            ring.append(values.get(metric, 0))
+
+    def get_series(self) -> dict:
+        series = {metric: ring.to_list() for metric, ring in self.metrics.items()}
+        series['time'] = self.times.to_list()
+        return series
+
+    def get_summary(self) -> dict:
+        times = self.times.to_list()
+        summary = {'pid': self.pid, 'name': self.name, 'running': self.exited_at is None, 'exited_at': self.exited_at,
+                   'samples': self.times.count, 'first_time': times[0] if times else None,
+                   'last_time': times[-1] if times else None}
+        for metric, ring in self.metrics.items():
+            values = ring.to_list()
+            if not values:
+                summary[metric] = {'min': 0, 'max': 0, 'mean': 0, 'last': 0, 'max_time': None}
+                continue
+            peak_index = max(range(len(values)), key=values.__getitem__)
+            summary[metric] = {'min': min(values), 'max': values[peak_index], 'mean': sum(values) / len(values),
+                               'last': values[-1], 'max_time': times[peak_index]}
+        return summary
+
+
+class ProcessMonitor(object):
+    """Samples the resource use (cpu percent, rss, threads, open fds / handles and io rates) of a set of processes
+     at a fixed interval, on a background thread. Every process keeps its last `samples` samples in fixed size ring
+     buffers, so the memory use is bounded regardless of the run length. The sum of all the monitored processes is
+     kept as the 'total' series.
+     When monitoring by name, processes started later with that name are picked up by checking only the pids that
+     are new since the previous sample
+
+    > with ProcessMonitor(process_name='chrome', interval=0.5) as monitor:
+    >     run_the_test()
+    > monitor.get_summary()['total']['rss']['max']
+    > monitor.get_peaks('cpu_percent', threshold=90)
+    """
+    INTERVAL = 1  # Seconds between samples
+    SAMPLES = 600  # Samples kept per process
+    MAX_EXITED_PROCESSES = 64  # Exited processes whose samples are kept, the oldest are dropped first
+
+    def __init__(self, pids: List[int] = None, process_name='', interval=None, samples=None):
+        """
+        :param pids: Pids of the processes to monitor
+        :param process_name: Monitor all the processes with this name (case insensitive, path is ignored), including
+         the ones started after the monitor
+        :param interval: Seconds between samples
+        :param samples: Samples kept per process
+        """
+        assert pids or process_name, 'Pids or a process name to monitor must be given'
+        self.process_name = os.path.basename(process_name).lower()
+        self.interval = interval or self.INTERVAL
+        self.samples = samples or self.SAMPLES
+        self.lock = threading.Lock()
+        self.processes: Dict[int, _MonitoredProcess] = {}
+        self.exited = deque(maxlen=self.MAX_EXITED_PROCESSES)
+        self.total = _MonitoredProcess(0, 'total', self.samples)
+        self.known_pids = set()
+        self.overhead = {'ticks': 0, 'cpu_seconds': 0.0, 'wall_seconds': 0.0, 'max_tick_seconds': 0.0}
+        self.started_at = None
+        self.stopped_at = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        if self.process_name:
+            self.known_pids = set(psutil.pids())
+            pids = list(pids or ()) + [p.pid for p in ProcessHandler.get_processes_by_name(self.process_name)]
+        for proc in get_process_objects(list(dict.fromkeys(pids))):
+            self._add_process(proc)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _add_process(self, proc: psutil.Process):
+        try:
+            name = proc.name()
+        except psutil.Error:
+            name = ''
+        self.processes[proc.pid] = _MonitoredProcess(proc.pid, name, self.samples, process=proc)
+
+    def _find_new_processes(self):
+        """Add the processes with the monitored name among the pids that are new since the previous check"""
+        current_pids = set(psutil.pids())
+        for pid in current_pids - self.known_pids:
+            try:
+                proc = psutil.Process(pid)
+                if proc.name().lower() == self.process_name:
+                    self._add_process(proc)
+            except (AccessDenied, psutil.NoSuchProcess):
+                pass
+        self.known_pids = current_pids
+
+    @staticmethod
+    def _read_counters(proc: psutil.Process) -> Tuple[dict, tuple]:
+        """Returns the sampled values of a process and its cumulative (cpu, io) counters"""
+        with proc.oneshot():
+            if proc.status() == psutil.STATUS_ZOMBIE:  # Exited, but not reaped by its parent yet
+                raise psutil.ZombieProcess(proc.pid)
+            cpu_times = proc.cpu_times()
+            values = {'rss': proc.memory_info().rss, 'threads': proc.num_threads()}
+            try:
+                values['fds'] = proc.num_fds() if hasattr(proc, 'num_fds') else proc.num_handles()
+            except AccessDenied:
+                values['fds'] = 0
+            try:
+                io = proc.io_counters()  # Not available on macOS
+                read_bytes, write_bytes = io.read_bytes, io.write_bytes
+            except (AccessDenied, AttributeError):
+                read_bytes = write_bytes = 0
+        return values, (time.monotonic(), cpu_times.user + cpu_times.system, read_bytes, write_bytes)
+
+    def sample(self):
+        """Take one sample of all the monitored processes now. Called by the background thread every interval"""
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        timestamp = time.time()
+        with self.lock:
+            if self.process_name:
+                self._find_new_processes()
+            totals = dict.fromkeys(MONITOR_METRICS, 0)
+            for pid, monitored in list(self.processes.items()):
+                try:
+                    values, counters = self._read_counters(monitored.process)
+                except psutil.NoSuchProcess:
+                    monitored.exited_at = timestamp
+                    self.exited.append(self.processes.pop(pid))
+                    continue
+                except AccessDenied:
+                    continue
+                if monitored.last_counters:
+                    elapsed = counters[0] - monitored.last_counters[0] or 1e-9
+                    values['cpu_percent'] = (counters[1] - monitored.last_counters[1]) / elapsed * 100
+                    values['read_rate'] = (counters[2] - monitored.last_counters[2]) / elapsed
+                    values['write_rate'] = (counters[3] - monitored.last_counters[3]) / elapsed
+                monitored.last_counters = counters
+                monitored.append(timestamp, values)
+                for metric in MONITOR_METRICS:
+                    totals[metric] += values.get(metric, 0)
+            self.total.append(timestamp, totals)
+            tick_seconds = time.perf_counter() - start_wall
+            self.overhead['ticks'] += 1
+            self.overhead['cpu_seconds'] += time.thread_time() - start_cpu
+            self.overhead['wall_seconds'] += tick_seconds
+            self.overhead['max_tick_seconds'] = max(self.overhead['max_tick_seconds'], tick_seconds)
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                self.sample()
+            except Exception as ex:
+                logger.error(f'Process monitor sample failed: {ex}')
+            next_time += self.interval
+            delay = next_time - time.monotonic()
+            if delay < 0:  # A sample took longer than the interval. Skip the missed ticks instead of bursting
+                next_time = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def start(self):
+        """Start sampling on a background (daemon) thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._thread = threading.Thread(target=self._run, name='ProcessMonitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling. The collected samples are kept"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.stopped_at = time.time()
+
+    def _get_monitored(self, pid) -> _MonitoredProcess:
+        if pid == 'total':
+            return self.total
+        if pid in self.processes:
+            return self.processes[pid]
+        for monitored in reversed(self.exited):
+            if monitored.pid == pid:
+                return monitored
+        raise KeyError(f'Process {pid} is not monitored')
+
+    def get_series(self, pid='total') -> dict:
+        """Returns the kept samples of a process, oldest first
+
+        :param pid: Pid of a monitored process, or 'total' for the sum of all the monitored processes
+        :return: Dict of {'time': [timestamps], metric: [values]} for every metric in MONITOR_METRICS
+        """
+        with self.lock:
+            return self._get_monitored(pid).get_series()
+
+    def get_summary(self) -> Dict:
+        """Returns the summary of the kept samples of every monitored process (running and exited) and their total
+
+        :return: Dict of {pid or 'total': {'pid', 'name', 'running', 'samples', ..., metric: {'min', 'max', 'mean',
+         'last', 'max_time'}}}. Exited processes whose pid was reused are listed under the latest one only
+        """
+        with self.lock:
+            summary = {monitored.pid: monitored.get_summary() for monitored in self.exited}
+            summary.update({pid: monitored.get_summary() for pid, monitored in self.processes.items()})
+            summary['total'] = self.total.get_summary()
+        return summary
+
+    def get_peaks(self, metric: str, threshold: float, pid='total') -> List[dict]:
+        """Returns the periods in which a metric was above the threshold, with the peak value of each period
+
+        :param metric: One of MONITOR_METRICS
+        :param threshold: Value the metric must exceed
+        :param pid: Pid of a monitored process, or 'total' for the sum of all the monitored processes
+        :return: List of {'start': timestamp, 'end': timestamp, 'samples': int, 'peak': value, 'peak_time': timestamp}
+        """
+        series = self.get_series(pid)
+        peaks = []
+        current = None
+        for timestamp, value in zip(series['time'], series[metric]):
+            if value <= threshold:
+                current = None
+                continue
+            if not current:
+                current = {'start': timestamp, 'end': timestamp, 'samples': 0, 'peak': value, 'peak_time': timestamp}
+                peaks.append(current)
+            current['end'] = timestamp
+            current['samples'] += 1
+            if value > current['peak']:
+                current['peak'], current['peak_time'] = value, timestamp
+        return peaks
+
+    def get_overhead(self) -> dict:
+        """Returns the cost of the sampling itself: ticks, the sampler thread cpu and wall seconds, the slowest tick
+         and the sampler cpu use as a percent of the monitoring time"""
+        with self.lock:
+            overhead = dict(self.overhead)
+        end_time = self.stopped_at or time.time()
+        run_seconds = end_time - self.started_at if self.started_at else 0
+        overhead['cpu_percent'] = overhead['cpu_seconds'] / run_seconds * 100 if run_seconds else 0
+        overhead['processes'] = len(self.processes)
+        return overhead
+
+
+class ProcessEventWatch(object):
+    """Iterator of the events of a change feed subscription that was made when the watch was created (see
+     ProcessChangeFeed.watch), so no event is missed between the call and the iteration. The subscription is removed
+     when the iteration ends, on close or at the end of a with block"""
+
+    def __init__(self, feed: 'ProcessChangeFeed', process_name='', pids: List[int] = None, kinds=EVENT_KINDS,
+                 timeout=None):
+        self.feed = feed
+        self.token = None
+        self.events = queue.Queue()
+        self.end_time = time.monotonic() + timeout if timeout is not None else None
+        self.token = feed.subscribe(self.events.put, process_name=process_name, pids=pids, kinds=kinds)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> ProcessEvent:
+        if self.token is None:
+            raise StopIteration
+        remaining = self.end_time - time.monotonic() if self.end_time is not None else None
+        try:
+            if remaining is not None and remaining <= 0:
+                raise queue.Empty
+            return self.events.get(timeout=remaining)
+        except queue.Empty:
+            self.close()
+            raise StopIteration
+
+    def close(self):
+        """Remove the subscription"""
+        token, self.token = self.token, None
+        if token is not None:
+            self.feed.unsubscribe(token)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class ProcessChangeFeed(object):
+    """Detects process starts and exits by diffing consecutive scans of the process table, keyed by
+     (pid, create_time) so a reused pid is reported as an exit and a start. A single poller thread scans once per
+     interval for all the subscribers, so many watchers cost one scan per interval. The thread runs only while
+     there are subscribers. On Linux a scan reads only /proc/<pid>/stat of every process
+
+    > token = default_change_feed.subscribe(print, process_name='chrome')
+    > ...
+    > default_change_feed.unsubscribe(token)
+    > with default_change_feed.watch(process_name='setup.exe', kinds=('exited',), timeout=60) as events:
+    >     for event in events:
+    >         logger.info(f'{event.name} ({event.pid}) exited')
+    """
+    INTERVAL = 0.5  # Seconds between scans
+
+    def __init__(self, interval=None):
+        """
+        :param interval: Seconds between scans
+        """
+        self.interval = interval or self.INTERVAL
+        self.lock = threading.RLock()
+        self.subscribers: Dict[int, Tuple[Callable[[ProcessEvent], Any], str, Optional[set], Tuple[str, ...]]] = {}
+        self.processes: Optional[Dict[Tuple[int, float], Tuple[str, int]]] = None  # The last scan, None before any
+        self.boot_time = linux_proc.get_boot_time() if LINUX_PROC else 0
+        self.scans = 0
+        self._next_token = 0
+        self._stop_event = None
+        self._thread = None
+
+    def _scan(self) -> Dict[Tuple[int, float], Tuple[str, int]]:
+        """Returns {(pid, create_time): (name, ppid)} of the running processes. Zombies (exited but not reaped by
+         their parent yet) are left out. The names of the processes known from the previous scan are reused"""
+        previous = self.processes or {}
+        processes = {}
+        if LINUX_PROC:
+            for pid, comm, state, ppid, start_ticks in linux_proc.iter_stats():
+                if state == 'Z':
+                    continue
+                key = (pid, linux_proc.get_create_time(start_ticks, self.boot_time))
+                known = previous.get(key)
+                processes[key] = (known[0] if known else linux_proc.get_full_name(pid, comm), ppid)
+            return processes
+        for proc in psutil.process_iter(['name', 'ppid', 'create_time', 'status'], ad_value=None):
+            if proc.info['status'] == psutil.STATUS_ZOMBIE:
+                continue
+            processes[(proc.pid, proc.info['create_time'] or 0.0)] = (proc.info['name'] or '', proc.info['ppid'])
+        return processes
+
+    def poll(self) -> List[ProcessEvent]:
+        """Scan the process table once, diff it against the previous scan and dispatch the events to the matching
+         subscribers. Called by the poller thread every interval. The first scan only sets the baseline
+
+        :return: List of the detected events, exits first
+        """
+        with self.lock:
+            timestamp = time.time()
+            processes = self._scan()
+            self.scans += 1
+            previous, self.processes = self.processes, processes
+            if previous is None:
+                return []
+            events = [ProcessEvent('exited', pid, create_time, name, ppid, timestamp)
+                      for (pid, create_time), (name, ppid) in previous.items() if (pid, create_time) not in processes]
+            events += [ProcessEvent('started', pid, create_time, name, ppid, timestamp)
+                       for (pid, create_time), (name, ppid) in processes.items() if (pid, create_time) not in previous]
+            subscribers = list(self.subscribers.values())
+        for event in events:
+            for callback, process_name, pids, kinds in subscribers:
+                if event.kind not in kinds or (pids and event.pid not in pids) or \
+                        (process_name and event.name.lower() != process_name):
+                    continue
+                try:
+                    callback(event)
+                except Exception as ex:
+                    logger.error(f'Process change feed subscriber failed on {event}: {ex}')
+        return events
+
+    def _run(self, stop_event: threading.Event):
+        while not stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as ex:
+                logger.error(f'Process change feed scan failed: {ex}')
+
+    def subscribe(self, callback: Callable[[ProcessEvent], Any], process_name='', pids: List[int] = None,
+                  kinds=EVENT_KINDS) -> int:
+        """Call the callback (on the poller thread) with every matching event. Starts the poller thread if needed
+
+        :param callback: Function getting a ProcessEvent
+        :param process_name: Only events of processes with this name (case insensitive, path is ignored)
+        :param pids: Only events of these pids
+        :param kinds: Event kinds to get, of EVENT_KINDS
+        :return: Subscription token for unsubscribe
+        """
+        with self.lock:
+            if not self._thread:
+                self.processes = None  # A baseline from before the feed stopped would report stale changes
+                self.poll()  # The baseline, so the changes from now on are reported
+                self._stop_event = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop_event,), name='ProcessChangeFeed',
+                                                daemon=True)
+                self._thread.start()
+            self._next_token += 1
+            self.subscribers[self._next_token] = (callback, os.path.basename(process_name).lower(),
+                                                  set(pids) if pids else None, tuple(kinds))
+            return self._next_token
+
+    def unsubscribe(self, token: int):
+        """Remove a subscription. The poller thread stops with the last subscription"""
+        with self.lock:
+            self.subscribers.pop(token, None)
+            if self.subscribers or not self._thread:
+                return
+            thread, self._thread = self._thread, None
+            self._stop_event.set()
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def watch(self, process_name='', pids: List[int] = None, kinds=EVENT_KINDS, timeout=None) -> ProcessEventWatch:
+        """Subscribe right away and return an iterator of the matching events, which yields them as they are
+         detected until the timeout passed or it is closed. Events from the call on are kept for the iteration
+
+        :param process_name: Only events of processes with this name (case insensitive, path is ignored)
+        :param pids: Only events of these pids
+        :param kinds: Event kinds to get, of EVENT_KINDS
+        :param timeout: Seconds to watch, from the call. None to watch until the iterator is closed
+        :return: ProcessEventWatch, an iterator of ProcessEvent and a context manager closing it
+        """
+        return ProcessEventWatch(self, process_name=process_name, pids=pids, kinds=kinds, timeout=timeout)
+
+    def wait_for(self, kind: str, process_name='', pids: List[int] = None, timeout=None) -> Optional[ProcessEvent]:
+        """Returns the first matching event, None if none was detected within the timeout
+
+        :param kind: 'started' or 'exited'
+        :param process_name: Wait for a process with this name (case insensitive, path is ignored)
+        :param pids: Wait for one of these pids
+        :param timeout: Seconds to wait. None to wait forever
+        :return: ProcessEvent or None
+        """
+        with self.watch(process_name=process_name, pids=pids, kinds=(kind,), timeout=timeout) as events:
+            return next(events, None)
+
+
+default_change_feed = ProcessChangeFeed()  # Process wide feed, shared by all the watchers
@@ -0,0 +1,282 @@
+import os
+import sys
+import time
+import shlex
+import signal
+import threading
+import subprocess
+import psutil
+from typing import Dict, List, Optional, Union
+from pybenutils.os_operations.process import kill_process_tree
+from pybenutils.utils_logger.config_logger import get_logger
+
+logger = get_logger()
+
+KILL_GRACE = 3  # Seconds a timed out command gets to exit after SIGTERM, before it is killed
+RSS_UNITS = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+
+
+class RunResult(subprocess.CompletedProcess):
+    """subprocess.CompletedProcess with the cost of the run. user_time, system_time and max_rss are None where
+     they are not available (Windows). On Linux the max_rss of a child is never below the rss its parent had when it
+     was spawned, since the kernel counts the memory of the forked child before exec too"""
+
+    def __init__(self, args, returncode, stdout=None, stderr=None, wall_time=0.0, user_time=None, system_time=None,
+                 max_rss=None, timed_out=False):
+        super().__init__(args, returncode, stdout=stdout, stderr=stderr)
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss  # Bytes
+        self.timed_out = timed_out
+
+    def __repr__(self):
+        return (f'RunResult(args={self.args!r}, returncode={self.returncode}, wall_time={self.wall_time:.3f}, '
+                f'user_time={self.user_time}, system_time={self.system_time}, max_rss={self.max_rss}, '
+                f'timed_out={self.timed_out})')
+
+
+def get_command_key(cmd: Union[str, List[str]]) -> str:
+    """Returns the statistics key of a command: the executable name, with the module of "python -m <module>" runs
+
+    > get_command_key([sys.executable, '-m', 'pip', 'install', 'requests'])  # 'python -m pip'
+    """
+    try:
+        tokens = shlex.split(cmd) if isinstance(cmd, str) else [str(token) for token in cmd]
+    except ValueError:  # Unbalanced quotes
+        tokens = cmd.split()
+    if not tokens:
+        return ''
+    key = os.path.basename(tokens[0])
+    if len(tokens) > 2 and tokens[1] == '-m':
+        key += f' -m {tokens[2]}'
+    return key
+
+
+class RunStats(object):
+    """Thread safe per command statistics of the runs (see get_command_key)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands: Dict[str, dict] = {}
+
+    def record(self, key: str, result: RunResult):
+        with self.lock:
+            stats = self.commands.setdefault(key, {'count': 0, 'failed': 0, 'timed_out': 0, 'wall_time': 0.0,
+                                                   'max_wall_time': 0.0, 'user_time': 0.0, 'system_time': 0.0,
+                                                   'max_rss': 0})
+            stats['count'] += 1
+            stats['failed'] += 1 if result.returncode else 0
+            stats['timed_out'] += 1 if result.timed_out else 0
+            stats['wall_time'] += result.wall_time
+            stats['max_wall_time'] = max(stats['max_wall_time'], result.wall_time)
+            stats['user_time'] += result.user_time or 0.0
+            stats['system_time'] += result.system_time or 0.0
+            stats['max_rss'] = max(stats['max_rss'], result.max_rss or 0)
+
+    def report(self) -> List[dict]:
+        """Returns the statistics of every command, the ones with the most total wall time first
+
+        :return: List of {'command', 'count', 'failed', 'timed_out', 'wall_time', 'max_wall_time', 'mean_wall_time',
+         'user_time', 'system_time', 'max_rss'}. Times in seconds, max_rss in bytes
+        """
+        with self.lock:
+            report = [dict(stats, command=key, mean_wall_time=stats['wall_time'] / stats['count'])
+                      for key, stats in self.commands.items()]
+        return sorted(report, key=lambda stats: stats['wall_time'], reverse=True)
+
+    def log_report(self, top=10):
+        """Write a line per command (the top ones by total wall time) to the logger"""
+        for stats in self.report()[:top]:
+            logger.info(f'{stats["command"]}: {stats["count"]} runs ({stats["failed"]} failed, {stats["timed_out"]} '
+                        f'timed out), wall {stats["wall_time"]:.2f}s (max {stats["max_wall_time"]:.2f}s), cpu user '
+                        f'{stats["user_time"]:.2f}s sys {stats["system_time"]:.2f}s, max rss '
+                        f'{stats["max_rss"] / 1024 ** 2:.1f} MB')
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+
+
+default_stats = RunStats()  # Process wide statistics of the runs
+
+
+def _get_returncode(status: int) -> int:
+    """Returns the Popen style return code of a wait status: the exit code, or -signal if the child was killed"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _wait(proc: subprocess.Popen, timeout: float = None):
+    """Wait for the child to exit and set proc.returncode. Where os.wait4 is available the child is reaped with it
+     (polling with WNOHANG, like Popen.wait polls with a timeout), and its resource usage is returned. Otherwise
+     (Windows) Popen.wait is used and None is returned
+
+    :raises subprocess.TimeoutExpired: The child is still running after timeout seconds
+    """
+    if not hasattr(os, 'wait4'):
+        proc.wait(timeout=timeout)
+        return None
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    delay = 0.0005
+    while True:
+        try:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        except ChildProcessError:  # SIGCHLD is ignored, the status and usage are lost
+            proc.returncode = 0
+            return None
+        if pid == proc.pid:
+            proc.returncode = _get_returncode(status)
+            return rusage
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(proc.args, timeout)
+            delay = min(delay, remaining)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+def _start_io_threads(proc: subprocess.Popen, input, output: dict) -> List[threading.Thread]:
+    """Feed the input to the child stdin and read its stdout and stderr into output, each in a thread, so the
+     child is never blocked on a full pipe while it is waited for"""
+    threads = []
+
+    def _write_input():
+        try:
+            if input:
+                proc.stdin.write(input)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def _read_output(stream_name):
+        with getattr(proc, stream_name) as stream:
+            output[stream_name] = stream.read()
+
+    if proc.stdin and input is not None:
+        threads.append(threading.Thread(target=_write_input, daemon=True))
+    for stream_name in ('stdout', 'stderr'):
+        if getattr(proc, stream_name):
+            threads.append(threading.Thread(target=_read_output, args=(stream_name,), daemon=True))
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def _stop_process(proc: subprocess.Popen, in_group: bool, kill_grace=KILL_GRACE):
+    """Stop the child with all its processes: SIGTERM, then SIGKILL after kill_grace seconds. A child started in its
+     own process group is stopped with the whole group (including the descendants that left its tree), otherwise
+     with its process tree. The child is reaped with _wait. On Windows the process tree is stopped instead
+
+    :return: The child resource usage (see _wait)
+    """
+    if sys.platform == 'win32':
+        kill_process_tree(proc.pid, term_timeout=kill_grace)
+        return _wait(proc)
+    if in_group:
+        processes = []
+    else:  # Collected before any signal, the descendants are re-parented once the child exits
+        try:
+            processes = psutil.Process(proc.pid).children(recursive=True)
+        except psutil.Error:
+            processes = []
+
+    def _signal(sig):
+        if in_group:
+            try:
+                os.killpg(proc.pid, sig)  # The child may be gone while the rest of the group is still alive
+            except (ProcessLookupError, PermissionError):
+                pass
+            return
+        if proc.returncode is None:  # Not Popen.send_signal, which polls and would reap the child without its usage
+            os.kill(proc.pid, sig)
+        for process in processes:
+            try:
+                process.send_signal(sig)
+            except psutil.Error:
+                pass
+
+    _signal(signal.SIGTERM)
+    try:
+        rusage = _wait(proc, timeout=kill_grace)
+    except subprocess.TimeoutExpired:
+        rusage = None
+    _signal(signal.SIGKILL)
+    return rusage if proc.returncode is not None else _wait(proc)
+
+
+def run(cmd: Union[str, List[str]], timeout: float = None, check=False, capture_output=False, text=False,
+        shell: bool = None, input=None, kill_grace=KILL_GRACE, new_session: bool = None, name='',
+        stats: Optional[RunStats] = default_stats, **popen_kwargs) -> RunResult:
+    """Run a command like subprocess.run, and account for its cost: wall time, user and system cpu time and max rss
+     (from os.wait4, covering the child and the descendants it waited for). With a timeout the child runs in its
+     own session (process group), so on timeout the whole group (e.g. a shell and its commands) is stopped, not only
+     the child. A new session has no controlling terminal, so commands prompting on it (sudo) need new_session=False
+
+    > result = run(['pip', 'download', 'requests'], timeout=120, capture_output=True)
+    > result.wall_time, result.user_time, result.max_rss
+    > default_stats.log_report()
+
+    :param cmd: Command, as a list or a string
+    :param timeout: Seconds to let the command run before it is stopped and TimeoutExpired is raised
+    :param check: Raise CalledProcessError on a non zero exit code
+    :param capture_output: Capture stdout and stderr
+    :param text: Decode the captured output and the input as text
+    :param shell: Run through the shell. Defaults to True for a string command
+    :param input: Data to send to the command stdin
+    :param kill_grace: Seconds the command gets to exit after SIGTERM on timeout, before it is killed
+    :param new_session: Start the command in its own session (a new process group on Windows). Defaults to True
+     when a timeout is given. Without one, the process tree of the command is stopped on timeout
+    :param name: Statistics key of the command. Defaults to get_command_key(cmd)
+    :param stats: RunStats to record the run in. None to not record it
+    :param popen_kwargs: Other subprocess.Popen arguments (cwd, env, stdout, stderr, ...)
+    :return: RunResult (a subprocess.CompletedProcess)
+    """
+    if capture_output:
+        popen_kwargs['stdout'] = popen_kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        popen_kwargs['stdin'] = subprocess.PIPE
+    new_session = timeout is not None if new_session is None else new_session
+    if new_session and sys.platform == 'win32':
+        popen_kwargs['creationflags'] = popen_kwargs.get('creationflags', 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+    elif new_session:
+        popen_kwargs['start_new_session'] = True
+    shell = isinstance(cmd, str) if shell is None else shell
+    start_time = time.perf_counter()
+    timed_out = False
+    output = {}
+    with subprocess.Popen(cmd, shell=shell, universal_newlines=text, **popen_kwargs) as proc:
+        threads = _start_io_threads(proc, input, output)
+        try:
+            rusage = _wait(proc, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            rusage = _stop_process(proc, new_session, kill_grace=kill_grace)
+        except BaseException:  # Including KeyboardInterrupt, a new session does not get the terminal signals
+            _stop_process(proc, new_session, kill_grace=0)
+            raise
+        for thread in threads:
+            thread.join()
+    stdout, stderr = output.get('stdout'), output.get('stderr')
+    wall_time = time.perf_counter() - start_time
+    result = RunResult(cmd, proc.returncode, stdout=stdout, stderr=stderr, wall_time=wall_time,
+                       user_time=rusage.ru_utime if rusage else None, system_time=rusage.ru_stime if rusage else None,
+                       max_rss=rusage.ru_maxrss * RSS_UNITS if rusage else None, timed_out=timed_out)
+    key = name or get_command_key(cmd)
+    if stats is not None:
+        stats.record(key, result)
+    logger.debug(f'{key} exited with {proc.returncode} in {wall_time:.3f}s'
+                 f'{" (timed out)" if timed_out else ""}' +
+                 (f', cpu user {rusage.ru_utime:.3f}s sys {rusage.ru_stime:.3f}s, max rss '
+                  f'{result.max_rss / 1024 ** 2:.1f} MB' if rusage else ''))
+    if timed_out:
+        raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return result
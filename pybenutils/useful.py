@@ -1,4 +1,3 @@
-import subprocess
 import sys
 
 from pybenutils.utils_logger.config_logger import get_logger
@@ -80,10 +79,13 @@ def install_pip_package_using_pip(package_path, *args):
     :param args: Extra arguments to pip install like --extra-index-url & --trusted-host
     :return: True if successful (exit code 0)
     """
+    from pybenutils.os_operations import process_runner
+
     print(f'Installing {package_path = }')
     cmd = [sys.executable, "-m", "pip", "install", package_path, "-U"] + list(args)
-    complete_proc = subprocess.run(cmd, check=False)
+    complete_proc = process_runner.run(cmd, check=False)
     if complete_proc.returncode:
         print(f"{' '.join(cmd)} failed with exit code {complete_proc.returncode}.")
         return False
+    print(f'Installed {package_path} in {complete_proc.wall_time:.1f} seconds')
     return True
@@ -0,0 +1,78 @@
+import os
+import sys
+import subprocess
+import importlib.util
+from unittest import TestCase, skipUnless
+from pybenutils.os_operations import linux_proc
+
+EXTENSION_MODULES = ('_decimal', '_sqlite3', '_bz2', '_lzma', '_ctypes', 'mmap', '_csv', '_uuid')
+CHILD_SCRIPT = '''
+import sys, importlib
+print('ready', flush=True)
+for module_name in sys.stdin.readline().split():
+    importlib.import_module(module_name)
+print('imported', flush=True)
+sys.stdin.readline()
+'''
+
+
+def get_extension_modules() -> dict:
+    """Returns {module name: file name} of the extension modules of this interpreter that are shared libraries (and
+     are not imported at the interpreter startup)"""
+    modules = {}
+    for module_name in EXTENSION_MODULES:
+        spec = importlib.util.find_spec(module_name)
+        if spec and spec.origin and spec.origin.endswith('.so'):
+            modules[module_name] = os.path.basename(spec.origin)
+    return modules
+
+
+@skipUnless(linux_proc.is_supported(), 'Requires Linux /proc')
+class ModuleLoadWatcherSuite(TestCase):
+    def setUp(self):
+        self.modules = get_extension_modules()
+        if not self.modules:
+            self.skipTest('The interpreter has no shared library extension modules to import')
+        self.child = subprocess.Popen([sys.executable, '-c', CHILD_SCRIPT], stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, text=True)
+        self.assertEqual(self.child.stdout.readline().strip(), 'ready')
+
+    def tearDown(self):
+        self.child.kill()
+        self.child.communicate()
+
+    def import_in_child(self):
+        self.child.stdin.write(' '.join(self.modules) + '\n')
+        self.child.stdin.flush()
+        self.assertEqual(self.child.stdout.readline().strip(), 'imported')
+
+    def test_reports_only_new_modules(self):
+        watcher = linux_proc.ModuleLoadWatcher(self.child.pid)
+        initial = watcher.poll()
+        self.assertIn(os.path.realpath(sys.executable), [os.path.realpath(path) for path in initial])
+        self.assertEqual(watcher.poll(), [])
+        self.import_in_child()
+        new_names = [os.path.basename(path) for path in watcher.poll()]
+        for file_name in self.modules.values():
+            self.assertIn(file_name, new_names)
+        self.assertFalse(set(new_names) & {os.path.basename(path) for path in initial})
+        self.assertEqual(len(new_names), len(set(new_names)))
+        self.assertEqual(watcher.poll(), [])
+
+    def test_find_and_wait_for_module(self):
+        watcher = linux_proc.ModuleLoadWatcher(self.child.pid)
+        module_name = next(iter(self.modules))
+        self.assertIsNone(watcher.wait_for_module(module_name, timeout=0.2, interval=0.05))
+        self.import_in_child()
+        self.assertEqual(os.path.basename(watcher.wait_for_module(module_name, timeout=5)), self.modules[module_name])
+
+    def test_watcher_is_cached_per_process(self):
+        watcher = linux_proc.get_module_watcher(self.child.pid)
+        self.assertIs(linux_proc.get_module_watcher(self.child.pid), watcher)
+        watcher.poll()
+        self.import_in_child()
+        self.assertTrue(linux_proc.get_module_watcher(self.child.pid).poll())
+        self.child.kill()
+        self.child.wait()
+        self.assertRaises(ProcessLookupError, linux_proc.get_module_watcher, self.child.pid)
+        self.assertEqual(watcher.poll(), [])
@@ -0,0 +1,19 @@
+import os
+import psutil
+from unittest import TestCase
+from pybenutils.os_operations.process import QUERY_ATTRIBUTE_COSTS, ProcessQuery
+
+
+class ProcessQuerySuite(TestCase):
+    def test_plan_order(self):
+        query = ProcessQuery(cmdline_contains='python', username='root', min_age=1, name='python', ppid=1, pid=5)
+        attributes = [attribute for attribute, _, _ in query.plan]
+        self.assertEqual(attributes[0], 'pid')
+        self.assertEqual(attributes[-1], 'cmdline')
+        self.assertEqual(attributes, sorted(attributes, key=QUERY_ATTRIBUTE_COSTS.get))
+        self.assertIn("pid == 5 and name == 'python'", repr(query))
+
+    def test_find_current_process(self):
+        query = ProcessQuery(pid=os.getpid(), cmdline_contains=psutil.Process().cmdline()[0])
+        self.assertEqual([process.pid for process in query.find()], [os.getpid()])
+        self.assertEqual(query.fetches['cmdline'], 1)
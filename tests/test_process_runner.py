@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import tempfile
+import subprocess
+from unittest import TestCase, skipUnless
+from pybenutils.os_operations import process_runner
+
+ALLOCATE_SCRIPT = '''
+import time
+data = bytearray(64 * 1024 * 1024)
+end_time = time.process_time() + 0.2
+while time.process_time() < end_time:
+    pass
+print('done')
+'''
+
+
+class ProcessRunnerSuite(TestCase):
+    def setUp(self):
+        self.stats = process_runner.RunStats()
+
+    def test_result_and_accounting(self):
+        result = process_runner.run([sys.executable, '-c', ALLOCATE_SCRIPT], capture_output=True, stats=self.stats)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout.strip(), b'done')
+        self.assertGreater(result.wall_time, 0)
+        if hasattr(os, 'wait4'):
+            self.assertGreaterEqual(result.user_time + result.system_time, 0.15)
+            self.assertGreater(result.max_rss, 64 * 1024 * 1024)
+
+    def test_check_and_input(self):
+        result = process_runner.run([sys.executable, '-c', 'import sys; print(sys.stdin.read().upper())'],
+                                    input='abc', capture_output=True, text=True, stats=self.stats)
+        self.assertEqual(result.stdout.strip(), 'ABC')
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            process_runner.run([sys.executable, '-c', 'import sys; sys.exit(3)'], check=True, stats=self.stats)
+        self.assertEqual(context.exception.returncode, 3)
+
+    @skipUnless(hasattr(os, 'killpg'), 'Requires process groups')
+    def test_timeout_kills_the_process_group(self):
+        pid_file = os.path.join(tempfile.gettempdir(), f'runner_test_{os.getpid()}.pid')
+        script = f'sleep 30 & echo $! > {pid_file}; wait'
+        start_time = time.monotonic()
+        try:
+            with self.assertRaises(subprocess.TimeoutExpired):
+                process_runner.run(script, shell=True, timeout=0.5, kill_grace=1, stats=self.stats)
+            self.assertLess(time.monotonic() - start_time, 5)
+            with open(pid_file) as pid_fd:
+                grandchild_pid = int(pid_fd.read())
+        finally:
+            if os.path.exists(pid_file):
+                os.remove(pid_file)
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:  # The killed grandchild is reaped by init
+            try:
+                os.kill(grandchild_pid, 0)
+            except ProcessLookupError:
+                break
+            time.sleep(0.05)
+        else:
+            self.fail(f'The grandchild process {grandchild_pid} survived the timeout')
+        self.assertEqual(self.stats.report()[0]['timed_out'], 1)
+
+    @skipUnless(hasattr(os, 'getsid'), 'Requires sessions')
+    def test_new_session_only_with_timeout(self):
+        script = 'import os; print(os.getsid(0))'
+        result = process_runner.run([sys.executable, '-c', script], capture_output=True, text=True, stats=self.stats)
+        self.assertEqual(int(result.stdout), os.getsid(0))
+        result = process_runner.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=30,
+                                    stats=self.stats)
+        self.assertNotEqual(int(result.stdout), os.getsid(0))
+
+    def test_stats_per_command(self):
+        for _ in range(3):
+            process_runner.run([sys.executable, '-c', 'pass'], stats=self.stats)
+        process_runner.run([sys.executable, '-c', 'import sys; sys.exit(1)'], name='failing', stats=self.stats)
+        report = {stats['command']: stats for stats in self.stats.report()}
+        self.assertEqual(report[os.path.basename(sys.executable)]['count'], 3)
+        self.assertEqual(report['failing']['failed'], 1)
+        self.assertEqual(process_runner.get_command_key([sys.executable, '-m', 'pip', 'install', 'x']),
+                         f'{os.path.basename(sys.executable)} -m pip')
@@ -0,0 +1,29 @@
+from unittest import TestCase, mock
+from pybenutils.network import ssh_transfer
+
+DIGEST = 'ab' * 32
+
+
+class RemoteHashesSuite(TestCase):
+    def get_hashes(self, output: bytes, remote_paths):
+        """Returns get_remote_hashes of the given paths, with the remote command output faked"""
+        with mock.patch.object(ssh_transfer, '_exec_with_input', return_value=(0, output)) as exec_mock:
+            hashes = ssh_transfer.get_remote_hashes(None, remote_paths)
+        self.assertEqual(exec_mock.call_args[0][2], '\0'.join(remote_paths).encode('utf-8', 'surrogateescape'))
+        return hashes
+
+    def test_plain_paths(self):
+        output = f'{DIGEST}  /tmp/a b.txt\n{DIGEST.upper()} */tmp/binary\n'.encode()
+        self.assertEqual(self.get_hashes(output, ['/tmp/a b.txt', '/tmp/binary', '/tmp/missing']),
+                         {'/tmp/a b.txt': DIGEST, '/tmp/binary': DIGEST.upper()})
+
+    def test_escaped_paths(self):
+        # sha256sum prefixes the line with a backslash and escapes the path when it has a backslash or a newline
+        output = f'\\{DIGEST}  /tmp/new\\nline\n\\{DIGEST}  /tmp/back\\\\slash\\r\n'.encode()
+        self.assertEqual(self.get_hashes(output, ['/tmp/new\nline', '/tmp/back\\slash\r']),
+                         {'/tmp/new\nline': DIGEST, '/tmp/back\\slash\r': DIGEST})
+
+    def test_undecodable_path(self):
+        remote_path = b'/tmp/caf\xe9'.decode('utf-8', 'surrogateescape')
+        self.assertEqual(self.get_hashes(f'{DIGEST}  '.encode() + b'/tmp/caf\xe9\n', [remote_path]),
+                         {remote_path: DIGEST})
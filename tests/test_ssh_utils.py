@@ -0,0 +1,41 @@
+import os
+import uuid
+import shutil
+import subprocess
+from unittest import TestCase, skipUnless
+from pybenutils.network.ssh_utils import compile_batch_script, parse_batch_output
+
+
+@skipUnless(shutil.which('sh'), 'Requires a posix shell')
+class BatchScriptSuite(TestCase):
+    def setUp(self):
+        self.token = uuid.uuid4().hex
+
+    def run_batch(self, commands, stop_on_error=False):
+        """Run the compiled batch script with the local shell and parse its output"""
+        script = compile_batch_script(commands, self.token, stop_on_error=stop_on_error)
+        result = subprocess.run(['sh', '-s'], input=script.encode(), stdout=subprocess.PIPE, check=True,
+                                env=dict(os.environ, SHELL='/bin/sh'))
+        return parse_batch_output(result.stdout, self.token, commands)
+
+    def test_results(self):
+        commands = ['echo out', 'echo err >&2; exit 3', 'printf no_newline']
+        responses = self.run_batch(commands)
+        self.assertEqual([response['ssh_stdin'] for response in responses], commands)
+        self.assertEqual([response['ssh_stdout'] for response in responses], ['out\n', '', 'no_newline'])
+        self.assertEqual([response['ssh_stderr'] for response in responses], ['', 'err\n', ''])
+        self.assertEqual([response['exit_status'] for response in responses], [0, 3, 0])
+        self.assertTrue(all(response['duration'] >= 0 for response in responses))
+
+    def test_marker_in_output(self):
+        fake_header = f'{self.token} 1 7 0 0 0\n'
+        responses = self.run_batch([f'printf "{fake_header}"', 'echo after'])
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(responses[0]['ssh_stdout'], fake_header)
+        self.assertEqual(responses[0]['exit_status'], 0)
+        self.assertEqual(responses[1]['ssh_stdout'], 'after\n')
+
+    def test_stop_on_error(self):
+        responses = self.run_batch(['echo first', 'echo failed >&2', 'echo never'], stop_on_error=True)
+        self.assertEqual([response['ssh_stdout'] for response in responses], ['first\n', ''])
+        self.assertEqual(responses[1]['ssh_stderr'], 'failed\n')